@@ -0,0 +1 @@
+default_app_config = "azure_auth.apps.AzureAuthConfig"
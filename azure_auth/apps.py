@@ -1,5 +1,54 @@
+import os
+import sys
+
 from django.apps import AppConfig
 
+MANAGEMENT_SCRIPTS = ("manage.py", "django-admin", "django-admin.py")
+
+
+def _is_management_command(argv):
+    """
+    Tells whether the process runs a management command (migrate, shell,
+    test...) rather than serving requests. The autoreloader of runserver only
+    serves requests from its child process.
+    """
+    script = argv[0] if argv else ""
+    if os.path.basename(script) not in MANAGEMENT_SCRIPTS and not script.endswith(
+        os.path.join("django", "__main__.py")
+    ):
+        return False
+    if len(argv) > 1 and argv[1] == "runserver":
+        return "--noreload" not in argv and os.environ.get("RUN_MAIN") != "true"
+    return True
+
+
+def _start_background_threads(argv):
+    """Starts the background threads of the package in web processes."""
+    from .msal_pool import warm_msal_app_pool
+    from .settings import AZURE_AUTH
+
+    if _is_management_command(argv):
+        return
+    if AZURE_AUTH.get("MSAL_WARM_ON_STARTUP"):
+        warm_msal_app_pool()
+
+    if interval := AZURE_AUTH.get("TOKEN_REFRESH_INTERVAL"):
+        from .token_refresh import get_token_refresher
+
+        get_token_refresher().start(interval)
+
 
 class AzureAuthConfig(AppConfig):
     name = "azure_auth"
+
+    def ready(self):
+        from django.conf import settings
+        from django.db.models.signals import post_delete, post_save
+
+        from .backends import _invalidate_on_change
+
+        # Cached user snapshots are versioned by these saves, see CachedUserBackend
+        post_save.connect(_invalidate_on_change, sender=settings.AUTH_USER_MODEL)
+        post_delete.connect(_invalidate_on_change, sender=settings.AUTH_USER_MODEL)
+
+        _start_background_threads(sys.argv)
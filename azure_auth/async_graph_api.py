@@ -0,0 +1,308 @@
+import asyncio
+import weakref
+from urllib.parse import urlparse, parse_qs
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ImproperlyConfigured
+
+from .graph_api import GraphApi, GraphApiError, _GraphApiUser
+from .metrics import span
+from .resilience import CircuitOpenResponse, endpoint_key, get_resilience
+from .settings import AZURE_AUTH
+from .singleflight import graph_single_flight, request_key
+from .tokens import get_app_token_store
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+# Clients and semaphores are bound to the event loop they were created in
+_loop_state = weakref.WeakKeyDictionary()
+
+
+class _LoopState:
+    def __init__(self):
+        if httpx is None:
+            raise ImproperlyConfigured("AsyncGraphApi requires the 'httpx' package")
+        self.client = httpx.AsyncClient(
+            headers={"Accept-Encoding": "gzip, deflate"},
+            limits=httpx.Limits(
+                max_connections=AZURE_AUTH.get("HTTP_POOL_MAXSIZE"),
+                max_keepalive_connections=AZURE_AUTH.get("HTTP_POOL_MAXSIZE"),
+            ),
+            timeout=httpx.Timeout(
+                AZURE_AUTH.get("HTTP_READ_TIMEOUT"),
+                connect=AZURE_AUTH.get("HTTP_CONNECT_TIMEOUT"),
+            ),
+        )
+        self.semaphore = asyncio.Semaphore(AZURE_AUTH.get("ASYNC_MAX_CONCURRENCY"))
+        self.token_lock = asyncio.Lock()
+
+
+def _get_loop_state() -> _LoopState:
+    loop = asyncio.get_running_loop()
+    state = _loop_state.get(loop)
+    if state is None:
+        state = _loop_state[loop] = _LoopState()
+    return state
+
+
+async def close_loop_client():
+    """
+    Closes the pooled client of the running event loop. Loops that end with
+    the request, as the one asgiref runs an async view in under WSGI, must
+    close it or leak its connections.
+    """
+    state = _loop_state.pop(asyncio.get_running_loop(), None)
+    if state is not None:
+        await state.client.aclose()
+
+
+def _invalidate_written(url):
+    from .response_cache import get_response_cache, url_tags
+
+    get_response_cache().invalidate(*url_tags(url))
+
+
+class AsyncGraphApi:
+    """
+    Asyncio counterpart of GraphApi. Shares the app-only token with GraphApi
+    and uses one pooled `httpx.AsyncClient` per event loop, with at most
+    ASYNC_MAX_CONCURRENCY requests in flight.
+    """
+
+    SCOPE = GraphApi.SCOPE
+    ENDPOINT = GraphApi.ENDPOINT
+
+    def __init__(self, client=None):
+        self.tokens = get_app_token_store(AsyncGraphApi.SCOPE)
+        self._client = client
+        self._users_api = _AsyncGraphApiUser(self)
+
+    async def token(self):
+        if token := self.tokens.peek():
+            return token
+        # Only one task per loop waits on a thread for a refresh
+        async with _get_loop_state().token_lock:
+            return await sync_to_async(self.tokens.get_token, thread_sensitive=False)()
+
+    async def auth_header(self):
+        return {"Authorization": "Bearer " + await self.token()}
+
+    @property
+    def user(self):
+        return self._users_api
+
+    async def request(self, method, url, **kwargs):
+        with span("graph_request", endpoint=endpoint_key(method, url)):
+            if method.upper() == "GET" and AZURE_AUTH.get("GRAPH_COALESCE"):
+                # Concurrent identical reads of the loop share one request
+                key = request_key(method, url, kwargs.get("params"))
+                return await graph_single_flight.ado(
+                    key, lambda: self._request(method, url, **kwargs)
+                )
+            res = await self._request(method, url, **kwargs)
+            if AZURE_AUTH.get("GRAPH_CACHE") and res.status_code < 400:
+                # Drops the responses cached by GraphApi, as its CachingTransport does
+                await sync_to_async(_invalidate_written, thread_sensitive=False)(url)
+            return res
+
+    async def _request(self, method, url, **kwargs):
+        state = _get_loop_state()
+        client = self._client or state.client
+        headers = {**kwargs.pop("headers", {}), **await self.auth_header()}
+        if not AZURE_AUTH.get("GRAPH_RESILIENCE"):
+            async with state.semaphore:
+                return await client.request(method, url, headers=headers, **kwargs)
+
+        resilience = get_resilience()
+        endpoint = endpoint_key(method, url)
+        attempt = 0
+        while True:
+            if not resilience.breaker(endpoint).allow():
+                resilience.record_rejected(endpoint)
+                return CircuitOpenResponse(endpoint)
+            if wait := resilience.acquire():
+                await asyncio.sleep(wait)
+            res = error = None
+            try:
+                async with state.semaphore:
+                    res = await client.request(method, url, headers=headers, **kwargs)
+            except httpx.TransportError as e:
+                error = e
+            finally:
+                # Recorded whatever happened, to resolve the trial of a half open breaker
+                resilience.record(
+                    endpoint, status=getattr(res, "status_code", None), error=error
+                )
+            if res is None:
+                delay = resilience.retry_delay(attempt, method, error=error)
+                if delay is None:
+                    raise error
+            else:
+                delay = resilience.retry_delay(
+                    attempt, method, status=res.status_code, headers=res.headers
+                )
+                if delay is None:
+                    return res
+            resilience.record_retry(endpoint)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def custom(self, url):
+        """
+        Calls a custom url using 'v1.0' endpoint and returns a json response
+        :param url: The url to call.
+        :return: parsed json response
+        """
+        return (await self.request("GET", f"{AsyncGraphApi.ENDPOINT}{url}")).json()
+
+    async def beta(self, url):
+        """
+        Calls a custom url using 'beta' endpoint and returns a json response
+        :param url: The url to call.
+        :return: parsed json response
+        """
+        return (
+            await self.request("GET", f"https://graph.microsoft.com/beta{url}")
+        ).json()
+
+
+class _AsyncGraphApiUser:
+    LIST_SELECT = _GraphApiUser.LIST_SELECT
+
+    def __init__(self, api: AsyncGraphApi):
+        self.api = api
+
+    async def get(self, email):
+        return (
+            await self.api.request("GET", f"{GraphApi.ENDPOINT}/users/{email}")
+        ).json()
+
+    async def list(self):
+        return (
+            await self.api.request(
+                "GET",
+                f"{GraphApi.ENDPOINT}/users?$select=givenName,surname,jobTitle,id,"
+                f"userPrincipalName",
+            )
+        ).json()
+
+    async def list_page(
+        self, select=LIST_SELECT, filter=None, page_size=100, cursor=None
+    ):
+        """Async version of `_GraphApiUser.list_page`."""
+        params = {"$select": ",".join(select), "$top": page_size}
+        if filter:
+            params["$filter"] = filter
+        if cursor:
+            params["$skiptoken"] = cursor
+        res = (
+            await self.api.request("GET", f"{GraphApi.ENDPOINT}/users", params=params)
+        ).json()
+        if "error" in res:
+            raise GraphApiError(res)
+        next_link = res.get("@odata.nextLink")
+        if next_link:
+            next_link = parse_qs(urlparse(next_link).query).get("$skiptoken", [None])[0]
+        return res.get("value", []), next_link
+
+    async def iter_users(self, select=LIST_SELECT, filter=None, page_size=100):
+        """Async version of `_GraphApiUser.iter_users`."""
+        cursor = None
+        while True:
+            users, cursor = await self.list_page(select, filter, page_size, cursor)
+            for user in users:
+                yield user
+            if not cursor:
+                return
+
+    async def create(
+        self,
+        username: str,
+        first_name: str,
+        last_name: str,
+        password: str,
+        job_title: str = '',
+    ):
+        if None in (username, first_name, last_name, password):
+            return False
+
+        res = await self.api.request(
+            "POST",
+            f"{GraphApi.ENDPOINT}/users",
+            json=_GraphApiUser._create_payload(
+                username, first_name, last_name, password, job_title
+            ),
+        )
+        if res.status_code == 201:
+            return True
+        else:
+            return res.json()
+
+    async def update(
+        self,
+        azure_object_id,
+        username: str,
+        first_name: str,
+        last_name: str,
+        job_title: str = None,
+    ):
+        if None in (username, first_name, last_name):
+            return False
+
+        res = await self.api.request(
+            "PATCH",
+            f"{GraphApi.ENDPOINT}/users/{azure_object_id}",
+            json=_GraphApiUser._update_payload(
+                username, first_name, last_name, job_title
+            ),
+        )
+        if res.status_code == 204:
+            return True
+        else:
+            return res.json()
+
+    async def delete(self, email):
+        res = await self.api.request("DELETE", f"{GraphApi.ENDPOINT}/users/{email}")
+        if res.status_code == 204:
+            return True
+        else:
+            return res.json()
+
+    async def exists(self, email):
+        res = await self.api.request("GET", f"{GraphApi.ENDPOINT}/users/{email}")
+        return res.status_code != 404
+
+    async def member_of(self, email):
+        return (
+            await self.api.request("GET", f"{GraphApi.ENDPOINT}/users/{email}/memberOf")
+        ).json()
+
+    async def directory_roles(self, email):
+        """Async version of `_GraphApiUser.directory_roles`."""
+        res = (
+            await self.api.request(
+                "GET",
+                f"{GraphApi.ENDPOINT}/users/{email}/memberOf/microsoft.graph.directoryRole"
+                f"?$select=id,displayName,roleTemplateId",
+            )
+        ).json()
+        if "error" in res:
+            return None
+        return res.get("value", [])
+
+    async def transitive_member_of(self, email):
+        """Async version of `_GraphApiUser.transitive_member_of`."""
+        url = (
+            f"{GraphApi.ENDPOINT}/users/{email}/transitiveMemberOf?$select=id&$top=999"
+        )
+        ids = []
+        while url:
+            res = (await self.api.request("GET", url)).json()
+            if "error" in res:
+                return None
+            ids.extend(item["id"] for item in res.get("value", []))
+            url = res.get("@odata.nextLink")
+        return ids
@@ -0,0 +1,92 @@
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.db import router, transaction
+
+from .settings import AZURE_AUTH
+
+USER_CACHE_PREFIX = "azure_auth:user:"
+
+
+def _user_cache():
+    alias = AZURE_AUTH.get("USER_CACHE")
+    return caches[alias] if alias else None
+
+
+def _version_key(pk):
+    return f"{USER_CACHE_PREFIX}version:{pk}"
+
+
+def _snapshot_key(pk):
+    return f"{USER_CACHE_PREFIX}{pk}"
+
+
+def invalidate_cached_users(*pks):
+    """
+    Gives the users a new version once the current transaction commits, so
+    their cached snapshots are no longer used. Called whenever a user is saved
+    or deleted.
+    """
+    cache = _user_cache()
+    if cache is not None and pks:
+        versions = {_version_key(pk): uuid.uuid4().hex for pk in pks}
+        transaction.on_commit(lambda: cache.set_many(versions, None))
+
+
+def _invalidate_on_change(sender, instance, **kwargs):
+    invalidate_cached_users(instance.pk)
+
+
+class CachedUserBackend(ModelBackend):
+    """
+    ModelBackend resolving the user of each authenticated request from a slim
+    snapshot kept in the USER_CACHE cache, instead of a database query.
+
+    Snapshots are tagged with a version of the user that changes on every
+    save, so a snapshot written from a row read before a save is never used.
+    Fields listed in `deferred_fields` are left out and loaded on access.
+    """
+
+    deferred_fields = ("last_login",)
+
+    def get_user(self, user_id):
+        cache = _user_cache()
+        if cache is None:
+            return super().get_user(user_id)
+
+        User = get_user_model()
+        loaded = [
+            f for f in User._meta.concrete_fields if f.name not in self.deferred_fields
+        ]
+        fields = [f.attname for f in loaded]
+        version_key, snapshot_key = _version_key(user_id), _snapshot_key(user_id)
+        cached = cache.get_many([version_key, snapshot_key])
+        version, snapshot = cached.get(version_key), cached.get(snapshot_key)
+        if snapshot is not None and version is not None and snapshot[0] == version:
+            user = User.from_db(router.db_for_read(User), fields, snapshot[1])
+            if snapshot[2] is not None:
+                user._azure_permissions = snapshot[2]
+        else:
+            if version is None:
+                # Read before the row, a concurrent save replaces it
+                cache.add(version_key, uuid.uuid4().hex, None)
+                version = cache.get(version_key)
+            try:
+                user = User._default_manager.only(*(f.name for f in loaded)).get(
+                    pk=user_id
+                )
+            except User.DoesNotExist:
+                return None
+            cache.set(
+                snapshot_key,
+                (
+                    version,
+                    [getattr(user, field) for field in fields],
+                    # The permission index of the user, saving it changes the version
+                    getattr(user, "azure_permissions", None),
+                ),
+                AZURE_AUTH.get("USER_CACHE_TTL"),
+            )
+        return user if self.user_can_authenticate(user) else None
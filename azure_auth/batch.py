@@ -0,0 +1,204 @@
+import itertools
+import time
+
+from .resilience import IDEMPOTENT_METHODS, parse_retry_after
+from .response_cache import url_tags
+
+
+class BatchRequest:
+    """A single request queued in a GraphBatch."""
+
+    def __init__(self, request_id, method, url, body=None, depends_on=None):
+        self.id = request_id
+        self.method = method
+        self.url = url
+        self.body = body
+        self.depends_on = list(depends_on or [])
+        self.status = None
+        self.headers = {}
+        self.result = None
+
+    @property
+    def done(self):
+        return self.status is not None
+
+    @property
+    def ok(self):
+        return self.status is not None and 200 <= self.status < 300
+
+    def to_json(self):
+        data = {"id": self.id, "method": self.method, "url": self.url}
+        if self.body is not None:
+            data["body"] = self.body
+            data["headers"] = {"Content-Type": "application/json"}
+        if self.depends_on:
+            data["dependsOn"] = [request.id for request in self.depends_on]
+        return data
+
+
+class GraphBatch:
+    """
+    Queues Graph requests and sends them through the JSON `$batch` endpoint,
+    at most 20 requests per envelope.
+
+    Requests chained with `depends_on` are always sent in the same envelope.
+    Sub-requests failing with a transient status are retried on their own,
+    honoring the largest `Retry-After` returned. Like the resilience layer,
+    non-idempotent requests are only retried when throttled, as Graph may
+    have applied them before failing.
+
+    Usage:
+        with api.batch() as batch:
+            request = batch.add("GET", "/users/someone@example.com")
+        request.result
+    """
+
+    MAX_REQUESTS = 20
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+
+    def __init__(self, api, max_retries=3):
+        self.api = api
+        self.max_retries = max_retries
+        self._ids = itertools.count(1)
+        self._queue = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.execute()
+
+    def add(self, method, url, body=None, depends_on=None) -> BatchRequest:
+        """
+        Queues a request.
+        :param method: The HTTP method.
+        :param url: The url relative to the 'v1.0' endpoint, e.g. '/users'.
+        :param body: An optional json body.
+        :param depends_on: BatchRequests that must complete before this one.
+        """
+        request = BatchRequest(str(next(self._ids)), method, url, body, depends_on)
+        self._queue.append(request)
+        return request
+
+    def execute(self):
+        """Sends every queued request and fills in their responses."""
+        pending, self._queue = self._queue, []
+        for attempt in range(self.max_retries + 1):
+            retry, delay = [], 0
+            for envelope in self._envelopes(pending):
+                failed, retry_after = self._send(envelope)
+                retry.extend(failed)
+                delay = max(delay, retry_after)
+            if not retry or attempt == self.max_retries:
+                return
+            time.sleep(delay or 2 ** attempt)
+            pending = retry
+
+    def _retryable(self, request, status):
+        if status == 429:
+            return True  # Graph did not process the request
+        return (
+            status in self.RETRY_STATUS and request.method.upper() in IDEMPOTENT_METHODS
+        )
+
+    def _envelopes(self, requests):
+        # Requests linked by dependsOn form a group that can not be split
+        groups, group_of = [], {}
+        for request in requests:
+            linked = [group_of[d.id] for d in request.depends_on if d.id in group_of]
+            group = linked[0] if linked else []
+            if not linked:
+                groups.append(group)
+            for other in linked[1:]:
+                if other is not group:
+                    group.extend(other)
+                    for member in other:
+                        group_of[member.id] = group
+                    other.clear()
+            group.append(request)
+            group_of[request.id] = group
+
+        envelope = []
+        for group in filter(None, groups):
+            if len(group) > self.MAX_REQUESTS:
+                raise ValueError(
+                    f"A dependsOn chain can not exceed {self.MAX_REQUESTS} requests"
+                )
+            if len(envelope) + len(group) > self.MAX_REQUESTS:
+                yield envelope
+                envelope = []
+            envelope.extend(group)
+        if envelope:
+            yield envelope
+
+    def _send(self, envelope):
+        in_envelope = {request.id for request in envelope}
+        by_id = {request.id: request for request in envelope}
+        payload = []
+        for request in envelope:
+            data = request.to_json()
+            # Dependencies that already succeeded in an earlier attempt are dropped
+            if request.depends_on:
+                data["dependsOn"] = [
+                    d.id for d in request.depends_on if d.id in in_envelope
+                ] or None
+                if not data["dependsOn"]:
+                    del data["dependsOn"]
+            payload.append(data)
+
+        res = self.api.transport.post(
+            f"{self.api.ENDPOINT}/$batch",
+            headers={**self.api.auth_header},
+            json={"requests": payload},
+        )
+        if res.status_code >= 400:
+            try:
+                error = res.json()
+            except ValueError:
+                error = None
+            for request in envelope:
+                request.status, request.result = res.status_code, error
+            retried = set()
+            for request in envelope:
+                # Requests waiting for one that is not retried are not retried either
+                if self._retryable(request, res.status_code) and all(
+                    d.id in retried for d in request.depends_on if d.id in in_envelope
+                ):
+                    retried.add(request.id)
+            failed = [request for request in envelope if request.id in retried]
+            return failed, parse_retry_after(res.headers.get("Retry-After")) or 0
+        body = res.json()
+
+        failed, retry_after = [], 0
+        for response in body.get("responses", []):
+            request = by_id[response["id"]]
+            request.status = int(response["status"])
+            request.headers = response.get("headers", {})
+            request.result = response.get("body")
+            if self._retryable(request, request.status):
+                failed.append(request)
+                retry_after = max(
+                    retry_after,
+                    parse_retry_after(request.headers.get("Retry-After")) or 0,
+                )
+        # A failed dependency (424) is retried along with the request it waits for
+        retried = {request.id for request in failed}
+        for request in envelope:
+            if request.status == 424 and any(
+                d.id in retried for d in request.depends_on
+            ):
+                failed.append(request)
+        failed.sort(key=envelope.index)
+
+        # Writes bypass the transport's response cache, invalidate it here
+        if invalidate := getattr(self.api.transport, "invalidate", None):
+            invalidate(
+                *(
+                    tag
+                    for request in envelope
+                    if request.method != "GET" and request.ok
+                    for tag in url_tags(request.url)
+                )
+            )
+        return failed, retry_after
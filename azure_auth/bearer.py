@@ -0,0 +1,266 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.contrib.auth import authenticate
+from django.contrib.auth.backends import BaseBackend
+from django.core.exceptions import ImproperlyConfigured
+from django.http import JsonResponse
+
+from .models import get_user_model
+from .settings import AZURE_AUTH
+
+try:
+    import jwt
+except ImportError:  # pragma: no cover
+    jwt = None
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidBearerToken(Exception):
+    pass
+
+
+class SigningKeysUnavailable(Exception):
+    """Raised when the signing keys of the tenant could not be fetched."""
+
+
+class JWKSCache:
+    """
+    Signing keys of the tenant, indexed by `kid`. The key set is fetched again
+    when it is older than `ttl` seconds, or when a token signed with an unknown
+    `kid` shows up (at most once every `min_refresh_interval` seconds). When a
+    refresh fails, the last key set is served and the refresh is tried again
+    after `min_refresh_interval` seconds.
+    """
+
+    def __init__(self, ttl=86400, min_refresh_interval=60):
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self._keys = {}
+        self._fetched_at = 0.0
+        self._openid_config = None
+        self._lock = threading.Lock()
+
+    @property
+    def openid_config(self):
+        if self._openid_config is None:
+            from .msal_pool import msal_app_pool
+
+            authority = AZURE_AUTH.get("AUTHORITY").rstrip("/")
+            try:
+                res = msal_app_pool.http_client.get(
+                    f"{authority}/v2.0/.well-known/openid-configuration"
+                )
+                res.raise_for_status()
+                config = json.loads(res.text)
+                if not {"issuer", "jwks_uri"} <= config.keys():
+                    raise ValueError("missing issuer or jwks_uri")
+            except (OSError, ValueError, AttributeError) as e:
+                # OSError covers the errors of requests
+                raise SigningKeysUnavailable(f"OpenID configuration: {e}")
+            self._openid_config = config
+        return self._openid_config
+
+    def get_key(self, kid):
+        age = time.time() - self._fetched_at
+        if kid not in self._keys or age > self.ttl:
+            with self._lock:
+                age = time.time() - self._fetched_at
+                if age > self.ttl or (
+                    kid not in self._keys and age > self.min_refresh_interval
+                ):
+                    self._refresh()
+        try:
+            return self._keys[kid]
+        except KeyError:
+            raise InvalidBearerToken(f"Unknown signing key '{kid}'")
+
+    def _refresh(self):
+        from .msal_pool import msal_app_pool
+
+        try:
+            # The key set itself is not cached by the discovery client
+            res = msal_app_pool.http_client.session.get(
+                self.openid_config["jwks_uri"],
+                timeout=msal_app_pool.http_client.timeout,
+            )
+            res.raise_for_status()
+            keys = {
+                jwk["kid"]: jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(jwk))
+                for jwk in res.json().get("keys", [])
+                if jwk.get("kty") == "RSA"
+            }
+        except (
+            OSError,
+            ValueError,
+            TypeError,
+            KeyError,
+            AttributeError,
+            jwt.PyJWTError,
+            SigningKeysUnavailable,
+        ) as e:
+            if not self._keys:
+                raise SigningKeysUnavailable(f"JWKS: {e}")
+            logger.warning(
+                "Could not refresh the signing keys, keeping the last ones: %s", e
+            )
+            # Tried again after min_refresh_interval
+            self._fetched_at = time.time() - max(
+                0, self.ttl - self.min_refresh_interval
+            )
+            return
+        self._keys = keys
+        self._fetched_at = time.time()
+
+
+class BearerTokenValidator:
+    """
+    Validates Azure AD access tokens locally: signature against the tenant's
+    JWKS, audience, issuer and expiry. Validated tokens are kept in a small LRU
+    until they expire, so repeated requests skip the signature check.
+    """
+
+    def __init__(self, cache_size=1024, leeway=60):
+        if jwt is None:
+            raise ImproperlyConfigured(
+                "Bearer token authentication requires the 'PyJWT[crypto]' package"
+            )
+        self.jwks = JWKSCache(ttl=AZURE_AUTH.get("BEARER_JWKS_TTL"))
+        self.cache_size = cache_size
+        self.leeway = leeway
+        self._validated = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def audiences(self):
+        client_id = AZURE_AUTH.get("CLIENT_ID")
+        return AZURE_AUTH.get("BEARER_AUDIENCES") or [client_id, f"api://{client_id}"]
+
+    @property
+    def issuers(self):
+        if issuers := AZURE_AUTH.get("BEARER_ISSUERS"):
+            return issuers
+        issuer = self.jwks.openid_config["issuer"]
+        tenant = issuer.rstrip("/").split("/")[-2]
+        # v1.0 tokens are issued by sts.windows.net
+        return [issuer, f"https://sts.windows.net/{tenant}/"]
+
+    def validate(self, token):
+        """
+        Returns the claims of a valid token, or raises InvalidBearerToken.
+        Raises SigningKeysUnavailable when the token can not be checked.
+        """
+        digest = hashlib.sha256(token.encode()).digest()
+        with self._lock:
+            cached = self._validated.get(digest)
+            if cached is not None:
+                if cached["exp"] > time.time():
+                    self._validated.move_to_end(digest)
+                    return cached
+                del self._validated[digest]
+
+        try:
+            header = jwt.get_unverified_header(token)
+            claims = jwt.decode(
+                token,
+                self.jwks.get_key(header.get("kid")),
+                algorithms=["RS256"],
+                audience=self.audiences,
+                leeway=self.leeway,
+            )
+        except jwt.PyJWTError as e:
+            raise InvalidBearerToken(str(e))
+        if "exp" not in claims or "oid" not in claims:
+            raise InvalidBearerToken("Missing 'exp' or 'oid' claim")
+        if claims.get("iss") not in self.issuers:
+            raise InvalidBearerToken("Invalid issuer")
+
+        with self._lock:
+            self._validated[digest] = claims
+            if len(self._validated) > self.cache_size:
+                self._validated.popitem(last=False)
+        return claims
+
+
+_validator = None
+_validator_lock = threading.Lock()
+
+
+def get_bearer_validator() -> BearerTokenValidator:
+    global _validator
+    if _validator is None:
+        with _validator_lock:
+            if _validator is None:
+                _validator = BearerTokenValidator(
+                    cache_size=AZURE_AUTH.get("BEARER_TOKEN_CACHE_SIZE"),
+                )
+    return _validator
+
+
+class BearerTokenBackend(BaseBackend):
+    """
+    Authenticates Azure AD access tokens, mapping the 'oid' claim to a User.
+    SigningKeysUnavailable is raised through `authenticate`.
+    """
+
+    def authenticate(self, request, bearer_token=None, **kwargs):
+        if bearer_token is None:
+            return None
+        try:
+            claims = get_bearer_validator().validate(bearer_token)
+        except InvalidBearerToken:
+            return None
+        User = get_user_model()
+        try:
+            user = User.objects.get(azure_object_id=claims["oid"])
+        except (User.DoesNotExist, ValueError):
+            return None
+        user.token_claims = claims
+        return user if user.is_active else None
+
+    def get_user(self, user_id):
+        User = get_user_model()
+        try:
+            return User.objects.get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+
+
+class BearerTokenMiddleware:
+    """
+    Authenticates requests carrying an 'Authorization: Bearer' header with
+    BearerTokenBackend. Must be placed after AuthenticationMiddleware.
+    Requests with an invalid token are answered with a 401, and with a 503
+    while the signing keys of the tenant can not be fetched.
+    """
+
+    retry_after = 30
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        header = request.META.get("HTTP_AUTHORIZATION", "")
+        if header[:7].lower() == "bearer ":
+            try:
+                user = authenticate(request, bearer_token=header[7:].strip())
+            except SigningKeysUnavailable as e:
+                logger.warning("Could not validate a bearer token: %s", e)
+                response = JsonResponse(
+                    {"error": "temporarily_unavailable"}, status=503
+                )
+                response["Retry-After"] = str(self.retry_after)
+                return response
+            if user is None:
+                response = JsonResponse({"error": "invalid_token"}, status=401)
+                response["WWW-Authenticate"] = 'Bearer error="invalid_token"'
+                return response
+            request.user = user
+            # Token authenticated requests do not need CSRF protection
+            request._dont_enforce_csrf_checks = True
+        return self.get_response(request)
@@ -0,0 +1,233 @@
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import msal
+from django.db import connections
+
+from .metrics import span
+from .settings import AZURE_AUTH
+from .token_store import NoCachedAccountError, get_token_store
+from .tokens import TokenAcquisitionError
+from .utils import _build_msal_app
+
+logger = logging.getLogger(__name__)
+
+
+class DelegatedTokens:
+    """
+    The token cache of a user, kept deserialized along with its MSAL
+    application between the GraphApi calls made on the user's behalf. Exposes
+    the `get_token` of AppTokenStore.
+    """
+
+    def __init__(self, user_id, scopes, pool):
+        self.user_id = user_id
+        self.scopes = list(scopes)
+        self.pool = pool
+        self.last_used = time.monotonic()
+        self._lock = threading.Lock()
+        self._cache = msal.SerializableTokenCache()
+        if serialized := get_token_store().load(user_id):
+            self._cache.deserialize(serialized)
+        self._app = _build_msal_app(cache=self._cache)
+        self._account = None
+        self._token = None
+        self._expires_at = 0.0
+        # Changes of the token cache, and the last one written to the token store
+        self._version = 0
+        self._saved_version = 0
+        self.discarded = False
+
+    def get_token(self):
+        token, expires_at = self._token, self._expires_at
+        # MSAL itself renews tokens expiring within 5 minutes
+        if token and expires_at - 300 > time.time():
+            return token
+        with self._lock:
+            if self._account is None:
+                accounts = self._app.get_accounts()
+                if not accounts:
+                    raise NoCachedAccountError(
+                        f"No account is cached for {self.user_id}"
+                    )
+                self._account = accounts[0]
+            with span("msal_acquire_token", flow="silent"):
+                result = self._app.acquire_token_silent_with_error(
+                    self.scopes, account=self._account
+                )
+            if not result or "access_token" not in result:
+                raise TokenAcquisitionError(result or {"error": "no_refresh_token"})
+            self._token = result["access_token"]
+            self._expires_at = time.time() + int(result.get("expires_in", 0))
+            if self._cache.has_state_changed:
+                self._cache.has_state_changed = False
+                self._version += 1
+                self.pool.mark_dirty(self)
+            return self._token
+
+    def snapshot(self):
+        """
+        Returns the token cache and its version if it changed since it was last
+        written, or None.
+        """
+        with self._lock:
+            if self._version == self._saved_version:
+                return None
+            return self._cache.serialize(), self._version
+
+    def saved(self, version):
+        """Records that the snapshot of `version` was written."""
+        with self._lock:
+            self._saved_version = max(self._saved_version, version)
+
+
+class DelegatedClientPool:
+    """
+    Bounded LRU of the DelegatedTokens of the users GraphApi is called for.
+
+    Users unused for `idle_timeout` seconds, and the least recently used ones
+    beyond `max_size`, are evicted. Token caches changed by a refresh are not
+    written at once but every `flush_interval` seconds, all together, and when
+    their user is evicted.
+    """
+
+    def __init__(self, max_size=256, idle_timeout=900, flush_interval=5):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.flush_interval = flush_interval
+        self._clients = OrderedDict()
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "writes": 0}
+
+    def get(self, user_id, scopes) -> DelegatedTokens:
+        key = (str(user_id), tuple(sorted(scopes)))
+        now = time.monotonic()
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                self._stats["hits"] += 1
+        if client is None:
+            # Loaded outside of the lock, a concurrent load of the same user wins
+            client = DelegatedTokens(user_id, scopes, self)
+            with self._lock:
+                client = self._clients.setdefault(key, client)
+                self._clients.move_to_end(key)
+                self._stats["misses"] += 1
+        client.last_used = now
+        self._evict(now)
+        return client
+
+    def discard(self, user_id):
+        """
+        Forgets the clients of a user, e.g. after its token cache was written
+        by a login. Their pending changes are dropped.
+        """
+        with self._lock:
+            for key in [k for k in self._clients if k[0] == str(user_id)]:
+                client = self._clients.pop(key)
+                client.discarded = True
+                self._dirty.pop(id(client), None)
+
+    def mark_dirty(self, client):
+        with self._lock:
+            self._dirty[id(client)] = client
+            if self._flusher is None:
+                self._flusher = threading.Thread(
+                    target=self._flush_loop, name="azure-auth-token-flush", daemon=True
+                )
+                self._flusher.start()
+
+    def flush(self):
+        """
+        Writes the changed token caches to the token store. Clients whose write
+        failed stay dirty and are written by the next flush.
+        """
+        with self._lock:
+            dirty, self._dirty = list(self._dirty.values()), {}
+        snapshots = {}
+        for client in dirty:
+            if (snapshot := client.snapshot()) is not None:
+                snapshots[client] = snapshot
+        if not snapshots:
+            return 0
+        try:
+            get_token_store().save_many(
+                {client.user_id: data for client, (data, _) in snapshots.items()}
+            )
+        except Exception:
+            with self._lock:
+                for client in snapshots:
+                    # A discarded client would overwrite a newer token cache
+                    if not client.discarded:
+                        self._dirty.setdefault(id(client), client)
+            raise
+        for client, (_, version) in snapshots.items():
+            client.saved(version)
+        with self._lock:
+            self._stats["writes"] += len(snapshots)
+        return len(snapshots)
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "clients": len(self._clients)}
+
+    def _evict(self, now):
+        evicted = []
+        with self._lock:
+            while self._clients:
+                key, client = next(iter(self._clients.items()))
+                if (
+                    len(self._clients) <= self.max_size
+                    and now - client.last_used < self.idle_timeout
+                ):
+                    break
+                del self._clients[key]
+                evicted.append(client)
+                self._stats["evictions"] += 1
+        if evicted and any(id(client) in self._dirty for client in evicted):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Could not write the delegated token caches")
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Could not write the delegated token caches")
+            finally:
+                connections.close_all()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_delegated_pool() -> DelegatedClientPool:
+    """Returns the process wide pool of delegated clients built from the settings."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = DelegatedClientPool(
+                    max_size=AZURE_AUTH.get("GRAPH_USER_POOL_SIZE"),
+                    idle_timeout=AZURE_AUTH.get("GRAPH_USER_POOL_IDLE"),
+                    flush_interval=AZURE_AUTH.get("GRAPH_USER_POOL_FLUSH_INTERVAL"),
+                )
+                # Changes still pending when the process stops
+                atexit.register(_pool.flush)
+    return _pool
+
+
+def discard_delegated(user_id):
+    """Forgets the pooled clients of a user whose token cache was written elsewhere."""
+    if _pool is not None:
+        _pool.discard(user_id)
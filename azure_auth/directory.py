@@ -0,0 +1,128 @@
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import DirectorySyncState, DirectoryUser
+from .settings import AZURE_AUTH
+
+# Graph property -> DirectoryUser field
+FIELDS = {
+    "userPrincipalName": "user_principal_name",
+    "givenName": "given_name",
+    "surname": "surname",
+    "jobTitle": "job_title",
+    "accountEnabled": "account_enabled",
+}
+
+# Sort parameter -> ordering, descending with a leading '-'
+SORTS = {
+    "name": ("surname_key", "given_name_key", "id"),
+    "upn": ("upn_key", "id"),
+    "job_title": ("job_title_key", "surname_key", "id"),
+}
+
+KEYS = ("given_name_key", "surname_key", "upn_key", "job_title_key")
+
+
+def _prefix(field, term):
+    # A range, unlike LIKE, is served by the index of the field on every backend
+    return Q(**{f"{field}__gte": term, f"{field}__lt": term + "\uffff"})
+
+
+def search_users(query="", sort="name"):
+    """
+    Returns the mirrored users matching a search, in the order of `sort`.
+
+    Every word of the query must start the given name, surname, UPN or job
+    title of a user. On PostgreSQL words also match inside those fields, using
+    the trigram index of `search_text`.
+    """
+    users = DirectoryUser.objects.all()
+    for term in query.lower().split():
+        if connection.vendor == "postgresql":
+            users = users.filter(search_text__contains=term)
+        else:
+            match = Q()
+            for key in KEYS:
+                match |= _prefix(key, term)
+            users = users.filter(match)
+    descending = sort.startswith("-")
+    ordering = SORTS.get(sort.lstrip("-"), SORTS["name"])
+    return users.order_by(*(("-" if descending else "") + field for field in ordering))
+
+
+def to_graph(user: DirectoryUser):
+    """Returns a mirrored user shaped as the Graph user it was copied from."""
+    return {
+        "id": str(user.id),
+        "userPrincipalName": user.user_principal_name,
+        "givenName": user.given_name,
+        "surname": user.surname,
+        "jobTitle": user.job_title,
+        "accountEnabled": user.account_enabled,
+    }
+
+
+def synced_at():
+    """Returns when the directory sync last completed, or None."""
+    return (
+        DirectorySyncState.objects.filter(name="users")
+        .values_list("updated_at", flat=True)
+        .first()
+    )
+
+
+def is_stale(at):
+    return at is None or (timezone.now() - at).total_seconds() > AZURE_AUTH.get(
+        "DIRECTORY_MIRROR_STALE_AFTER"
+    )
+
+
+@transaction.atomic
+def mirror_users(changed, removed, batch_size=None):
+    """
+    Applies the users changed and removed by a delta page to the mirror.
+    :param changed: a dict mapping user ids to their changed Graph properties.
+    :param removed: the ids of the users removed from the directory.
+    """
+    now = timezone.now()
+    if removed:
+        DirectoryUser.objects.filter(pk__in=list(removed)).delete()
+    if not changed:
+        return
+    pks = {DirectoryUser._meta.pk.to_python(pk): pk for pk in changed}
+    existing = DirectoryUser.objects.in_bulk(list(pks))
+    to_update, to_create = [], []
+    for pk, graph_id in pks.items():
+        item = changed[graph_id]
+        user = existing.get(pk)
+        if user is None:
+            user = DirectoryUser(id=pk)
+            to_create.append(user)
+        else:
+            to_update.append(user)
+        for graph_field, field in FIELDS.items():
+            if graph_field not in item:
+                continue
+            value = item[graph_field]
+            if field == "account_enabled":
+                user.account_enabled = value is not False
+            else:
+                setattr(user, field, value or "")
+        user.update_search_fields()
+        user.synced_at = now
+    if to_update:
+        DirectoryUser.objects.bulk_update(
+            to_update,
+            [*FIELDS.values(), *KEYS, "search_text", "synced_at"],
+            batch_size=batch_size,
+        )
+    if to_create:
+        DirectoryUser.objects.bulk_create(
+            to_create, batch_size=batch_size, ignore_conflicts=True
+        )
+
+
+def prune_mirror(before):
+    """Drops the mirrored users a full enumeration started at `before` did not return."""
+    return DirectoryUser.objects.filter(synced_at__lt=before).delete()[0]
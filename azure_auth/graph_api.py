@@ -1,28 +1,48 @@
-import requests
-import msal
+from urllib.parse import urlparse, parse_qs
+
+from .batch import GraphBatch
 from .settings import AZURE_AUTH
+from .tokens import get_app_token_store
+from .transport import get_transport
+
+
+class GraphApiError(Exception):
+    """Raised when Graph answers with an error payload."""
+
+    def __init__(self, error: dict):
+        self.error = error
+        super().__init__(error.get("error", {}).get("message"))
 
 
 class GraphApi:
     SCOPE = ["https://graph.microsoft.com/.default"]
     ENDPOINT = "https://graph.microsoft.com/v1.0"
 
-    _cache = None
+    def __init__(self, user=None, transport=None):
+        """
+        :param user: A user (or its primary key) to call Graph on behalf of,
+            with the delegated tokens of its token cache. Calls are app-only
+            without it.
+        """
+        if user is None:
+            # App-only token shared by every instance of the process
+            self.tokens = get_app_token_store(GraphApi.SCOPE)
+        else:
+            from .delegated import get_delegated_pool
 
-    def __init__(self, user=None):
+            # The deserialized token cache of the user is kept between instances
+            self.tokens = get_delegated_pool().get(
+                getattr(user, "pk", user), AZURE_AUTH.get("SCOPE") or GraphApi.SCOPE
+            )
+        # Pooled HTTP transport shared by every instance unless one is given
+        self.transport = transport or get_transport(delegated=user is not None)
         # API services
-        self.cache = msal.SerializableTokenCache()
-        if self._cache:
-            self.cache.deserialize(self.cache)
-        self.cca = GraphApi._build_msal_app(cache=self.cache)
-        self._users_api = _GraphApiUser(self.cache, self.cca)
+        self._users_api = _GraphApiUser(self)
+        self._subscriptions_api = _GraphApiSubscription(self)
 
     @property
     def token(self):
-        if result := self.cca.acquire_token_silent(scopes=GraphApi.SCOPE, account=None):
-            return result.get("access_token")
-        result = self.cca.acquire_token_for_client(scopes=GraphApi.SCOPE)
-        return result.get("access_token")
+        return self.tokens.get_token()
 
     @property
     def auth_header(self):
@@ -32,13 +52,17 @@ class GraphApi:
     def user(self):
         return self._users_api
 
+    @property
+    def subscriptions(self):
+        return self._subscriptions_api
+
     def custom(self, url):
         """
         Calls a custom url using 'v1.0' endpoint and returns a json response
         :param url: The url to call.
         :return: parsed json response
         """
-        return requests.get(
+        return self.transport.get(
             f"{GraphApi.ENDPOINT}{url}", headers={**self.auth_header}
         ).json()
 
@@ -48,87 +72,193 @@ class GraphApi:
         :param url: The url to call.
         :return: parsed json response
         """
-        return requests.get(
+        return self.transport.get(
             f"https://graph.microsoft.com/beta{url}", headers={**self.auth_header}
         ).json()
 
+    def batch(self, max_retries=3) -> GraphBatch:
+        """
+        Returns a GraphBatch sending queued requests through the '$batch'
+        endpoint when executed (or when its `with` block exits).
+        """
+        return GraphBatch(self, max_retries=max_retries)
+
     @staticmethod
     def _build_msal_app(cache=None, authority=None):
-        from django.conf import settings
+        from .utils import _build_msal_app
 
-        config = getattr(settings, "AZURE_AUTH")
+        return _build_msal_app(cache=cache, authority=authority)
 
-        return msal.ConfidentialClientApplication(
-            config.get("CLIENT_ID"),
-            authority=authority or config.get("AUTHORITY"),
-            client_credential=config.get("CLIENT_SECRET"),
-            token_cache=cache,
-        )
+
+def _error_body(res):
+    try:
+        return res.json()
+    except ValueError:
+        return {"error": {"code": str(res.status_code), "message": res.text}}
 
 
 class _GraphApiUser:
-    def __init__(
-            self,
-            cache: msal.SerializableTokenCache,
-            cca: msal.ConfidentialClientApplication,
-    ):
-        self.cache = cache
-        self.cca = cca
+    # Sizes of the profile photos stored by Graph
+    PHOTO_SIZES = (48, 64, 96, 120, 240, 360, 432, 504, 648)
+    LIST_SELECT = ("givenName", "surname", "jobTitle", "id", "userPrincipalName")
+    DELTA_SELECT = (
+        "givenName",
+        "surname",
+        "userPrincipalName",
+        "accountEnabled",
+        "jobTitle",
+    )
+
+    def __init__(self, api: GraphApi):
+        self.api = api
 
     def get(self, email):
-        return requests.get(
+        return self.transport.get(
             f"{GraphApi.ENDPOINT}/users/{email}", headers={**self.auth_header},
         ).json()
 
     def list(self):
-        return requests.get(
+        return self.transport.get(
             f"{GraphApi.ENDPOINT}/users?$select=givenName,surname,jobTitle,id,"
             f"userPrincipalName",
             headers={**self.auth_header},
         ).json()
 
-    def create(self, username: str, first_name: str, last_name: str, password: str,
-               job_title: str = ''):
+    def list_page(self, select=LIST_SELECT, filter=None, page_size=100, cursor=None):
+        """
+        Fetches a single page of users.
+        :param select: The user properties to return.
+        :param filter: An optional OData filter expression.
+        :param page_size: Number of users per page (at most 999).
+        :param cursor: The cursor returned with the previous page.
+        :return: a tuple of the users and the cursor of the next page, or None
+        """
+        params = {"$select": ",".join(select), "$top": page_size}
+        if filter:
+            params["$filter"] = filter
+        if cursor:
+            params["$skiptoken"] = cursor
+        res = self.transport.get(
+            f"{GraphApi.ENDPOINT}/users", params=params, headers={**self.auth_header},
+        ).json()
+        if "error" in res:
+            raise GraphApiError(res)
+        next_link = res.get("@odata.nextLink")
+        if next_link:
+            next_link = parse_qs(urlparse(next_link).query).get("$skiptoken", [None])[0]
+        return res.get("value", []), next_link
+
+    def iter_users(self, select=LIST_SELECT, filter=None, page_size=100):
+        """
+        Lazily yields every user of the directory, requesting the next page only
+        once the current one has been consumed.
+        """
+        cursor = None
+        while True:
+            users, cursor = self.list_page(select, filter, page_size, cursor)
+            yield from users
+            if not cursor:
+                return
+
+    def delta(self, delta_link=None, select=DELTA_SELECT):
+        """
+        Lazily yields the pages of a '/users/delta' query. The last page holds
+        the '@odata.deltaLink' to pass on the next call to only receive changes.
+        :param delta_link: The deltaLink of a previous query, or None for a full
+            enumeration.
+        :param select: The user properties to track.
+        """
+        url = delta_link or (
+            f"{GraphApi.ENDPOINT}/users/delta?$select=" + ",".join(select)
+        )
+        while url:
+            res = self.transport.get(url, headers={**self.auth_header}).json()
+            if "error" in res:
+                raise GraphApiError(res)
+            yield res
+            url = res.get("@odata.nextLink")
+
+    @staticmethod
+    def _create_payload(
+        username: str,
+        first_name: str,
+        last_name: str,
+        password: str,
+        job_title: str = '',
+    ):
+        return {
+            "accountEnabled": True,
+            "displayName": f"{first_name} {last_name}",
+            "mailNickname": username,
+            "userPrincipalName": username + '@' + AZURE_AUTH.get('DOMAIN'),
+            "givenName": first_name,
+            "surname": last_name,
+            "passwordProfile": {
+                "forceChangePasswordNextSignIn": False,
+                "password": password,
+            },
+            "jobTitle": job_title,
+        }
+
+    @staticmethod
+    def _update_payload(
+        username: str, first_name: str, last_name: str, job_title: str = None
+    ):
+        payload = {
+            "displayName": f"{first_name} {last_name}",
+            "mailNickname": username,
+            "userPrincipalName": username + '@' + AZURE_AUTH.get('DOMAIN'),
+            "givenName": first_name,
+            "surname": last_name,
+        }
+        # An empty job title can not be sent, it is cleared with null
+        if job_title is not None:
+            payload["jobTitle"] = job_title or None
+        return payload
+
+    def create(
+        self,
+        username: str,
+        first_name: str,
+        last_name: str,
+        password: str,
+        job_title: str = '',
+        return_user: bool = False,
+    ):
+        """
+        Creates a user. Returns True, or the created user if `return_user` is
+        set, on success and the error response otherwise.
+        """
         if None in (username, first_name, last_name, password):
             return False
 
-        res = requests.post(
+        res = self.transport.post(
             f"{GraphApi.ENDPOINT}/users",
             headers={**self.auth_header},
-            json={
-                "accountEnabled": True,
-                "displayName": f"{first_name} {last_name}",
-                "mailNickname": username,
-                "userPrincipalName": username + '@' + AZURE_AUTH.get('DOMAIN'),
-                "givenName": first_name,
-                "surname": last_name,
-                "passwordProfile": {
-                    "forceChangePasswordNextSignIn": False,
-                    "password": password,
-                },
-                "jobTitle": job_title,
-            },
+            json=self._create_payload(
+                username, first_name, last_name, password, job_title
+            ),
         )
         if res.status_code == 201:
-            return True
+            return res.json() if return_user else True
         else:
             return res.json()
 
-    def update(self, azure_object_id, username: str, first_name: str, last_name: str,
-               password: str):
-        if None in (username, first_name, last_name, password):
+    def update(
+        self,
+        azure_object_id,
+        username: str,
+        first_name: str,
+        last_name: str,
+        job_title: str = None,
+    ):
+        if None in (username, first_name, last_name):
             return False
 
-        res = requests.patch(
+        res = self.transport.patch(
             f"{GraphApi.ENDPOINT}/users/{azure_object_id}",
             headers={**self.auth_header},
-            json={
-                "displayName": f"{first_name} {last_name}",
-                "mailNickname": username,
-                "userPrincipalName": username + '@' + AZURE_AUTH.get('DOMAIN'),
-                "givenName": first_name,
-                "surname": last_name,
-            },
+            json=self._update_payload(username, first_name, last_name, job_title),
         )
         if res.status_code == 204:
             return True
@@ -136,9 +266,8 @@ class _GraphApiUser:
             return res.json()
 
     def delete(self, email):
-        res = requests.delete(
-            f"{GraphApi.ENDPOINT}/users/{email}",
-            headers={**self.auth_header},
+        res = self.transport.delete(
+            f"{GraphApi.ENDPOINT}/users/{email}", headers={**self.auth_header},
         )
         if res.status_code == 204:
             return True
@@ -147,36 +276,250 @@ class _GraphApiUser:
 
     def exists(self, email):
         return (
-                requests.get(
-                    f"{GraphApi.ENDPOINT}/users/{email}", headers={**self.auth_header},
-                ).status_code
-                != 404
+            self.transport.get(
+                f"{GraphApi.ENDPOINT}/users/{email}", headers={**self.auth_header},
+            ).status_code
+            != 404
         )
 
     def member_of(self, email):
-        return requests.get(
+        return self.transport.get(
             f"{GraphApi.ENDPOINT}/users/{email}/memberOf", headers={**self.auth_header}
         ).json()
 
     def directory_roles(self, email):
-        res = requests.get(
-            f"{GraphApi.ENDPOINT}/users/{email}/memberOf", headers={**self.auth_header}
+        """
+        Returns the directory roles the user is a member of, or None if Graph
+        returned an error. The cast to directoryRole is applied by Graph so
+        groups and administrative units are never downloaded.
+        """
+        res = self.transport.get(
+            f"{GraphApi.ENDPOINT}/users/{email}/memberOf/microsoft.graph.directoryRole"
+            f"?$select=id,displayName,roleTemplateId",
+            headers={**self.auth_header},
         ).json()
-        roles = res.get("value")
-        return list(
-            filter(
-                lambda x: x.get("@odata.type") == "#microsoft.graph.directoryRole",
-                roles,
-            )
+        if "error" in res:
+            return None
+        return res.get("value", [])
+
+    def transitive_member_of(self, email):
+        """
+        Returns the ids of the groups and directory roles the user is a direct
+        or nested member of, or None if Graph returned an error.
+        """
+        url = (
+            f"{GraphApi.ENDPOINT}/users/{email}/transitiveMemberOf?$select=id&$top=999"
+        )
+        ids = []
+        while url:
+            res = self.transport.get(url, headers={**self.auth_header}).json()
+            if "error" in res:
+                return None
+            ids.extend(item["id"] for item in res.get("value", []))
+            url = res.get("@odata.nextLink")
+        return ids
+
+    def photo(self, email, size=None):
+        """
+        Downloads the profile photo of a user.
+        :param size: One of PHOTO_SIZES to download a size stored by Graph, or
+            None for the largest photo.
+        :return: a tuple of the image and its content type, or None if the user
+            has no photo (in that size)
+        """
+        path = "photo" if size is None else f"photos/{size}x{size}"
+        res = self.transport.get(
+            f"{GraphApi.ENDPOINT}/users/{email}/{path}/$value",
+            headers={**self.auth_header},
+        )
+        if res.status_code == 404:
+            return None
+        if res.status_code != 200:
+            raise GraphApiError(_error_body(res))
+        return res.content, res.headers.get("Content-Type", "image/jpeg")
+
+    def photo_etag(self, email):
+        """
+        Returns the media ETag of the profile photo of a user, which changes
+        with the photo, or None if the user has no photo.
+        """
+        res = self.transport.get(
+            f"{GraphApi.ENDPOINT}/users/{email}/photo", headers={**self.auth_header},
         )
+        if res.status_code == 404:
+            return None
+        body = _error_body(res)
+        if "error" in body:
+            raise GraphApiError(body)
+        return body.get("@odata.mediaEtag")
+
+    def get_many(self, emails, select=None):
+        """
+        Fetches several users with '$batch' requests.
+        :param select: the properties to fetch, Graph's default ones if None.
+        :return: a dict mapping each email to its json response
+        """
+        query = f"?$select={','.join(select)}" if select else ""
+        with self.api.batch() as batch:
+            requests = {
+                email: batch.add("GET", f"/users/{email}{query}") for email in emails
+            }
+        return {email: request.result for email, request in requests.items()}
+
+    def exists_many(self, emails):
+        """
+        Checks the existence of several users with '$batch' requests.
+        :return: a dict mapping each email to a boolean
+        """
+        with self.api.batch() as batch:
+            requests = {
+                email: batch.add("GET", f"/users/{email}?$select=id")
+                for email in emails
+            }
+        return {email: request.status != 404 for email, request in requests.items()}
+
+    def transitive_member_of_many(self, emails):
+        """
+        Fetches the transitive memberships of several users with '$batch'
+        requests, see `transitive_member_of`.
+        :return: a dict mapping each email to a list of ids, or None
+        """
+        with self.api.batch() as batch:
+            requests = {
+                email: batch.add(
+                    "GET", f"/users/{email}/transitiveMemberOf?$select=id&$top=999"
+                )
+                for email in emails
+            }
+        memberships = {}
+        for email, request in requests.items():
+            if not request.ok:
+                memberships[email] = None
+            elif request.result.get("@odata.nextLink"):
+                # Memberships larger than a page are fetched outside of the batch
+                memberships[email] = self.transitive_member_of(email)
+            else:
+                memberships[email] = [item["id"] for item in request.result["value"]]
+        return memberships
+
+    def create_many(self, users):
+        """
+        Creates several users with '$batch' requests.
+        :param users: an iterable of dicts holding the arguments of `create`.
+        :return: a list holding True or the error response for each user
+        """
+        with self.api.batch() as batch:
+            requests = [
+                batch.add("POST", "/users", body=self._create_payload(**user))
+                for user in users
+            ]
+        return [
+            True if request.status == 201 else request.result for request in requests
+        ]
+
+    def delete_many(self, emails):
+        """
+        Deletes several users with '$batch' requests.
+        :return: a dict mapping each email to True or the error response
+        """
+        with self.api.batch() as batch:
+            requests = {
+                email: batch.add("DELETE", f"/users/{email}") for email in emails
+            }
+        return {
+            email: True if request.status == 204 else request.result
+            for email, request in requests.items()
+        }
 
     @property
-    def token(self):
-        if result := self.cca.acquire_token_silent(scopes=GraphApi.SCOPE, account=None):
-            return result.get("access_token")
+    def transport(self):
+        return self.api.transport
 
-        return self.cca.acquire_token_for_client(scopes=GraphApi.SCOPE)["access_token"]
+    @property
+    def token(self):
+        return self.api.token
 
     @property
     def auth_header(self):
-        return {"Authorization": "Bearer " + self.token}
+        return self.api.auth_header
+
+
+class _GraphApiSubscription:
+    """Subscriptions of the app to Graph change notifications."""
+
+    def __init__(self, api: GraphApi):
+        self.api = api
+
+    def list(self):
+        """Returns the subscriptions of the app, raising GraphApiError on errors."""
+        url, subscriptions = f"{GraphApi.ENDPOINT}/subscriptions", []
+        while url:
+            res = self.api.transport.get(url, headers={**self.api.auth_header}).json()
+            if "error" in res:
+                raise GraphApiError(res)
+            subscriptions.extend(res.get("value", []))
+            url = res.get("@odata.nextLink")
+        return subscriptions
+
+    def create(
+        self,
+        resource,
+        change_type,
+        notification_url,
+        client_state,
+        expiration,
+        lifecycle_notification_url=None,
+    ):
+        """
+        Subscribes to the changes of a resource.
+        :param expiration: an aware datetime, at most 29 days away for users
+            and groups.
+        :return: the created subscription
+        """
+        payload = {
+            "resource": resource,
+            "changeType": change_type,
+            "notificationUrl": notification_url,
+            "clientState": client_state,
+            "expirationDateTime": expiration.isoformat(),
+        }
+        if lifecycle_notification_url:
+            payload["lifecycleNotificationUrl"] = lifecycle_notification_url
+        res = self.api.transport.post(
+            f"{GraphApi.ENDPOINT}/subscriptions",
+            headers={**self.api.auth_header},
+            json=payload,
+        )
+        if res.status_code != 201:
+            raise GraphApiError(_error_body(res))
+        return res.json()
+
+    def renew(self, subscription_id, expiration):
+        """Extends a subscription, returning it updated."""
+        res = self.api.transport.patch(
+            f"{GraphApi.ENDPOINT}/subscriptions/{subscription_id}",
+            headers={**self.api.auth_header},
+            json={"expirationDateTime": expiration.isoformat()},
+        )
+        if res.status_code != 200:
+            raise GraphApiError(_error_body(res))
+        return res.json()
+
+    def reauthorize(self, subscription_id):
+        """Answers a 'reauthorizationRequired' lifecycle notification."""
+        res = self.api.transport.post(
+            f"{GraphApi.ENDPOINT}/subscriptions/{subscription_id}/reauthorize",
+            headers={**self.api.auth_header},
+        )
+        if res.status_code not in (200, 204):
+            raise GraphApiError(_error_body(res))
+        return True
+
+    def delete(self, subscription_id):
+        res = self.api.transport.delete(
+            f"{GraphApi.ENDPOINT}/subscriptions/{subscription_id}",
+            headers={**self.api.auth_header},
+        )
+        if res.status_code not in (204, 404):
+            raise GraphApiError(_error_body(res))
+        return True
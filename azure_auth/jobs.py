@@ -0,0 +1,269 @@
+import base64
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from cryptography.fernet import Fernet
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+
+from .graph_api import GraphApi
+from .models import DirectoryUser, GraphJob, get_user_model
+from .settings import AZURE_AUTH
+
+logger = logging.getLogger(__name__)
+
+
+def _sync_user(payload):
+    user = get_user_model().objects.filter(pk=payload["user_id"]).first()
+    if user is None:
+        return {"synced": False}
+    user.sync_from_ad()
+    return {"synced": True}
+
+
+def _create_user(payload):
+    res = GraphApi().user.create(**payload, return_user=True)
+    if "error" in res:
+        return res
+    return {"id": res["id"], "userPrincipalName": res.get("userPrincipalName")}
+
+
+def _update_user(payload):
+    res = GraphApi().user.update(
+        payload["user_id"],
+        payload["username"],
+        payload["first_name"],
+        payload["last_name"],
+        payload.get("job_title"),
+    )
+    if res is not True:
+        return (
+            res if isinstance(res, dict) else {"error": {"message": "Invalid update"}}
+        )
+    return _sync_user(payload)
+
+
+def _delete_user(payload):
+    res = GraphApi().user.delete(payload["user_id"])
+    if res is not True:
+        return res
+    get_user_model().objects.filter(pk=payload["user_id"]).delete()
+    DirectoryUser.objects.filter(pk=payload["user_id"]).delete()
+    return {"deleted": True}
+
+
+def _notifications(payload):
+    from .notifications import NotificationHandler
+
+    result = NotificationHandler().handle(payload["value"])
+    return {
+        "notifications": result.notifications,
+        "updated": result.updated,
+        "removed": result.removed,
+        "memberships": result.memberships,
+    }
+
+
+HANDLERS = {
+    "user.create": _create_user,
+    "user.update": _update_user,
+    "user.delete": _delete_user,
+    "user.sync": _sync_user,
+    "notifications": _notifications,
+}
+
+# Payload entries stored encrypted, and not kept once a job has run
+SECRET_FIELDS = ("password",)
+
+
+def _fernet():
+    key = salted_hmac("azure_auth.jobs", "payload", algorithm="sha256").digest()
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def seal(payload):
+    """Encrypts the SECRET_FIELDS of a payload with a key derived from SECRET_KEY."""
+    return {
+        name: _fernet().encrypt(value.encode()).decode()
+        if name in SECRET_FIELDS and value
+        else value
+        for name, value in payload.items()
+    }
+
+
+def unseal(payload):
+    """Decrypts the SECRET_FIELDS of a payload stored by `seal`."""
+    return {
+        name: _fernet().decrypt(value.encode()).decode()
+        if name in SECRET_FIELDS and value
+        else value
+        for name, value in payload.items()
+    }
+
+
+def _merge(kind, payload, new_kind, new_payload):
+    """Coalesces a new job into a pending job of the same key."""
+    if kind == new_kind == "notifications":
+        return kind, {"value": payload["value"] + new_payload["value"]}
+    if new_kind == "user.sync" or kind == "user.delete":
+        # Every job of a user ends with a sync, and nothing follows a deletion
+        return kind, payload
+    if kind == new_kind == "user.update":
+        return kind, {**payload, **new_payload}
+    return new_kind, new_payload
+
+
+class JobQueue:
+    """
+    Runs deferred Graph writes on a bounded pool of threads.
+
+    Jobs are stored in the GraphJob table before they run, so jobs that did
+    not fit in the pool, or were left behind by a stopped process, are run by
+    the next free worker or by `manage.py azure_jobs`. A job enqueued while
+    another job with the same key is pending is merged into it, and jobs with
+    the same key never run concurrently.
+    """
+
+    def __init__(self, workers=4, max_pending=100):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._running_keys = set()
+
+    def enqueue(self, kind, key, payload) -> GraphJob:
+        payload = seal(payload)
+        with transaction.atomic():
+            job = self._merge_pending(kind, key, payload)
+            if job is None:
+                job = GraphJob.objects.create(kind=kind, key=key, payload=payload)
+        transaction.on_commit(lambda: self._submit(job.pk))
+        return job
+
+    def _merge_pending(self, kind, key, payload):
+        """Merges a job into the pending job of its key, or returns None."""
+        job = (
+            GraphJob.objects.select_for_update()
+            .filter(key=key, status=GraphJob.PENDING)
+            .order_by("created_at")
+            .first()
+        )
+        if job is None:
+            return None
+        job.kind, job.payload = _merge(job.kind, job.payload, kind, payload)
+        job.coalesced += 1
+        job.updated_at = timezone.now()
+        # A job claimed by a worker since it was read must not be changed
+        if not GraphJob.objects.filter(pk=job.pk, status=GraphJob.PENDING).update(
+            kind=job.kind,
+            payload=job.payload,
+            coalesced=F("coalesced") + 1,
+            updated_at=job.updated_at,
+        ):
+            return None
+        return job
+
+    def run(self, job_id):
+        """Runs a pending job in the calling thread."""
+        job = GraphJob.objects.filter(pk=job_id, status=GraphJob.PENDING).first()
+        if job is None:
+            return None
+        with self._lock:
+            if job.key in self._running_keys:
+                # Picked up once the running job of the key is done
+                return None
+            self._running_keys.add(job.key)
+        try:
+            # Claimed by a single worker, across processes
+            if not GraphJob.objects.filter(pk=job_id, status=GraphJob.PENDING).update(
+                status=GraphJob.RUNNING, updated_at=timezone.now()
+            ):
+                return None
+            job.refresh_from_db()
+            try:
+                result = HANDLERS[job.kind](unseal(job.payload))
+                status = GraphJob.FAILED if "error" in result else GraphJob.DONE
+            except Exception as e:
+                logger.exception("Graph job %s failed", job.pk)
+                result, status = {"error": {"message": str(e)}}, GraphJob.FAILED
+            job.status, job.result = status, result
+            for field in SECRET_FIELDS:
+                job.payload.pop(field, None)
+            job.save(update_fields=["status", "result", "payload", "updated_at"])
+            return job
+        finally:
+            with self._lock:
+                self._running_keys.discard(job.key)
+
+    def run_pending(self, stale_after=None):
+        """
+        Runs every pending job in the calling thread. Jobs running for more than
+        `stale_after` seconds are considered abandoned and run again.
+        """
+        if stale_after is not None:
+            GraphJob.objects.filter(
+                status=GraphJob.RUNNING,
+                updated_at__lt=timezone.now() - timedelta(seconds=stale_after),
+            ).update(status=GraphJob.PENDING)
+        count = 0
+        while (job_id := self._next_pending()) is not None:
+            if self.run(job_id) is None:
+                break
+            count += 1
+        return count
+
+    def _next_pending(self):
+        with self._lock:
+            running = set(self._running_keys)
+        return (
+            GraphJob.objects.filter(status=GraphJob.PENDING)
+            .exclude(key__in=running)
+            .order_by("created_at")
+            .values_list("pk", flat=True)
+            .first()
+        )
+
+    def _submit(self, job_id):
+        with self._lock:
+            if self._inflight >= self.max_pending:
+                return  # Left in the table for the next free worker
+            self._inflight += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="azure-auth-jobs"
+                )
+        self._executor.submit(self._work, job_id)
+
+    def _work(self, job_id):
+        try:
+            while job_id is not None:
+                self.run(job_id)
+                job_id = self._next_pending()
+        except Exception:
+            logger.exception("Graph job worker failed")
+        finally:
+            with self._lock:
+                self._inflight -= 1
+            connections.close_all()
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Returns the process wide job queue built from the settings."""
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue(
+                    workers=AZURE_AUTH.get("GRAPH_JOBS_WORKERS"),
+                    max_pending=AZURE_AUTH.get("GRAPH_JOBS_MAX_PENDING"),
+                )
+    return _job_queue
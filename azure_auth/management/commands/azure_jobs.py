@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from ...jobs import get_job_queue
+
+
+class Command(BaseCommand):
+    help = "Runs the deferred Graph jobs left pending in the job table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--stale-after",
+            type=int,
+            default=None,
+            help="Run again jobs marked running for more than this many seconds.",
+        )
+
+    def handle(self, *args, **options):
+        count = get_job_queue().run_pending(stale_after=options["stale_after"])
+        self.stdout.write(self.style.SUCCESS(f"{count} jobs run"))
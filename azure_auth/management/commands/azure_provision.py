@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from ...provisioning import Provisioner
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates the users listed in a CSV or JSONL file in Azure AD. Rows hold the "
+        "fields of UserCreateForm. Interrupted runs resume from a checkpoint file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV or JSONL (.jsonl) file of users.")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=8,
+            help="Number of users created concurrently.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Number of users written per bulk query to the local User table.",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            default=None,
+            help="Checkpoint file, defaults to '<path>.checkpoint'.",
+        )
+
+    def handle(self, *args, **options):
+        provisioner = Provisioner(
+            workers=options["workers"],
+            batch_size=options["batch_size"],
+            on_error=lambda number, message: self.stderr.write(
+                f"Line {number}: {message}"
+            ),
+        )
+        result = provisioner.run(options["path"], checkpoint_path=options["checkpoint"])
+        style = self.style.SUCCESS if not result.errors else self.style.WARNING
+        self.stdout.write(style(str(result)))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...token_refresh import TokenRefresher
+
+
+class Command(BaseCommand):
+    help = "Refreshes the delegated access tokens of the users before they expire."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--margin",
+            type=int,
+            default=None,
+            help="Refresh the tokens expiring within this many seconds.",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=None, help="Number of concurrent refreshes.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=None,
+            help="Keep running, refreshing tokens every this many seconds.",
+        )
+
+    def handle(self, *args, **options):
+        refresher = TokenRefresher(margin=options["margin"], workers=options["workers"])
+        while True:
+            result = refresher.run()
+            style = self.style.SUCCESS if not result.failed else self.style.WARNING
+            self.stdout.write(style(str(result)))
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...notifications import SubscriptionManager
+from ...settings import AZURE_AUTH
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates and renews the Graph change notification subscriptions posting "
+        "to the notification view."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url",
+            default=None,
+            help="Public url of the notification view, GRAPH_NOTIFICATION_URL by default.",
+        )
+        parser.add_argument(
+            "--delete", action="store_true", help="Delete the subscriptions instead.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=None,
+            help="Keep running, renewing the subscriptions every this many seconds.",
+        )
+
+    def handle(self, *args, **options):
+        manager = SubscriptionManager(notification_url=options["url"])
+        if not manager.notification_url:
+            raise CommandError("Set GRAPH_NOTIFICATION_URL or pass --url.")
+        if not AZURE_AUTH.get("GRAPH_NOTIFICATION_CLIENT_STATE"):
+            raise CommandError("Set GRAPH_NOTIFICATION_CLIENT_STATE.")
+        if options["delete"]:
+            self.stdout.write(self.style.SUCCESS(str(manager.delete())))
+            return
+        while True:
+            self.stdout.write(self.style.SUCCESS(str(manager.ensure())))
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...graph_api import GraphApiError
+from ...sync import DirectorySync
+
+
+class Command(BaseCommand):
+    help = "Synchronizes the local users with Azure AD using Graph delta queries."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Ignore the stored deltaLink and enumerate every user.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=None,
+            help="Number of users written per bulk query.",
+        )
+        parser.add_argument(
+            "--no-create",
+            action="store_true",
+            help="Only update users that already exist locally.",
+        )
+
+    def handle(self, *args, **options):
+        sync = DirectorySync(
+            chunk_size=options["chunk_size"], create_missing=not options["no_create"],
+        )
+        try:
+            result = sync.run(full=options["full"])
+        except GraphApiError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(str(result)))
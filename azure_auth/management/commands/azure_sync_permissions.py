@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from ...permission_index import PermissionIndexSync
+
+
+class Command(BaseCommand):
+    help = (
+        "Refreshes the permission index of the local users from their transitive "
+        "group memberships in Azure AD."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=None,
+            help="Number of users fetched and written per chunk.",
+        )
+        parser.add_argument(
+            "--remap-only",
+            action="store_true",
+            help="Only recompute the permissions of the stored memberships, "
+            "e.g. after PERMISSION_MAP changed.",
+        )
+
+    def handle(self, *args, **options):
+        sync = PermissionIndexSync(chunk_size=options["chunk_size"])
+        result = sync.run(remap_only=options["remap_only"])
+        self.stdout.write(self.style.SUCCESS(str(result)))
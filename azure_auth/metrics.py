@@ -0,0 +1,316 @@
+import bisect
+import contextvars
+import hmac
+import threading
+import time
+from collections import defaultdict
+
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse
+from django.utils.module_loading import import_string
+
+from .settings import AZURE_AUTH
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Spans recorded while handling the current request, see MetricsMiddleware
+_request_spans = contextvars.ContextVar("azure_auth_request_spans", default=None)
+
+
+class BaseSink:
+    """Receives the measurements of the package."""
+
+    def increment(self, name, value=1, labels=None):
+        raise NotImplementedError
+
+    def observe(self, name, value, labels=None):
+        raise NotImplementedError
+
+
+class NullSink(BaseSink):
+    def increment(self, name, value=1, labels=None):
+        pass
+
+    def observe(self, name, value, labels=None):
+        pass
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class RegistrySink(BaseSink):
+    """Keeps counters and histograms in memory, exported by `metrics_view`."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1, labels=None):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name, value, labels=None):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self.buckets)
+            histogram.counts[bisect.bisect_left(self.buckets, value)] += 1
+            histogram.sum += value
+            histogram.count += 1
+
+    def render(self):
+        """Renders the registry in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            histograms = [
+                (key, list(h.counts), h.sum, h.count) for key, h in histograms
+            ]
+
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        for (name, labels), counts, total, count in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = labels + (("le", str(bound)),)
+                lines.append(f"{name}_bucket{_format_labels(le)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total:g}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def get_sink() -> BaseSink:
+    global _sink
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                if not AZURE_AUTH.get("METRICS_ENABLED"):
+                    _sink = NullSink()
+                else:
+                    sink_class = AZURE_AUTH.get("METRICS_SINK")
+                    if isinstance(sink_class, str):
+                        sink_class = import_string(sink_class)
+                    _sink = sink_class()
+    return _sink
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("name", "labels", "started")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        elapsed = time.perf_counter() - self.started
+        labels = dict(self.labels, outcome="error" if exc_type else "ok")
+        get_sink().observe(f"azure_auth_{self.name}_seconds", elapsed, labels)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((self.name, elapsed))
+        return False
+
+
+def span(name, **labels):
+    """
+    Times a block, recording it in the `azure_auth_<name>_seconds` histogram
+    and in the summary of the current request. Free when metrics are disabled.
+    """
+    if not AZURE_AUTH.get("METRICS_ENABLED"):
+        return _NOOP_SPAN
+    return _Span(name, labels)
+
+
+def increment(name, value=1, **labels):
+    if AZURE_AUTH.get("METRICS_ENABLED"):
+        get_sink().increment(f"azure_auth_{name}_total", value, labels)
+
+
+class InstrumentedTransport:
+    """Wraps a transport, timing every Graph call per endpoint and status."""
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    def request(self, method, url, **kwargs):
+        from .resilience import endpoint_key
+
+        with span("graph_request", endpoint=endpoint_key(method, url)):
+            res = self.transport.request(method, url, **kwargs)
+        increment(
+            "graph_responses",
+            endpoint=endpoint_key(method, url),
+            status=res.status_code,
+        )
+        return res
+
+    def invalidate(self, *tags):
+        if invalidate := getattr(self.transport, "invalidate", None):
+            invalidate(*tags)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def close(self):
+        if hasattr(self.transport, "close"):
+            self.transport.close()
+
+
+# Component stats reporting a current value rather than a running count
+_GAUGES = {"expires_in", "near_expiry", "clients", "entries", "bytes", "circuit_open"}
+
+
+def _component_stats():
+    """Counters kept by the caches and the resilience layer of the package."""
+    from .resilience import get_resilience
+    from .response_cache import get_response_cache
+    from .singleflight import graph_single_flight
+    from .tokens import _stores
+    from . import delegated, token_refresh
+
+    families = defaultdict(list)
+
+    def add(prefix, stats, labels=""):
+        for key, value in stats.items():
+            families[(f"{prefix}_{key}", key in _GAUGES)].append((labels, value))
+
+    for scopes, store in list(_stores.items()):
+        add(
+            "azure_auth_app_token",
+            store.stats(),
+            _format_labels((("scopes", " ".join(scopes)),)),
+        )
+    if token_refresh._refresher is not None:
+        add("azure_auth_token_refresh", token_refresh._refresher.stats())
+    if delegated._pool is not None:
+        add("azure_auth_delegated_clients", delegated._pool.stats())
+    add("azure_auth_graph_cache", get_response_cache().stats())
+    add("azure_auth_graph_coalesced", graph_single_flight.stats())
+    for endpoint, counters in get_resilience().stats()["endpoints"].items():
+        counters = dict(counters)
+        counters["circuit_open"] = int(counters.pop("circuit") != "closed")
+        add("azure_auth_graph", counters, _format_labels((("endpoint", endpoint),)))
+
+    lines = []
+    for (name, gauge), samples in families.items():
+        lines.append(f"# TYPE {name} {'gauge' if gauge else 'counter'}")
+        lines.extend(f"{name}{labels} {value}" for labels, value in samples)
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def metrics_view(request):
+    """
+    Exports the metrics of the package in the Prometheus text format, to
+    superusers, to requests bearing METRICS_TOKEN and to the addresses of
+    METRICS_ALLOWED_IPS.
+    """
+    sink = get_sink()
+    if not isinstance(sink, RegistrySink):
+        raise Http404
+    token = AZURE_AUTH.get("METRICS_TOKEN")
+    if not (
+        getattr(request.user, "is_superuser", False)
+        or token
+        and hmac.compare_digest(
+            request.headers.get("Authorization", "").encode(),
+            f"Bearer {token}".encode(),
+        )
+        # Behind a proxy REMOTE_ADDR is the address of the proxy
+        or request.META.get("REMOTE_ADDR") in AZURE_AUTH.get("METRICS_ALLOWED_IPS")
+    ):
+        raise PermissionDenied
+    return HttpResponse(
+        sink.render() + _component_stats(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+class MetricsMiddleware:
+    """
+    Collects the spans of each request. With METRICS_SUMMARY_HEADER, their
+    total duration and count per name are returned in a 'Server-Timing' header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not AZURE_AUTH.get("METRICS_ENABLED"):
+            return self.get_response(request)
+        token = _request_spans.set([])
+        try:
+            response = self.get_response(request)
+            spans = _request_spans.get()
+        finally:
+            _request_spans.reset(token)
+        if spans and AZURE_AUTH.get("METRICS_SUMMARY_HEADER"):
+            totals = defaultdict(lambda: [0.0, 0])
+            for name, elapsed in spans:
+                totals[name][0] += elapsed
+                totals[name][1] += 1
+            response["Server-Timing"] = ", ".join(
+                f'{name};dur={total * 1000:.1f};desc="{count} calls"'
+                for name, (total, count) in totals.items()
+            )
+        return response
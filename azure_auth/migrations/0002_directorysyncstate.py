@@ -0,0 +1,21 @@
+# Generated by Django 3.1.13 on 2026-10-18 09:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('azure_auth', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectorySyncState',
+            fields=[
+                ('name', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('delta_link', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
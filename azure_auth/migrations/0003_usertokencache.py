@@ -0,0 +1,57 @@
+# Generated by Django 3.1.13 on 2026-10-18 09:14
+
+import zlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def move_token_caches(apps, schema_editor):
+    User = apps.get_model('azure_auth', 'User')
+    UserTokenCache = apps.get_model('azure_auth', 'UserTokenCache')
+    users = User.objects.exclude(azure_token_cache__isnull=True).exclude(
+        azure_token_cache=''
+    )
+    UserTokenCache.objects.bulk_create(
+        (
+            UserTokenCache(
+                user_id=user_id, data=zlib.compress(token_cache.encode(), 6)
+            )
+            for user_id, token_cache in users.values_list(
+                'azure_object_id', 'azure_token_cache'
+            ).iterator()
+        ),
+        batch_size=500,
+    )
+
+
+def restore_token_caches(apps, schema_editor):
+    User = apps.get_model('azure_auth', 'User')
+    UserTokenCache = apps.get_model('azure_auth', 'UserTokenCache')
+    for user_id, data in UserTokenCache.objects.values_list('user_id', 'data').iterator():
+        User.objects.filter(azure_object_id=user_id).update(
+            azure_token_cache=zlib.decompress(bytes(data)).decode()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('azure_auth', '0002_directorysyncstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserTokenCache',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='token_cache', serialize=False, to='azure_auth.user')),
+                ('data', models.BinaryField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(move_token_caches, restore_token_caches),
+        migrations.RemoveField(
+            model_name='user',
+            name='azure_token_cache',
+        ),
+    ]
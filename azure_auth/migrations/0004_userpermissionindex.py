@@ -0,0 +1,24 @@
+# Generated by Django 3.1.13 on 2026-10-18 09:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('azure_auth', '0003_usertokencache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserPermissionIndex',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='permission_index', serialize=False, to='azure_auth.user')),
+                ('groups', models.JSONField(default=list)),
+                ('roles', models.JSONField(default=list)),
+                ('permissions', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
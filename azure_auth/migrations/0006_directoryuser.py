@@ -0,0 +1,73 @@
+# Generated by Django 3.1.13 on 2026-10-18 09:33
+
+from django.db import migrations, models
+
+
+def create_trigram_index(apps, schema_editor):
+    """Indexes the search text for substring matches on PostgreSQL, when pg_trgm can be used."""
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    from django.db import DatabaseError, transaction
+
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            schema_editor.execute(
+                "CREATE INDEX azure_auth_dir_search_trgm ON azure_auth_directoryuser "
+                "USING gin (search_text gin_trgm_ops)"
+            )
+    except DatabaseError:
+        pass  # Searches then scan the table
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS azure_auth_dir_search_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('azure_auth', '0005_graphjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectoryUser',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('user_principal_name', models.CharField(blank=True, max_length=255)),
+                ('given_name', models.CharField(blank=True, max_length=120)),
+                ('surname', models.CharField(blank=True, max_length=120)),
+                ('job_title', models.CharField(blank=True, max_length=128)),
+                ('account_enabled', models.BooleanField(default=True)),
+                ('upn_key', models.CharField(blank=True, max_length=255)),
+                ('given_name_key', models.CharField(blank=True, max_length=120)),
+                ('surname_key', models.CharField(blank=True, max_length=120)),
+                ('job_title_key', models.CharField(blank=True, max_length=128)),
+                ('search_text', models.TextField(blank=True)),
+                ('synced_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='directoryuser',
+            index=models.Index(fields=['upn_key'], name='azure_auth_dir_upn_key'),
+        ),
+        migrations.AddIndex(
+            model_name='directoryuser',
+            index=models.Index(fields=['given_name_key'], name='azure_auth_dir_given_name_key'),
+        ),
+        migrations.AddIndex(
+            model_name='directoryuser',
+            index=models.Index(fields=['surname_key'], name='azure_auth_dir_surname_key'),
+        ),
+        migrations.AddIndex(
+            model_name='directoryuser',
+            index=models.Index(fields=['job_title_key'], name='azure_auth_dir_job_title_key'),
+        ),
+        migrations.AddIndex(
+            model_name='directoryuser',
+            index=models.Index(fields=['synced_at'], name='azure_auth_dir_synced_at'),
+        ),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
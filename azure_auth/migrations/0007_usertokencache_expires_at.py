@@ -0,0 +1,18 @@
+# Generated by Django 3.1.13 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('azure_auth', '0006_directoryuser'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usertokencache',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
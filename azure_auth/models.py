@@ -1,3 +1,5 @@
+import uuid
+
 from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 from django.core.exceptions import ImproperlyConfigured
@@ -37,7 +39,6 @@ class User(AbstractBaseUser):
     is_superuser = models.BooleanField(default=False)
     first_name = models.CharField("First name", max_length=120, blank=False)
     last_name = models.CharField("Last name", max_length=120, blank=True)
-    azure_token_cache = models.TextField(null=True, blank=True)
     # Custom Manager
     objects = CustomUserManager()
 
@@ -55,21 +56,56 @@ class User(AbstractBaseUser):
     def get_short_name(self):
         return self.first_name
 
+    @property
+    def azure_permissions(self):
+        """The permissions granted by the user's groups and app roles."""
+        if not hasattr(self, "_azure_permissions"):
+            try:
+                permissions = self.permission_index.permissions
+            except UserPermissionIndex.DoesNotExist:
+                permissions = []
+            self._azure_permissions = frozenset(permissions)
+        return self._azure_permissions
+
+    def has_perm(self, perm, obj=None):
+        if not self.is_active:
+            return False
+        return self.is_superuser or perm in self.azure_permissions
+
+    def has_perms(self, perm_list, obj=None):
+        return all(self.has_perm(perm, obj) for perm in perm_list)
+
+    def has_module_perms(self, app_label):
+        if not self.is_active:
+            return False
+        if not hasattr(self, "_azure_modules"):
+            self._azure_modules = frozenset(
+                perm.split(".", 1)[0] for perm in self.azure_permissions
+            )
+        return self.is_superuser or app_label in self._azure_modules
+
+    def get_all_permissions(self, obj=None):
+        return set(self.azure_permissions) if self.is_active else set()
+
     def get_token_from_cache(self, scope=None):
+        from .metrics import span
+        from .token_store import NoCachedAccountError
         from .utils import _load_cache, _save_cache, _build_msal_app
 
         cache = _load_cache(self)
         cca = _build_msal_app(cache=cache)
         accounts = cca.get_accounts()
         if accounts:
-            result = cca.acquire_token_silent(scope, account=accounts[0])
+            with span("msal_acquire_token", flow="silent"):
+                result = cca.acquire_token_silent(scope, account=accounts[0])
             _save_cache(cache, self)
             return result
         else:
-            raise Exception
+            raise NoCachedAccountError(f"No account is cached for {self.pk}")
 
     def sync_from_ad(self):
         from .graph_api import GraphApi
+
         g = GraphApi()
         new_data = g.user.get(self.email)
         if 'error' in new_data:
@@ -80,6 +116,118 @@ class User(AbstractBaseUser):
         self.save()
 
 
+class UserTokenCache(models.Model):
+    """Compressed MSAL token cache of a user, see `token_store.DatabaseTokenStore`."""
+
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name="token_cache"
+    )
+    data = models.BinaryField()
+    # Earliest expiry of the refreshable access tokens, see `token_refresh`
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class UserPermissionIndex(models.Model):
+    """
+    The groups and app roles of a user, and the Django permissions they grant
+    through PERMISSION_MAP, see `permission_index.update_permission_index`.
+    """
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="permission_index",
+    )
+    groups = models.JSONField(default=list)
+    roles = models.JSONField(default=list)
+    permissions = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class GraphJob(models.Model):
+    """A deferred Graph write, see `jobs.JobQueue`."""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=32)
+    # Pending jobs with the same key are coalesced
+    key = models.CharField(max_length=255)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    result = models.JSONField(null=True, blank=True)
+    coalesced = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "key"])]
+
+
+class DirectoryUser(models.Model):
+    """
+    Local copy of a directory user searched by UserListView, see
+    `directory.search_users`. The `*_key` columns hold the lowercased fields
+    matched by prefix and sorted on, `search_text` the text matched by trigram
+    on PostgreSQL.
+    """
+
+    id = models.UUIDField(primary_key=True, editable=False)
+    user_principal_name = models.CharField(max_length=255, blank=True)
+    given_name = models.CharField(max_length=120, blank=True)
+    surname = models.CharField(max_length=120, blank=True)
+    job_title = models.CharField(max_length=128, blank=True)
+    account_enabled = models.BooleanField(default=True)
+    upn_key = models.CharField(max_length=255, blank=True)
+    given_name_key = models.CharField(max_length=120, blank=True)
+    surname_key = models.CharField(max_length=120, blank=True)
+    job_title_key = models.CharField(max_length=128, blank=True)
+    search_text = models.TextField(blank=True)
+    synced_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=[field], name=f"azure_auth_dir_{field}")
+            for field in ("upn_key", "given_name_key", "surname_key", "job_title_key")
+        ] + [models.Index(fields=["synced_at"], name="azure_auth_dir_synced_at")]
+
+    def update_search_fields(self):
+        self.upn_key = self.user_principal_name.lower()
+        self.given_name_key = self.given_name.lower()
+        self.surname_key = self.surname.lower()
+        self.job_title_key = self.job_title.lower()
+        self.search_text = " ".join(
+            filter(
+                None,
+                (
+                    self.given_name_key,
+                    self.surname_key,
+                    self.upn_key,
+                    self.job_title_key,
+                ),
+            )
+        )
+
+
+class DirectorySyncState(models.Model):
+    """Stores the deltaLink of the last directory sync run."""
+
+    name = models.CharField(max_length=64, primary_key=True)
+    delta_link = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
 def get_user_model():
     from django.apps import apps as django_apps
     from .settings import AZURE_AUTH
@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import msal
+import requests
+
+from .settings import AZURE_AUTH
+
+logger = logging.getLogger(__name__)
+
+# Authority and OpenID metadata requests made while constructing an MSAL app
+DISCOVERY_PATHS = ("/.well-known/openid-configuration", "/common/discovery/instance")
+
+
+class _CachedResponse:
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+        self.headers = {}
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error", response=self)
+
+
+class DiscoveryCachingHttpClient:
+    """
+    HTTP client handed to MSAL applications. Authority discovery responses are
+    cached for `ttl` seconds (and optionally persisted to `path`), so building a
+    ConfidentialClientApplication does not hit the network. Token requests are
+    sent through a pooled keep-alive session.
+    """
+
+    def __init__(self, ttl=86400, path=None, timeout=None):
+        self.ttl = ttl
+        self.path = path
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._lock = threading.Lock()
+        self._entries = self._read_file()
+
+    def get(self, url, params=None, **kwargs):
+        if not any(p in url for p in DISCOVERY_PATHS):
+            return self._request("GET", url, params=params, **kwargs)
+        key = url + "?" + json.dumps(params or {}, sort_keys=True)
+        entry = self._entries.get(key)
+        if entry and entry["expires"] > time.time():
+            return _CachedResponse(entry["status_code"], entry["text"])
+        res = self._request("GET", url, params=params, **kwargs)
+        if res.status_code == 200:
+            with self._lock:
+                self._entries[key] = {
+                    "status_code": res.status_code,
+                    "text": res.text,
+                    "expires": time.time() + self.ttl,
+                }
+                self._write_file()
+        return res
+
+    def post(self, url, params=None, data=None, **kwargs):
+        return self._request("POST", url, params=params, data=data, **kwargs)
+
+    def _request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def _read_file(self):
+        if not self.path:
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_file(self):
+        if not self.path:
+            return
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+            with os.fdopen(fd, "w") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            logger.warning("Unable to persist MSAL discovery cache to %s", self.path)
+
+
+class MsalAppPool:
+    """
+    Thread-safe pool of ConfidentialClientApplications keyed by authority.
+
+    Applications without a token cache are shared. Applications bound to a
+    user's token cache are built on demand, but reuse the discovery cache so
+    their construction is free of network calls.
+    """
+
+    def __init__(self):
+        self._apps = {}
+        self._build_locks = {}
+        self._lock = threading.Lock()
+        self._http_client = None
+
+    @property
+    def http_client(self):
+        if self._http_client is None:
+            with self._lock:
+                if self._http_client is None:
+                    self._http_client = DiscoveryCachingHttpClient(
+                        ttl=AZURE_AUTH.get("MSAL_DISCOVERY_TTL"),
+                        path=AZURE_AUTH.get("MSAL_DISCOVERY_CACHE_FILE"),
+                        timeout=(
+                            AZURE_AUTH.get("HTTP_CONNECT_TIMEOUT"),
+                            AZURE_AUTH.get("HTTP_READ_TIMEOUT"),
+                        ),
+                    )
+        return self._http_client
+
+    def get(self, cache=None, authority=None):
+        authority = authority or AZURE_AUTH.get("AUTHORITY")
+        if cache is not None:
+            return self._build(cache, authority)
+        app = self._apps.get(authority)
+        if app is None:
+            with self._lock:
+                build_lock = self._build_locks.setdefault(authority, threading.Lock())
+            # Building runs authority discovery, only once per authority
+            with build_lock:
+                app = self._apps.get(authority)
+                if app is None:
+                    app = self._build(None, authority)
+                    with self._lock:
+                        self._apps[authority] = app
+        return app
+
+    def warm(self, authorities=None):
+        """Builds the shared applications, running authority discovery."""
+        for authority in authorities or [AZURE_AUTH.get("AUTHORITY")]:
+            self.get(authority=authority)
+
+    def clear(self):
+        with self._lock:
+            self._apps.clear()
+
+    def _build(self, cache, authority):
+        return msal.ConfidentialClientApplication(
+            AZURE_AUTH.get("CLIENT_ID"),
+            authority=authority,
+            client_credential=AZURE_AUTH.get("CLIENT_SECRET"),
+            token_cache=cache,
+            http_client=self.http_client,
+        )
+
+
+msal_app_pool = MsalAppPool()
+
+
+def warm_msal_app_pool():
+    """Warms the pool in a background thread so startup is never delayed."""
+    if not AZURE_AUTH.get("CLIENT_ID") or not AZURE_AUTH.get("AUTHORITY"):
+        return
+
+    def warm():
+        try:
+            msal_app_pool.warm()
+        except Exception:
+            logger.warning("Unable to warm the MSAL application pool", exc_info=True)
+
+    threading.Thread(target=warm, name="azure-auth-msal-warmup", daemon=True).start()
@@ -0,0 +1,270 @@
+import hmac
+import json
+import logging
+from datetime import timedelta
+
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    HttpResponseNotFound,
+)
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from .backends import invalidate_cached_users
+from .graph_api import GraphApi, GraphApiError, _GraphApiUser
+from .metrics import increment
+from .models import get_user_model
+from .permissions import invalidate_directory_roles
+from .response_cache import collection_tag, get_response_cache
+from .settings import AZURE_AUTH
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationResult:
+    def __init__(self):
+        self.notifications = 0
+        self.updated = 0
+        self.removed = 0
+        self.memberships = 0
+
+    def __str__(self):
+        return (
+            f"{self.notifications} notifications: {self.updated} users updated, "
+            f"{self.removed} removed, {self.memberships} memberships refreshed"
+        )
+
+
+def _resource_id(notification):
+    data = notification.get("resourceData") or {}
+    return data.get("id") or notification.get("resource", "").rsplit("/", 1)[-1]
+
+
+def _kind(notification):
+    return notification.get("resource", "").split("/", 1)[0].lower()
+
+
+def valid_client_state(notification):
+    expected = AZURE_AUTH.get("GRAPH_NOTIFICATION_CLIENT_STATE")
+    return bool(expected) and hmac.compare_digest(
+        str(notification.get("clientState", "")).encode(), expected.encode()
+    )
+
+
+class NotificationHandler:
+    """
+    Applies Graph change notifications of users and groups.
+
+    Updated users are fetched again and written to the local User table (and
+    the DirectoryUser copy) like the directory sync does, deleted users are
+    deactivated. Membership changes of groups refresh the permission index of
+    their members. The cached Graph responses, directory roles and user
+    snapshots of every affected user are invalidated.
+    """
+
+    def __init__(self, api=None):
+        self.api = api or GraphApi()
+
+    def handle(self, notifications) -> NotificationResult:
+        from .permission_index import PermissionIndexSync
+        from .sync import DirectorySync
+
+        result = NotificationResult()
+        updated, removed, members, groups = set(), {}, set(), set()
+        for notification in notifications:
+            result.notifications += 1
+            if "lifecycleEvent" in notification:
+                self._lifecycle(notification)
+                continue
+            kind, resource_id = _kind(notification), _resource_id(notification)
+            if kind == "users":
+                if notification.get("changeType") == "deleted":
+                    updated.discard(resource_id)
+                    # Deleted users stay restorable for 30 days
+                    removed[resource_id] = "changed"
+                else:
+                    removed.pop(resource_id, None)
+                    updated.add(resource_id)
+            elif kind == "groups":
+                groups.add(resource_id)
+                data = notification.get("resourceData") or {}
+                members.update(member["id"] for member in data.get("members@delta", []))
+
+        affected = updated | set(removed) | members
+        # Cached copies are dropped before the users are fetched again
+        get_response_cache().invalidate(
+            *affected,
+            *groups,
+            *([collection_tag("/users")] if updated or removed else []),
+            *([collection_tag("/groups")] if groups else []),
+        )
+        for user_id in affected:
+            invalidate_directory_roles(user_id)
+
+        changed = {}
+        if updated:
+            fetched = self.api.user.get_many(
+                sorted(updated), select=("id", *_GraphApiUser.DELTA_SELECT)
+            )
+            for user_id, item in fetched.items():
+                if item.get("error", {}).get("code") == "Request_ResourceNotFound":
+                    removed[user_id] = "changed"
+                elif "error" in item:
+                    logger.warning(
+                        "Could not fetch the changed user %s: %s",
+                        user_id,
+                        item["error"].get("message"),
+                    )
+                else:
+                    changed[user_id] = item
+        if changed or removed:
+            DirectorySync(api=self.api, create_missing=False).apply_changes(
+                changed, removed
+            )
+        result.updated, result.removed = len(changed), len(removed)
+        to_pk = get_user_model()._meta.pk.to_python
+        if members:
+            result.memberships = (
+                PermissionIndexSync(api=self.api)
+                .run(pks=[to_pk(member) for member in members])
+                .users
+            )
+        invalidate_cached_users(*(to_pk(user_id) for user_id in affected))
+        increment("graph_notifications", result.notifications)
+        return result
+
+    def _lifecycle(self, notification):
+        event = notification["lifecycleEvent"]
+        subscription_id = notification.get("subscriptionId")
+        if event == "reauthorizationRequired":
+            try:
+                self.api.subscriptions.reauthorize(subscription_id)
+            except GraphApiError as e:
+                logger.warning(
+                    "Could not reauthorize subscription %s: %s", subscription_id, e
+                )
+        elif event == "missed":
+            logger.warning(
+                "Graph dropped notifications of subscription %s, run azure_sync",
+                subscription_id,
+            )
+        elif event == "subscriptionRemoved":
+            logger.warning(
+                "Graph removed subscription %s, run azure_subscriptions",
+                subscription_id,
+            )
+
+
+def _handle(notifications):
+    from .jobs import get_job_queue
+
+    if AZURE_AUTH.get("GRAPH_JOBS"):
+        # Graph expects an answer within 3 seconds
+        get_job_queue().enqueue(
+            "notifications", "notifications", {"value": notifications,}
+        )
+    else:
+        NotificationHandler().handle(notifications)
+
+
+@csrf_exempt
+@require_POST
+def notification_view(request):
+    """
+    Receives the Graph change notifications of the subscriptions made by
+    `manage.py azure_subscriptions`. Notifications whose clientState does not
+    match GRAPH_NOTIFICATION_CLIENT_STATE are ignored.
+    """
+    if not AZURE_AUTH.get("GRAPH_NOTIFICATION_CLIENT_STATE"):
+        return HttpResponseNotFound()
+    if "validationToken" in request.GET:
+        # Handshake of a new subscription
+        return HttpResponse(request.GET["validationToken"], content_type="text/plain")
+    try:
+        notifications = json.loads(request.body).get("value", [])
+    except (ValueError, AttributeError):
+        return HttpResponseBadRequest()
+    valid = [n for n in notifications if valid_client_state(n)]
+    if len(valid) < len(notifications):
+        logger.warning(
+            "Ignored %d notifications with an invalid clientState",
+            len(notifications) - len(valid),
+        )
+        if not valid:
+            return HttpResponseForbidden()
+    if valid:
+        _handle(valid)
+    return HttpResponse(status=202)
+
+
+class SubscriptionResult:
+    def __init__(self):
+        self.created = 0
+        self.renewed = 0
+        self.deleted = 0
+
+    def __str__(self):
+        return (
+            f"Subscriptions: {self.created} created, {self.renewed} renewed, "
+            f"{self.deleted} deleted"
+        )
+
+
+class SubscriptionManager:
+    """
+    Keeps a subscription per resource of GRAPH_NOTIFICATION_RESOURCES posting
+    to `notification_url`, creating the missing ones and extending the others
+    by GRAPH_SUBSCRIPTION_LIFETIME seconds.
+    """
+
+    def __init__(self, notification_url=None, api=None):
+        self.notification_url = notification_url or AZURE_AUTH.get(
+            "GRAPH_NOTIFICATION_URL"
+        )
+        self.api = api or GraphApi()
+
+    def _ours(self):
+        return [
+            subscription
+            for subscription in self.api.subscriptions.list()
+            if subscription.get("notificationUrl") == self.notification_url
+        ]
+
+    def ensure(self) -> SubscriptionResult:
+        result = SubscriptionResult()
+        expiration = timezone.now() + timedelta(
+            seconds=AZURE_AUTH.get("GRAPH_SUBSCRIPTION_LIFETIME")
+        )
+        resources = dict(AZURE_AUTH.get("GRAPH_NOTIFICATION_RESOURCES"))
+        for subscription in self._ours():
+            change_type = resources.pop(subscription["resource"], None)
+            if change_type is None or change_type != subscription.get("changeType"):
+                # No longer configured, or with other change types
+                self.api.subscriptions.delete(subscription["id"])
+                result.deleted += 1
+                if change_type is not None:
+                    resources[subscription["resource"]] = change_type
+                continue
+            self.api.subscriptions.renew(subscription["id"], expiration)
+            result.renewed += 1
+        for resource, change_type in resources.items():
+            self.api.subscriptions.create(
+                resource,
+                change_type,
+                self.notification_url,
+                AZURE_AUTH.get("GRAPH_NOTIFICATION_CLIENT_STATE"),
+                expiration,
+                lifecycle_notification_url=self.notification_url,
+            )
+            result.created += 1
+        return result
+
+    def delete(self) -> SubscriptionResult:
+        result = SubscriptionResult()
+        for subscription in self._ours():
+            self.api.subscriptions.delete(subscription["id"])
+            result.deleted += 1
+        return result
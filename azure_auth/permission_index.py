@@ -0,0 +1,134 @@
+from django.db import transaction
+
+from .backends import invalidate_cached_users
+from .graph_api import GraphApi
+from .models import UserPermissionIndex, get_user_model
+from .settings import AZURE_AUTH
+
+
+def map_permissions(groups, roles):
+    """Returns the Django permissions granted by groups and app roles."""
+    mapping = AZURE_AUTH.get("PERMISSION_MAP")
+    permissions = set()
+    for key in (*groups, *roles):
+        permissions.update(mapping.get(key, ()))
+    return sorted(permissions)
+
+
+def _apply(index, groups=None, roles=None):
+    """Updates an index in memory, returning whether anything changed."""
+    before = (index.groups, index.roles, index.permissions)
+    if groups is not None:
+        index.groups = sorted(set(groups))
+    if roles is not None:
+        index.roles = sorted(set(roles))
+    index.permissions = map_permissions(index.groups, index.roles)
+    return (index.groups, index.roles, index.permissions) != before
+
+
+def update_permission_index(user_pk, groups=None, roles=None):
+    """
+    Stores the groups and app roles of a user and recomputes its permissions.
+    Memberships passed as None are left unchanged.
+    """
+    index, created = UserPermissionIndex.objects.get_or_create(user_id=user_pk)
+    if _apply(index, groups, roles) or created:
+        index.save()
+        invalidate_cached_users(user_pk)
+    return index
+
+
+def claims_memberships(claims, api=None):
+    """
+    Returns the groups and app roles named by ID token claims. When the user
+    has too many groups for the token (group overage), they are read from
+    Graph instead.
+    """
+    groups = claims.get("groups")
+    if groups is None and "groups" in claims.get("_claim_names", {}):
+        groups = (api or GraphApi()).user.transitive_member_of(claims.get("oid"))
+    return groups, claims.get("roles", [])
+
+
+class PermissionSyncResult:
+    def __init__(self):
+        self.users = 0
+        self.changed = 0
+        self.failed = 0
+
+    def __str__(self):
+        return (
+            f"Permissions of {self.users} users synchronized: "
+            f"{self.changed} changed, {self.failed} failed"
+        )
+
+
+class PermissionIndexSync:
+    """
+    Refreshes the group memberships of the local users from Graph transitive
+    memberships, and recomputes their permissions. App roles are only known
+    from ID tokens and are kept as stored at the last login.
+    """
+
+    def __init__(self, api=None, chunk_size=None):
+        self.api = api or GraphApi()
+        self.chunk_size = chunk_size or AZURE_AUTH.get("SYNC_CHUNK_SIZE")
+        self.User = get_user_model()
+
+    def run(self, remap_only=False, pks=None) -> PermissionSyncResult:
+        """
+        :param remap_only: Only recompute the permissions from the stored
+            memberships, e.g. after PERMISSION_MAP changed, without calling Graph.
+        :param pks: Only synchronize these users.
+        """
+        result = PermissionSyncResult()
+        users = self.User.objects.filter(is_active=True)
+        if pks is not None:
+            users = users.filter(pk__in=list(pks))
+        pks = users.values_list("pk", flat=True)
+        chunk = []
+        for pk in pks.iterator(chunk_size=self.chunk_size):
+            chunk.append(pk)
+            if len(chunk) >= self.chunk_size:
+                self._sync(chunk, remap_only, result)
+                chunk = []
+        if chunk:
+            self._sync(chunk, remap_only, result)
+        return result
+
+    def _sync(self, pks, remap_only, result):
+        # Graph is called before the transaction, which only spans the writes
+        memberships = (
+            {}
+            if remap_only
+            else self.api.user.transitive_member_of_many([str(pk) for pk in pks])
+        )
+        to_create, to_update = [], []
+        with transaction.atomic():
+            # Locked so that the roles stored by a concurrent login are kept
+            indexes = UserPermissionIndex.objects.select_for_update().in_bulk(pks)
+            for pk in pks:
+                result.users += 1
+                groups = memberships.get(str(pk))
+                if groups is None and not remap_only:
+                    result.failed += 1
+                    continue
+                index = indexes.get(pk)
+                if index is None:
+                    if remap_only:
+                        continue
+                    index = UserPermissionIndex(user_id=pk)
+                    to_create.append(index)
+                    _apply(index, groups)
+                elif _apply(index, groups):
+                    to_update.append(index)
+            if to_update:
+                UserPermissionIndex.objects.bulk_update(
+                    to_update, ["groups", "roles", "permissions"]
+                )
+            if to_create:
+                UserPermissionIndex.objects.bulk_create(
+                    to_create, ignore_conflicts=True
+                )
+        result.changed += len(to_update) + len(to_create)
+        invalidate_cached_users(*(index.user_id for index in to_update + to_create))
@@ -1,16 +1,123 @@
+import threading
+import time
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth.mixins import AccessMixin
+from django.contrib.auth.views import redirect_to_login
+from django.core.cache import caches
+from django.core.exceptions import PermissionDenied
+
+from .metrics import increment, span
+from .settings import AZURE_AUTH
+
+ROLE_CACHE_PREFIX = "azure_auth:roles:"
+
+
+def _role_cache():
+    return caches[AZURE_AUTH.get("ROLE_CACHE")]
+
+
+def _store_directory_roles(azure_object_id, roles):
+    if roles is None:
+        return None
+    names = [role.get("displayName") for role in roles]
+    _role_cache().set(
+        ROLE_CACHE_PREFIX + str(azure_object_id),
+        {"roles": names, "fetched_at": time.time()},
+        AZURE_AUTH.get("ROLE_CACHE_TTL") + AZURE_AUTH.get("ROLE_CACHE_STALE_TTL"),
+    )
+    return names
+
+
+def _fetch_directory_roles(azure_object_id):
+    from .graph_api import GraphApi
+
+    roles = GraphApi().user.directory_roles(azure_object_id)
+    return _store_directory_roles(azure_object_id, roles)
+
+
+def _revalidate_directory_roles(azure_object_id):
+    # Only one process refreshes a stale entry at a time
+    lock_key = ROLE_CACHE_PREFIX + "lock:" + str(azure_object_id)
+    if not _role_cache().add(lock_key, 1, 30):
+        return
+
+    def refresh():
+        try:
+            _fetch_directory_roles(azure_object_id)
+        finally:
+            _role_cache().delete(lock_key)
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+def get_directory_roles(azure_object_id):
+    """
+    Returns the display names of the directory roles of a user.
+
+    Results are cached for ROLE_CACHE_TTL seconds. For a further
+    ROLE_CACHE_STALE_TTL seconds the stale result is returned while it is
+    refreshed in the background. Returns None if Graph could not be queried.
+    """
+    with span("role_check"):
+        entry = _role_cache().get(ROLE_CACHE_PREFIX + str(azure_object_id))
+        if entry is None:
+            increment("role_cache", result="miss")
+            return _fetch_directory_roles(azure_object_id)
+        if time.time() - entry["fetched_at"] > AZURE_AUTH.get("ROLE_CACHE_TTL"):
+            increment("role_cache", result="stale")
+            _revalidate_directory_roles(azure_object_id)
+        else:
+            increment("role_cache", result="hit")
+        return entry["roles"]
+
+
+async def aget_directory_roles(azure_object_id):
+    """Async version of `get_directory_roles`."""
+    from .async_graph_api import AsyncGraphApi
+
+    entry = await sync_to_async(_role_cache().get)(
+        ROLE_CACHE_PREFIX + str(azure_object_id)
+    )
+    if entry is None:
+        roles = await AsyncGraphApi().user.directory_roles(azure_object_id)
+        return await sync_to_async(_store_directory_roles)(azure_object_id, roles)
+    if time.time() - entry["fetched_at"] > AZURE_AUTH.get("ROLE_CACHE_TTL"):
+        await sync_to_async(_revalidate_directory_roles)(azure_object_id)
+    return entry["roles"]
+
+
+def invalidate_directory_roles(azure_object_id):
+    """Forgets the cached directory roles of a user."""
+    _role_cache().delete(ROLE_CACHE_PREFIX + str(azure_object_id))
 
 
 class UserAdminRequiredMixin(AccessMixin):
     """Verify that the current user is authenticated and is a superuser."""
+
+    admin_role = 'User Account Administrator'
+
     def dispatch(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return self.handle_no_permission()
-        from .graph_api import GraphApi
-        roles = GraphApi().user.directory_roles(request.user.email)
-        is_admin = len(list(
-            filter(lambda x: x.get('displayName') == 'User Account Administrator', roles)
-        )) != 0
-        if not is_admin:
+        roles = get_directory_roles(request.user.azure_object_id)
+        if not roles or self.admin_role not in roles:
             return self.handle_no_permission()
         return super().dispatch(request, *args, **kwargs)
+
+
+async def user_admin_required(request, admin_role=UserAdminRequiredMixin.admin_role):
+    """
+    Async counterpart of UserAdminRequiredMixin for async views. Raises
+    PermissionDenied, or returns a redirect to the login page that the view
+    must return, when the user is not a user administrator.
+    """
+    user = await sync_to_async(
+        lambda: request.user if request.user.is_authenticated else None
+    )()
+    if user is None:
+        return redirect_to_login(request.get_full_path())
+    roles = await aget_directory_roles(user.azure_object_id)
+    if not roles or admin_role not in roles:
+        raise PermissionDenied
+    return None
@@ -0,0 +1,302 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from .graph_api import GraphApi, GraphApiError, _GraphApiUser
+from .settings import AZURE_AUTH
+from .singleflight import SingleFlight
+from .tokens import TokenAcquisitionError
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER = (
+    b'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 64 64">'
+    b'<rect width="64" height="64" fill="#d0d4d9"/>'
+    b'<circle cx="32" cy="25" r="12" fill="#f5f6f7"/>'
+    b'<path d="M10 60c2-13 11-19 22-19s20 6 22 19z" fill="#f5f6f7"/></svg>'
+)
+
+
+def _etag(content):
+    return '"' + hashlib.sha256(content).hexdigest()[:32] + '"'
+
+
+class Photo:
+    """
+    A photo, or the placeholder, ready to be served. A transient placeholder
+    stands for a photo that could not be fetched, and is not cached.
+    """
+
+    def __init__(
+        self, content, content_type, etag=None, placeholder=False, transient=False
+    ):
+        self.content = content
+        self.content_type = content_type
+        self.etag = etag or _etag(content)
+        self.placeholder = placeholder
+        self.transient = transient
+
+
+PLACEHOLDER_PHOTO = Photo(PLACEHOLDER, "image/svg+xml", placeholder=True)
+UNAVAILABLE_PHOTO = Photo(
+    PLACEHOLDER, "image/svg+xml", placeholder=True, transient=True
+)
+
+
+class PhotoCache:
+    """
+    Size bounded on-disk cache of profile photos. Each user has a directory
+    holding a thumbnail per size and a metadata file, whose modification time
+    orders the least recently used users evicted once `max_bytes` is exceeded.
+    """
+
+    META = "meta.json"
+
+    def __init__(self, directory, max_bytes=50 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._used = None
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Returns the metadata of a cached user, or None."""
+        path = os.path.join(self._user_dir(user_id), self.META)
+        try:
+            with open(path) as f:
+                meta = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return meta
+
+    def read(self, user_id, size, meta):
+        """Returns a cached thumbnail, or None if it was evicted meanwhile."""
+        variant = meta["variants"].get(str(size))
+        if variant is None:
+            return None
+        try:
+            with open(os.path.join(self._user_dir(user_id), f"{size}.img"), "rb") as f:
+                content = f.read()
+        except OSError:
+            return None
+        return Photo(content, meta["content_type"], variant)
+
+    def store(self, user_id, variants, content_type=None, media_etag=None):
+        """
+        Replaces the cached photo of a user.
+        :param variants: a dict mapping sizes to images, empty for a user
+            without photo.
+        """
+        directory = self._user_dir(user_id)
+        os.makedirs(directory, exist_ok=True)
+        for size, content in variants.items():
+            self._write(os.path.join(directory, f"{size}.img"), content)
+        meta = {
+            "variants": {str(size): _etag(c) for size, c in variants.items()},
+            "content_type": content_type,
+            "media_etag": media_etag,
+            "fetched_at": time.time(),
+        }
+        self._write(os.path.join(directory, self.META), json.dumps(meta).encode())
+        with self._lock:
+            if self._used is not None:
+                self._used += sum(len(c) for c in variants.values())
+        self._evict(keep=directory)
+        return meta
+
+    def touch(self, user_id, meta):
+        """Marks the cached photo of a user as fresh after a revalidation."""
+        meta = {**meta, "fetched_at": time.time()}
+        self._write(
+            os.path.join(self._user_dir(user_id), self.META), json.dumps(meta).encode()
+        )
+        return meta
+
+    def _user_dir(self, user_id):
+        return os.path.join(self.directory, str(user_id).lower())
+
+    def _write(self, path, content):
+        # Readers never see a partially written file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+    def _scan(self):
+        users = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir():
+                continue
+            try:
+                used = sum(f.stat().st_size for f in os.scandir(entry.path))
+                accessed = os.stat(os.path.join(entry.path, self.META)).st_mtime
+            except OSError:
+                used, accessed = 0, 0
+            users.append((accessed, used, entry.path))
+        return users
+
+    def _evict(self, keep=None):
+        with self._lock:
+            if self._used is not None and self._used <= self.max_bytes:
+                return
+            users = self._scan()
+            self._used = sum(used for _, used, _ in users)
+            # Evicts down to 90% of the limit, so that evictions are batched
+            for _, used, path in sorted(users):
+                if self._used <= self.max_bytes * 0.9:
+                    break
+                if path == keep:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                self._used -= used
+
+
+class PhotoService:
+    """
+    Serves thumbnails of the profile photos of the users from a PhotoCache.
+
+    A photo is downloaded once and every size of `sizes` is computed from it
+    with Pillow. Without Pillow, each size is downloaded from the nearest size
+    stored by Graph. Photos older than `revalidate_after` seconds are still
+    served while their media ETag is checked in the background.
+    """
+
+    def __init__(
+        self, cache: PhotoCache, sizes=(48, 96, 240), revalidate_after=86400, api=None
+    ):
+        self.cache = cache
+        self.sizes = tuple(sizes)
+        self.revalidate_after = revalidate_after
+        self._api = api
+        self._fetches = SingleFlight()
+        self._revalidating = set()
+        self._lock = threading.Lock()
+
+    @property
+    def api(self):
+        return self._api or GraphApi()
+
+    def get(self, user_id, size) -> Photo:
+        """
+        Returns a thumbnail of a user, the placeholder if it has no photo, or
+        UNAVAILABLE_PHOTO if its photo could not be fetched.
+        """
+        meta = self.cache.get(user_id)
+        if meta is None:
+            meta = self._fetches.do(str(user_id), lambda: self._fetch(user_id))
+            if meta is None:
+                return UNAVAILABLE_PHOTO
+        elif time.time() - meta["fetched_at"] > self.revalidate_after:
+            self._revalidate(user_id, meta)
+        photo = None
+        if meta["variants"]:
+            photo = self.cache.read(user_id, size, meta)
+            if photo is None:
+                # Evicted since the metadata was read
+                meta = self._fetches.do(str(user_id), lambda: self._fetch(user_id))
+                if meta is None:
+                    return UNAVAILABLE_PHOTO
+                photo = self.cache.read(user_id, size, meta)
+        return photo or PLACEHOLDER_PHOTO
+
+    def _fetch(self, user_id, media_etag=False):
+        try:
+            if media_etag is False:
+                # Read first, a photo changed meanwhile is fetched again later
+                media_etag = self.api.user.photo_etag(str(user_id))
+            variants, content_type = {}, None
+            if media_etag is not None:
+                if Image is not None:
+                    variants, content_type = self._resize(user_id)
+                else:
+                    variants, content_type = self._download(user_id)
+        except (GraphApiError, TokenAcquisitionError, OSError) as e:
+            # OSError covers the connection errors of requests
+            logger.warning("Could not fetch the photo of %s: %s", user_id, e)
+            return None
+        return self.cache.store(user_id, variants, content_type, media_etag)
+
+    def _resize(self, user_id):
+        photo = self.api.user.photo(str(user_id))
+        if photo is None:
+            return {}, None
+        variants = {}
+        try:
+            image = Image.open(io.BytesIO(photo[0])).convert("RGB")
+            for size in self.sizes:
+                out = io.BytesIO()
+                ImageOps.fit(image, (size, size), Image.LANCZOS).save(
+                    out, "JPEG", quality=85, optimize=True
+                )
+                variants[size] = out.getvalue()
+        except (OSError, ValueError, SyntaxError, Image.DecompressionBombError) as e:
+            # Cached as a user without photo until its media ETag changes
+            logger.warning("Could not decode the photo of %s: %s", user_id, e)
+            return {}, None
+        return variants, "image/jpeg"
+
+    def _download(self, user_id):
+        variants, content_type = {}, None
+        for size in self.sizes:
+            stored = [s for s in _GraphApiUser.PHOTO_SIZES if s >= size]
+            photo = self.api.user.photo(str(user_id), stored[0] if stored else None)
+            if photo is None and stored:
+                # Photos smaller than the size are only available in full
+                photo = self.api.user.photo(str(user_id))
+            if photo is None:
+                return {}, None
+            variants[size], content_type = photo
+        return variants, content_type
+
+    def _revalidate(self, user_id, meta):
+        with self._lock:
+            if user_id in self._revalidating:
+                return
+            self._revalidating.add(user_id)
+
+        def revalidate():
+            try:
+                media_etag = self.api.user.photo_etag(str(user_id))
+                if media_etag == meta.get("media_etag"):
+                    self.cache.touch(user_id, meta)
+                else:
+                    self._fetch(user_id, media_etag)
+            except Exception:
+                logger.exception("Could not revalidate the photo of %s", user_id)
+            finally:
+                with self._lock:
+                    self._revalidating.discard(user_id)
+
+        threading.Thread(target=revalidate, daemon=True).start()
+
+
+_photo_service = None
+_photo_service_lock = threading.Lock()
+
+
+def get_photo_service() -> PhotoService:
+    """Returns the process wide photo service built from the settings."""
+    global _photo_service
+    if _photo_service is None:
+        with _photo_service_lock:
+            if _photo_service is None:
+                directory = AZURE_AUTH.get("PHOTO_CACHE_DIR") or os.path.join(
+                    tempfile.gettempdir(), "azure_auth_photos"
+                )
+                _photo_service = PhotoService(
+                    PhotoCache(directory, AZURE_AUTH.get("PHOTO_CACHE_MAX_BYTES")),
+                    sizes=AZURE_AUTH.get("PHOTO_SIZES"),
+                    revalidate_after=AZURE_AUTH.get("PHOTO_REVALIDATE_AFTER"),
+                )
+    return _photo_service
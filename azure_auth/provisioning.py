@@ -0,0 +1,198 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.contrib.auth.hashers import make_password
+
+from .forms import UserCreateForm
+from .graph_api import GraphApi
+from .models import get_user_model
+from .settings import AZURE_AUTH
+
+
+def read_rows(path):
+    """Yields (line number, row) for every user of a CSV or JSONL file."""
+    with open(path, newline="") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    yield number, json.loads(line)
+        else:
+            for number, row in enumerate(csv.DictReader(f), 2):
+                yield number, row
+
+
+class Checkpoint:
+    """
+    Append-only record of the rows already handled, so that an interrupted
+    run resumes where it stopped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        # Whether an earlier run left rows that may have been created already
+        self.resumed = os.path.exists(path)
+        if self.resumed:
+            with open(path) as f:
+                self.done = {int(line) for line in f if line.strip()}
+        self._file = open(path, "a")
+
+    def __contains__(self, number):
+        return number in self.done
+
+    def add(self, numbers):
+        self._file.writelines(f"{number}\n" for number in numbers)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.done.update(numbers)
+
+    def close(self):
+        self._file.close()
+
+
+def _already_exists(res):
+    return "already exists" in (res.get("error") or {}).get("message", "")
+
+
+class ProvisionResult:
+    def __init__(self):
+        self.created = 0
+        self.skipped = 0
+        self.errors = []
+        self.latencies = []
+        self.elapsed = 0.0
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))]
+
+    def __str__(self):
+        throughput = self.created / self.elapsed if self.elapsed else 0.0
+        return (
+            f"{self.created} created, {len(self.errors)} failed, {self.skipped} "
+            f"skipped in {self.elapsed:.1f}s ({throughput:.1f} users/s), "
+            f"latency p50={self.percentile(50) * 1000:.0f}ms "
+            f"p95={self.percentile(95) * 1000:.0f}ms "
+            f"p99={self.percentile(99) * 1000:.0f}ms"
+        )
+
+
+class Provisioner:
+    """
+    Creates the users of a file in Azure AD with bounded parallelism, and
+    mirrors them into the local User table in batches.
+    """
+
+    def __init__(self, api=None, workers=8, batch_size=None, on_error=None):
+        self.api = api or GraphApi()
+        self.workers = workers
+        self.batch_size = batch_size or AZURE_AUTH.get("SYNC_CHUNK_SIZE")
+        self.on_error = on_error
+        self.User = get_user_model()
+
+    def run(self, path, checkpoint_path=None) -> ProvisionResult:
+        result = ProvisionResult()
+        checkpoint = Checkpoint(checkpoint_path or path + ".checkpoint")
+        started = time.monotonic()
+        pending, done, users = set(), [], []
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                try:
+                    for number, row in read_rows(path):
+                        if number in checkpoint:
+                            result.skipped += 1
+                            continue
+                        form = UserCreateForm(row)
+                        if not form.is_valid():
+                            self._error(result, number, form.errors.as_json())
+                            done.append(number)
+                            continue
+                        pending.add(
+                            executor.submit(
+                                self._create,
+                                number,
+                                form.cleaned_data,
+                                checkpoint.resumed,
+                            )
+                        )
+                        # Keep a bounded number of rows in flight
+                        if len(pending) >= self.workers * 2:
+                            finished, pending = wait(
+                                pending, return_when=FIRST_COMPLETED
+                            )
+                            self._collect(finished, result, done, users)
+                        if len(users) >= self.batch_size:
+                            self._flush(checkpoint, done, users)
+                            done, users = [], []
+                except BaseException:
+                    # Rows already sent when the run is interrupted are collected,
+                    # mirrored and checkpointed, so that a rerun skips them
+                    for future in pending:
+                        future.cancel()
+                    raise
+                finally:
+                    finished, _ = wait(pending)
+                    self._collect(
+                        [f for f in finished if not f.cancelled()], result, done, users
+                    )
+        finally:
+            try:
+                self._flush(checkpoint, done, users)
+            finally:
+                checkpoint.close()
+        result.elapsed = time.monotonic() - started
+        return result
+
+    def _create(self, number, data, resumed=False):
+        started = time.monotonic()
+        try:
+            res = self.api.user.create(**data, return_user=True)
+            if resumed and _already_exists(res):
+                # Created by the interrupted run before it was checkpointed
+                res = self.api.user.get(
+                    data["username"] + "@" + AZURE_AUTH.get("DOMAIN")
+                )
+        except Exception as e:
+            # Not checkpointed, the row is tried again by the next run
+            res = {"error": {"message": f"{type(e).__name__}: {e}"}, "retry": True}
+        return number, data, res, time.monotonic() - started
+
+    def _collect(self, finished, result, done, users):
+        for future in finished:
+            number, data, res, latency = future.result()
+            result.latencies.append(latency)
+            if "error" in res:
+                if not res.get("retry"):
+                    done.append(number)
+                self._error(result, number, res["error"].get("message"))
+                continue
+            done.append(number)
+            result.created += 1
+            users.append(
+                self.User(
+                    azure_object_id=res["id"],
+                    email=res.get("userPrincipalName"),
+                    first_name=data["first_name"],
+                    last_name=data["last_name"],
+                    password=make_password(None),
+                )
+            )
+
+    def _flush(self, checkpoint, done, users):
+        if users:
+            self.User.objects.bulk_create(
+                users, batch_size=self.batch_size, ignore_conflicts=True
+            )
+        # Rows are only marked done once their local copy is written
+        if done:
+            checkpoint.add(done)
+
+    def _error(self, result, number, message):
+        result.errors.append((number, message))
+        if self.on_error:
+            self.on_error(number, message)
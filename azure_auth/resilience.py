@@ -0,0 +1,354 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from .settings import AZURE_AUTH
+
+# Path segments identifying a single object, folded into one endpoint key
+ID_SEGMENT = re.compile(r"^([0-9a-f-]{36}|[^/]*@[^/]*|\{[^}]*\})$", re.IGNORECASE)
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "PATCH", "DELETE")
+THROTTLE_STATUS = (429, 503)
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+def endpoint_key(method, url):
+    """Returns e.g. 'GET /v1.0/users/{id}/memberOf' for a request."""
+    segments = [
+        "{id}" if ID_SEGMENT.match(segment) else segment
+        for segment in urlparse(url).path.split("/")
+    ]
+    return f"{method.upper()} {'/'.join(segments)}"
+
+
+def parse_retry_after(value):
+    """
+    Returns the seconds to wait given by a Retry-After header, in seconds or
+    as an HTTP date, or None if it is missing or invalid.
+    """
+    if not value:
+        return None
+    if str(value).strip().isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Client side rate limiter. The rate is cut on every throttling response and
+    slowly raised back to `max_rate` on successes (AIMD).
+    """
+
+    def __init__(
+        self, max_rate, capacity=None, min_rate=1.0, decrease=0.5, increase=0.1
+    ):
+        self.max_rate = float(max_rate)
+        self.rate = float(max_rate)
+        self.capacity = float(capacity or max_rate)
+        self.min_rate = min_rate
+        self.decrease = decrease
+        self.increase = increase
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Takes a token and returns the seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def on_throttle(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds, then lets a single trial call through. The trial
+    closes the breaker on success and opens it again on failure or throttling.
+    A trial whose outcome is never recorded opens it again after
+    `reset_timeout` seconds.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            now = time.monotonic()
+            if (
+                self.state == self.HALF_OPEN
+                and now - self._trial_at >= self.reset_timeout
+            ):
+                self._open(now)
+            if self.state == self.OPEN:
+                if now - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._trial_at = now
+                return True
+            # Only the trial call goes through while half open
+            return self.state == self.CLOSED
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._open(time.monotonic())
+
+    def record_throttle(self):
+        """Throttling is not a failure of the endpoint, but fails a trial call."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._open(time.monotonic())
+
+    def _open(self, now):
+        self.state = self.OPEN
+        self._opened_at = now
+
+
+class CircuitOpenResponse:
+    """Response returned without any request while a circuit is open."""
+
+    status_code = 503
+
+    def __init__(self, endpoint):
+        self.headers = {}
+        self._body = {
+            "error": {
+                "code": "circuitOpen",
+                "message": f"Graph calls to '{endpoint}' are suspended after repeated failures",
+            }
+        }
+        self.content = json.dumps(self._body).encode()
+        self.text = self.content.decode()
+
+    def json(self):
+        return self._body
+
+
+class Resilience:
+    """
+    Retry, rate limiting and circuit breaking policy shared by the sync and
+    async Graph transports.
+    """
+
+    def __init__(
+        self,
+        max_retries=4,
+        backoff_base=0.5,
+        backoff_max=30.0,
+        rate_limit=None,
+        rate_burst=None,
+        failure_threshold=5,
+        reset_timeout=30,
+    ):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.limiter = TokenBucket(rate_limit, rate_burst) if rate_limit else None
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: defaultdict(int))
+
+    def breaker(self, endpoint) -> CircuitBreaker:
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(
+                    endpoint, CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                )
+        return breaker
+
+    def acquire(self):
+        """Returns the seconds to wait before sending the next request."""
+        return self.limiter.reserve() if self.limiter else 0.0
+
+    def record(self, endpoint, status=None, error=None):
+        """
+        Records the outcome of a request, a failure when it raised `error` or
+        got no response.
+        """
+        self._count(endpoint, "requests")
+        breaker = self.breaker(endpoint)
+        if error is not None or status is None or (status >= 500 and status != 503):
+            breaker.record_failure()
+            self._count(endpoint, "failures")
+        elif status in THROTTLE_STATUS:
+            # Throttling is not a failure of the endpoint, but slows every call
+            self._count(endpoint, "throttled")
+            if self.limiter:
+                self.limiter.on_throttle()
+            if status == 503:
+                breaker.record_failure()
+            else:
+                breaker.record_throttle()
+        else:
+            breaker.record_success()
+            if self.limiter:
+                self.limiter.on_success()
+
+    def retry_delay(self, attempt, method, status=None, error=None, headers=None):
+        """
+        Returns the seconds to wait before retrying a request, or None if it
+        must not be retried.
+        """
+        if attempt >= self.max_retries:
+            return None
+        if status == 429:
+            pass  # Graph did not process the request, always safe to retry
+        elif method.upper() not in IDEMPOTENT_METHODS:
+            return None
+        elif error is None and status not in RETRY_STATUS:
+            return None
+        retry_after = parse_retry_after((headers or {}).get("Retry-After"))
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        # Exponential backoff with full jitter
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        )
+
+    def record_retry(self, endpoint):
+        self._count(endpoint, "retries")
+
+    def record_rejected(self, endpoint):
+        self._count(endpoint, "rejected")
+
+    def stats(self):
+        """Returns the counters of every endpoint, and the limiter state."""
+        with self._lock:
+            endpoints = {
+                endpoint: {
+                    **counters,
+                    "circuit": getattr(
+                        self._breakers.get(endpoint), "state", CircuitBreaker.CLOSED
+                    ),
+                }
+                for endpoint, counters in self._stats.items()
+            }
+        return {
+            "rate": self.limiter.rate if self.limiter else None,
+            "endpoints": endpoints,
+        }
+
+    def _count(self, endpoint, key):
+        with self._lock:
+            self._stats[endpoint][key] += 1
+
+
+class ResilientTransport:
+    """Wraps a transport, applying a Resilience policy to every request."""
+
+    def __init__(self, transport, resilience: Resilience):
+        self.transport = transport
+        self.resilience = resilience
+
+    def request(self, method, url, **kwargs):
+        endpoint = endpoint_key(method, url)
+        resilience = self.resilience
+        # GraphBatch retries its envelopes and their requests itself
+        retries = not urlparse(url).path.endswith("/$batch")
+        attempt = 0
+        while True:
+            if not resilience.breaker(endpoint).allow():
+                resilience.record_rejected(endpoint)
+                return CircuitOpenResponse(endpoint)
+            if wait := resilience.acquire():
+                time.sleep(wait)
+            res = error = None
+            try:
+                res = self.transport.request(method, url, **kwargs)
+            except (ConnectionError, TimeoutError, OSError) as e:
+                error = e
+            finally:
+                # Recorded whatever happened, to resolve the trial of a half open breaker
+                resilience.record(
+                    endpoint, status=getattr(res, "status_code", None), error=error
+                )
+            delay = None
+            if retries and res is None:
+                delay = resilience.retry_delay(attempt, method, error=error)
+            elif retries:
+                delay = resilience.retry_delay(
+                    attempt, method, status=res.status_code, headers=res.headers
+                )
+            if delay is None:
+                if res is None:
+                    raise error
+                return res
+            resilience.record_retry(endpoint)
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def close(self):
+        if hasattr(self.transport, "close"):
+            self.transport.close()
+
+
+_resilience = None
+_resilience_lock = threading.Lock()
+
+
+def get_resilience() -> Resilience:
+    """Returns the process wide policy built from the `AZURE_AUTH` settings."""
+    global _resilience
+    if _resilience is None:
+        with _resilience_lock:
+            if _resilience is None:
+                _resilience = Resilience(
+                    max_retries=AZURE_AUTH.get("GRAPH_MAX_RETRIES"),
+                    backoff_base=AZURE_AUTH.get("GRAPH_BACKOFF_BASE"),
+                    backoff_max=AZURE_AUTH.get("GRAPH_BACKOFF_MAX"),
+                    rate_limit=AZURE_AUTH.get("GRAPH_RATE_LIMIT"),
+                    rate_burst=AZURE_AUTH.get("GRAPH_RATE_BURST"),
+                    failure_threshold=AZURE_AUTH.get("GRAPH_CIRCUIT_FAILURES"),
+                    reset_timeout=AZURE_AUTH.get("GRAPH_CIRCUIT_RESET"),
+                )
+    return _resilience
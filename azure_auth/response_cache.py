@@ -0,0 +1,348 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode, urlparse
+
+from .resilience import ID_SEGMENT, endpoint_key
+from .settings import AZURE_AUTH
+
+
+class CachedResponse:
+    """A Graph GET response served from the ResponseCache."""
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.text = content.decode()
+        self.from_cache = True
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class _Entry:
+    __slots__ = (
+        "status_code",
+        "headers",
+        "content",
+        "stored_at",
+        "ttl",
+        "tags",
+        "versions",
+    )
+
+    def __init__(
+        self, status_code, headers, content, ttl, tags, stored_at=None, versions=None
+    ):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.stored_at = stored_at or time.time()
+        self.ttl = ttl
+        self.tags = tags
+        # Versions of the tags in the shared tier when the entry was stored
+        self.versions = versions or {}
+
+    @property
+    def fresh(self):
+        return time.time() - self.stored_at < self.ttl
+
+    @property
+    def etag(self):
+        return self.headers.get("ETag")
+
+    def response(self):
+        return CachedResponse(self.status_code, self.headers, self.content)
+
+    def dump(self):
+        return (
+            self.status_code,
+            self.headers,
+            self.content,
+            self.ttl,
+            list(self.tags),
+            self.stored_at,
+            self.versions,
+        )
+
+
+class ResponseCache:
+    """
+    LRU of Graph GET responses bounded by `max_entries` and `max_bytes`, with
+    an optional Django cache tier shared by every process. Entries are tagged
+    with the object ids and user principal names they hold, so a write to an
+    object invalidates every entry about it. Responses larger than an eighth
+    of `max_bytes` are not cached.
+    """
+
+    def __init__(
+        self,
+        max_entries=1024,
+        default_ttl=30,
+        ttls=None,
+        cache_alias=None,
+        max_bytes=16 * 1024 * 1024,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.ttls = ttls or {}
+        self.cache_alias = cache_alias
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "revalidated": 0, "misses": 0}
+
+    def key(self, url, params=None):
+        if params:
+            url += ("&" if "?" in url else "?") + urlencode(sorted(params.items()))
+        return url
+
+    def ttl(self, url):
+        return self.ttls.get(endpoint_key("GET", url), self.default_ttl)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        shared = self._shared_cache()
+        if entry is not None and shared is not None:
+            # Invalidated by another process since it was stored
+            if entry.versions != self._versions(shared, entry.versions):
+                with self._lock:
+                    if self._entries.get(key) is entry:
+                        self._bytes -= len(self._entries.pop(key).content)
+                entry = None
+        if entry is None and shared is not None:
+            if dumped := shared.get(self._shared_key(key)):
+                status_code, headers, content, ttl, tags, stored_at, versions = dumped
+                # Invalidated by any process bumping the version of one of its tags
+                if versions == self._versions(shared, versions):
+                    entry = _Entry(
+                        status_code,
+                        headers,
+                        content,
+                        ttl,
+                        set(tags),
+                        stored_at,
+                        versions,
+                    )
+                    self._put(key, entry)
+        return entry
+
+    def set(self, key, response):
+        if len(response.content) > self.max_bytes // 8:
+            return None
+        tags = self._tags(key, response)
+        shared = self._shared_cache()
+        entry = _Entry(
+            response.status_code,
+            {"ETag": response.headers.get("ETag")}
+            if response.headers.get("ETag")
+            else {},
+            response.content,
+            self.ttl(key),
+            tags,
+            versions=self._versions(shared, tags) if shared is not None else None,
+        )
+        self._put(key, entry)
+        if shared is not None:
+            shared.set(self._shared_key(key), entry.dump(), max(entry.ttl, 1) * 10)
+        return entry
+
+    def touch(self, key, entry):
+        """Marks an entry as fresh again after a 304 revalidation."""
+        entry.stored_at = time.time()
+        if (shared := self._shared_cache()) is not None:
+            shared.set(self._shared_key(key), entry.dump(), max(entry.ttl, 1) * 10)
+
+    def invalidate(self, *tags):
+        """Drops every entry tagged with one of `tags` (ids or principal names)."""
+        tags = {str(tag).lower() for tag in tags}
+        with self._lock:
+            # Entries about the same object carry its other identifiers as tags
+            for entry in self._entries.values():
+                if entry.tags & tags:
+                    tags |= entry.tags
+            for key in [k for k, e in self._entries.items() if e.tags & tags]:
+                self._bytes -= len(self._entries.pop(key).content)
+        if (shared := self._shared_cache()) is not None:
+            for tag in tags:
+                try:
+                    shared.incr(self._version_key(tag))
+                except ValueError:
+                    shared.set(self._version_key(tag), 2, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries), "bytes": self._bytes}
+
+    def _put(self, key, entry):
+        with self._lock:
+            if (previous := self._entries.pop(key, None)) is not None:
+                self._bytes -= len(previous.content)
+            self._entries[key] = entry
+            self._bytes += len(entry.content)
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                self._bytes -= len(self._entries.popitem(last=False)[1].content)
+
+    def _tags(self, key, response):
+        tags = {s.lower() for s in urlparse(key).path.split("/") if ID_SEGMENT.match(s)}
+        try:
+            body = json.loads(response.content)
+        except ValueError:
+            return tags
+        if isinstance(body, dict) and isinstance(body.get("value"), list):
+            # Pages of a collection change with any object created in it
+            tags.add(collection_tag(key))
+        elif isinstance(body, dict):
+            tags |= {
+                str(body[field]).lower()
+                for field in ("id", "userPrincipalName")
+                if body.get(field)
+            }
+        return tags
+
+    def _shared_cache(self):
+        if not self.cache_alias:
+            return None
+        from django.core.cache import caches
+
+        return caches[self.cache_alias]
+
+    def _version_key(self, tag):
+        return f"azure_auth:graph:version:{tag}"
+
+    def _versions(self, shared, tags):
+        """Returns the current versions of tags in the shared tier, see `invalidate`."""
+        versions = shared.get_many([self._version_key(tag) for tag in tags])
+        return {tag: versions.get(self._version_key(tag), 1) for tag in tags}
+
+    def _shared_key(self, key):
+        return "azure_auth:graph:entry:" + hashlib.sha256(key.encode()).hexdigest()
+
+
+def collection_tag(url):
+    """Returns the tag of the collection a url belongs to, e.g. 'collection:users'."""
+    segments = [s for s in urlparse(url).path.split("/") if s]
+    if segments and segments[0] in ("v1.0", "beta"):
+        segments = segments[1:]
+    return f"collection:{segments[0].lower() if segments else ''}"
+
+
+def url_tags(url):
+    """
+    Returns the tags invalidated by a write to a url: the identifiers of the
+    objects it names and its collection.
+    """
+    return [
+        *(s for s in urlparse(url).path.split("/") if ID_SEGMENT.match(s)),
+        collection_tag(url),
+    ]
+
+
+def _cacheable(url):
+    path = urlparse(url).path
+    # Media streams, e.g. profile photos, are cached by their own consumers, and
+    # delta pages are large and only meaningful once
+    return not path.endswith("/$value") and not any(
+        segment.startswith("delta") for segment in path.split("/")
+    )
+
+
+class CachingTransport:
+    """
+    Wraps a transport, serving Graph GETs from a ResponseCache. Stale entries
+    holding an ETag are revalidated with 'If-None-Match'. Writes invalidate
+    the entries of the object they target and the pages of its collection.
+    With `reads` False, GETs bypass
+    the cache and only the invalidation is kept.
+    """
+
+    def __init__(self, transport, cache: ResponseCache, reads=True):
+        self.transport = transport
+        self.cache = cache
+        self.reads = reads
+
+    def request(self, method, url, **kwargs):
+        if method.upper() != "GET":
+            res = self.transport.request(method, url, **kwargs)
+            if res.status_code < 400:
+                self.cache.invalidate(*url_tags(url))
+            return res
+        if not self.reads:
+            return self.transport.request(method, url, **kwargs)
+
+        key = self.cache.key(url, kwargs.get("params"))
+        entry = self.cache.get(key)
+        if entry is not None and entry.fresh:
+            self.cache.count("hits")
+            return entry.response()
+        if entry is not None and entry.etag:
+            kwargs["headers"] = {
+                **kwargs.get("headers", {}),
+                "If-None-Match": entry.etag,
+            }
+        res = self.transport.request(method, url, **kwargs)
+        if res.status_code == 304 and entry is not None:
+            self.cache.count("revalidated")
+            self.cache.touch(key, entry)
+            return entry.response()
+        self.cache.count("misses")
+        if res.status_code == 200 and _cacheable(url):
+            self.cache.set(key, res)
+        return res
+
+    def invalidate(self, *tags):
+        self.cache.invalidate(*tags)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def close(self):
+        if hasattr(self.transport, "close"):
+            self.transport.close()
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Returns the process wide response cache built from the settings."""
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(
+                    max_entries=AZURE_AUTH.get("GRAPH_CACHE_SIZE"),
+                    max_bytes=AZURE_AUTH.get("GRAPH_CACHE_MAX_BYTES"),
+                    default_ttl=AZURE_AUTH.get("GRAPH_CACHE_TTL"),
+                    ttls=AZURE_AUTH.get("GRAPH_CACHE_TTLS"),
+                    cache_alias=AZURE_AUTH.get("GRAPH_CACHE_ALIAS"),
+                )
+    return _response_cache
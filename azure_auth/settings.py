@@ -11,4 +11,125 @@ AZURE_AUTH = {
     "DOMAIN": USER_SETTINGS.get('DOMAIN', ''),
     "SCOPE": USER_SETTINGS.get("SCOPE", []),
     "LOGIN_REDIRECT_URL": USER_SETTINGS.get("LOGIN_REDIRECT_URL", "home"),
+    # Django cache alias used to share the app-only Graph token between processes
+    "APP_TOKEN_CACHE": USER_SETTINGS.get("APP_TOKEN_CACHE", None),
+    # Seconds before expiry at which the app-only Graph token is refreshed
+    "APP_TOKEN_REFRESH_MARGIN": USER_SETTINGS.get("APP_TOKEN_REFRESH_MARGIN", 300),
+    # Lifetime (seconds) and optional file of the cached MSAL authority discovery
+    "MSAL_DISCOVERY_TTL": USER_SETTINGS.get("MSAL_DISCOVERY_TTL", 86400),
+    "MSAL_DISCOVERY_CACHE_FILE": USER_SETTINGS.get("MSAL_DISCOVERY_CACHE_FILE", None),
+    # Run authority discovery when the app is loaded
+    "MSAL_WARM_ON_STARTUP": USER_SETTINGS.get("MSAL_WARM_ON_STARTUP", True),
+    # Local validation of bearer access tokens, see `bearer.BearerTokenBackend`
+    "BEARER_AUDIENCES": USER_SETTINGS.get("BEARER_AUDIENCES", None),
+    "BEARER_ISSUERS": USER_SETTINGS.get("BEARER_ISSUERS", None),
+    "BEARER_JWKS_TTL": USER_SETTINGS.get("BEARER_JWKS_TTL", 86400),
+    "BEARER_TOKEN_CACHE_SIZE": USER_SETTINGS.get("BEARER_TOKEN_CACHE_SIZE", 1024),
+    # Storage of the delegated MSAL token caches of the users (class or dotted path)
+    "TOKEN_STORE": USER_SETTINGS.get(
+        "TOKEN_STORE", "azure_auth.token_store.DatabaseTokenStore"
+    ),
+    "TOKEN_STORE_OPTIONS": USER_SETTINGS.get("TOKEN_STORE_OPTIONS", {}),
+    # Pool of the token caches of the users GraphApi(user=...) calls Graph for:
+    # size, seconds before an unused user is evicted, and seconds between the
+    # batched writes of refreshed token caches
+    "GRAPH_USER_POOL_SIZE": USER_SETTINGS.get("GRAPH_USER_POOL_SIZE", 256),
+    "GRAPH_USER_POOL_IDLE": USER_SETTINGS.get("GRAPH_USER_POOL_IDLE", 900),
+    "GRAPH_USER_POOL_FLUSH_INTERVAL": USER_SETTINGS.get(
+        "GRAPH_USER_POOL_FLUSH_INTERVAL", 5
+    ),
+    # Refresh of the delegated access tokens expiring within TOKEN_REFRESH_MARGIN
+    # seconds, by TOKEN_REFRESH_WORKERS threads. Runs every TOKEN_REFRESH_INTERVAL
+    # seconds in the web processes when set, see `token_refresh.TokenRefresher`
+    "TOKEN_REFRESH_MARGIN": USER_SETTINGS.get("TOKEN_REFRESH_MARGIN", 600),
+    "TOKEN_REFRESH_WORKERS": USER_SETTINGS.get("TOKEN_REFRESH_WORKERS", 4),
+    "TOKEN_REFRESH_INTERVAL": USER_SETTINGS.get("TOKEN_REFRESH_INTERVAL", None),
+    # HTTP transport used for Graph calls (class or dotted path)
+    "GRAPH_TRANSPORT": USER_SETTINGS.get("GRAPH_TRANSPORT", None),
+    "HTTP_POOL_CONNECTIONS": USER_SETTINGS.get("HTTP_POOL_CONNECTIONS", 10),
+    "HTTP_POOL_MAXSIZE": USER_SETTINGS.get("HTTP_POOL_MAXSIZE", 20),
+    "HTTP_POOL_BLOCK": USER_SETTINGS.get("HTTP_POOL_BLOCK", False),
+    "HTTP_CONNECT_TIMEOUT": USER_SETTINGS.get("HTTP_CONNECT_TIMEOUT", 5),
+    "HTTP_READ_TIMEOUT": USER_SETTINGS.get("HTTP_READ_TIMEOUT", 30),
+    # Retries, client side rate limit (requests/second) and circuit breaking of
+    # Graph calls, see `resilience.Resilience`
+    "GRAPH_RESILIENCE": USER_SETTINGS.get("GRAPH_RESILIENCE", True),
+    "GRAPH_MAX_RETRIES": USER_SETTINGS.get("GRAPH_MAX_RETRIES", 4),
+    "GRAPH_BACKOFF_BASE": USER_SETTINGS.get("GRAPH_BACKOFF_BASE", 0.5),
+    "GRAPH_BACKOFF_MAX": USER_SETTINGS.get("GRAPH_BACKOFF_MAX", 30),
+    "GRAPH_RATE_LIMIT": USER_SETTINGS.get("GRAPH_RATE_LIMIT", None),
+    "GRAPH_RATE_BURST": USER_SETTINGS.get("GRAPH_RATE_BURST", None),
+    "GRAPH_CIRCUIT_FAILURES": USER_SETTINGS.get("GRAPH_CIRCUIT_FAILURES", 5),
+    "GRAPH_CIRCUIT_RESET": USER_SETTINGS.get("GRAPH_CIRCUIT_RESET", 30),
+    # Share one request between concurrent identical Graph GETs
+    "GRAPH_COALESCE": USER_SETTINGS.get("GRAPH_COALESCE", True),
+    # Cache of Graph GET responses, see `response_cache.ResponseCache`. TTLs can be
+    # set per endpoint, e.g. {"GET /v1.0/users/{id}": 300}
+    "GRAPH_CACHE": USER_SETTINGS.get("GRAPH_CACHE", True),
+    "GRAPH_CACHE_SIZE": USER_SETTINGS.get("GRAPH_CACHE_SIZE", 1024),
+    "GRAPH_CACHE_MAX_BYTES": USER_SETTINGS.get(
+        "GRAPH_CACHE_MAX_BYTES", 16 * 1024 * 1024
+    ),
+    "GRAPH_CACHE_TTL": USER_SETTINGS.get("GRAPH_CACHE_TTL", 30),
+    "GRAPH_CACHE_TTLS": USER_SETTINGS.get("GRAPH_CACHE_TTLS", {}),
+    "GRAPH_CACHE_ALIAS": USER_SETTINGS.get("GRAPH_CACHE_ALIAS", None),
+    # Maximum number of concurrent requests of AsyncGraphApi per event loop
+    "ASYNC_MAX_CONCURRENCY": USER_SETTINGS.get("ASYNC_MAX_CONCURRENCY", 20),
+    # Django cache alias and lifetimes (seconds) of cached directory role lookups
+    "ROLE_CACHE": USER_SETTINGS.get("ROLE_CACHE", "default"),
+    "ROLE_CACHE_TTL": USER_SETTINGS.get("ROLE_CACHE_TTL", 300),
+    "ROLE_CACHE_STALE_TTL": USER_SETTINGS.get("ROLE_CACHE_STALE_TTL", 600),
+    # Django cache alias and lifetime (seconds) of the user snapshots of CachedUserBackend
+    "USER_CACHE": USER_SETTINGS.get("USER_CACHE", "default"),
+    "USER_CACHE_TTL": USER_SETTINGS.get("USER_CACHE_TTL", 3600),
+    # Run the Graph writes of the admin views on a pool of background threads
+    "GRAPH_JOBS": USER_SETTINGS.get("GRAPH_JOBS", False),
+    "GRAPH_JOBS_WORKERS": USER_SETTINGS.get("GRAPH_JOBS_WORKERS", 4),
+    "GRAPH_JOBS_MAX_PENDING": USER_SETTINGS.get("GRAPH_JOBS_MAX_PENDING", 100),
+    # Graph change notifications, see `notifications`: public url of the
+    # notification view, secret sent back by Graph with every notification,
+    # subscribed resources and their change types, and subscription lifetime
+    # (seconds, at most 29 days for users and groups)
+    "GRAPH_NOTIFICATION_URL": USER_SETTINGS.get("GRAPH_NOTIFICATION_URL", None),
+    "GRAPH_NOTIFICATION_CLIENT_STATE": USER_SETTINGS.get(
+        "GRAPH_NOTIFICATION_CLIENT_STATE", None
+    ),
+    "GRAPH_NOTIFICATION_RESOURCES": USER_SETTINGS.get(
+        "GRAPH_NOTIFICATION_RESOURCES",
+        {"users": "updated,deleted", "groups": "updated"},
+    ),
+    "GRAPH_SUBSCRIPTION_LIFETIME": USER_SETTINGS.get(
+        "GRAPH_SUBSCRIPTION_LIFETIME", 3 * 24 * 3600
+    ),
+    # Django permissions granted by Azure AD group ids and app role values
+    "PERMISSION_MAP": USER_SETTINGS.get("PERMISSION_MAP", {}),
+    # Number of users written per bulk query by the directory sync
+    "SYNC_CHUNK_SIZE": USER_SETTINGS.get("SYNC_CHUNK_SIZE", 500),
+    # Number of users shown per page of UserListView
+    "USER_LIST_PAGE_SIZE": USER_SETTINGS.get("USER_LIST_PAGE_SIZE", 100),
+    # Search UserListView in a local copy of the directory kept by the directory
+    # sync, considered stale after the given number of seconds without a sync
+    "DIRECTORY_MIRROR": USER_SETTINGS.get("DIRECTORY_MIRROR", False),
+    "DIRECTORY_MIRROR_STALE_AFTER": USER_SETTINGS.get(
+        "DIRECTORY_MIRROR_STALE_AFTER", 3600
+    ),
+    # Profile photos served by the photo view: cache directory (defaults to a
+    # directory in the temp dir) and its size limit (bytes), thumbnail sizes
+    # (pixels), and seconds after which a photo is revalidated with Graph
+    "PHOTO_CACHE_DIR": USER_SETTINGS.get("PHOTO_CACHE_DIR", None),
+    "PHOTO_CACHE_MAX_BYTES": USER_SETTINGS.get(
+        "PHOTO_CACHE_MAX_BYTES", 50 * 1024 * 1024
+    ),
+    "PHOTO_SIZES": USER_SETTINGS.get("PHOTO_SIZES", (48, 96, 240)),
+    "PHOTO_REVALIDATE_AFTER": USER_SETTINGS.get("PHOTO_REVALIDATE_AFTER", 86400),
+    # Seconds browsers may reuse a photo without asking again
+    "PHOTO_MAX_AGE": USER_SETTINGS.get("PHOTO_MAX_AGE", 86400),
+    # Timing spans and counters of the hot paths, and where they are sent
+    "METRICS_ENABLED": USER_SETTINGS.get("METRICS_ENABLED", False),
+    "METRICS_SINK": USER_SETTINGS.get(
+        "METRICS_SINK", "azure_auth.metrics.RegistrySink"
+    ),
+    "METRICS_SUMMARY_HEADER": USER_SETTINGS.get("METRICS_SUMMARY_HEADER", False),
+    "METRICS_ALLOWED_IPS": USER_SETTINGS.get("METRICS_ALLOWED_IPS", ()),
+    "METRICS_TOKEN": USER_SETTINGS.get("METRICS_TOKEN", None),
 }
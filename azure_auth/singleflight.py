@@ -0,0 +1,124 @@
+import asyncio
+import hashlib
+import threading
+import weakref
+from urllib.parse import urlencode
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: while a call for a key is in flight,
+    other callers with the same key wait for it and receive its result (or
+    exception) instead of making their own call. Works across threads and,
+    through `ado`, across the tasks of an event loop.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._futures = weakref.WeakKeyDictionary()
+        self._stats = {"calls": 0, "deduplicated": 0}
+
+    def do(self, key, fn):
+        with self._lock:
+            self._stats["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self._stats["deduplicated"] += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    async def ado(self, key, coro_fn):
+        futures = self._futures.setdefault(asyncio.get_running_loop(), {})
+        with self._lock:
+            self._stats["calls"] += 1
+            if key in futures:
+                self._stats["deduplicated"] += 1
+        if key in futures:
+            return await asyncio.shield(futures[key])
+
+        future = futures[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await coro_fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved if nobody was waiting for it
+            future.exception()
+            raise
+        finally:
+            del futures[key]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+def request_key(method, url, params=None, headers=None):
+    """Identifies a read by its url, query and caller identity."""
+    if params:
+        url += ("&" if "?" in url else "?") + urlencode(sorted(params.items()))
+    authorization = (headers or {}).get("Authorization", "")
+    return (method.upper(), url, hashlib.sha256(authorization.encode()).hexdigest())
+
+
+class CoalescingTransport:
+    """Wraps a transport, coalescing concurrent identical GETs."""
+
+    def __init__(self, transport, single_flight: SingleFlight):
+        self.transport = transport
+        self.single_flight = single_flight
+
+    def request(self, method, url, **kwargs):
+        if method.upper() != "GET":
+            return self.transport.request(method, url, **kwargs)
+        key = request_key(method, url, kwargs.get("params"), kwargs.get("headers"))
+        return self.single_flight.do(
+            key, lambda: self.transport.request(method, url, **kwargs)
+        )
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def close(self):
+        if hasattr(self.transport, "close"):
+            self.transport.close()
+
+
+graph_single_flight = SingleFlight()
@@ -0,0 +1,175 @@
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from .backends import invalidate_cached_users
+from .directory import mirror_users, prune_mirror
+from .graph_api import GraphApi, GraphApiError
+from .models import DirectorySyncState, DirectoryUser, get_user_model
+from .settings import AZURE_AUTH
+
+
+class SyncResult:
+    def __init__(self):
+        self.full = False
+        self.pages = 0
+        self.created = 0
+        self.updated = 0
+        self.deleted = 0
+        self.elapsed = 0.0
+
+    @property
+    def rows(self):
+        return self.created + self.updated + self.deleted
+
+    def __str__(self):
+        return (
+            f"{'Full' if self.full else 'Incremental'} sync: {self.rows} rows "
+            f"({self.created} created, {self.updated} updated, {self.deleted} deleted) "
+            f"from {self.pages} pages in {self.elapsed:.2f}s"
+        )
+
+
+class DirectorySync:
+    """
+    Mirrors directory users into the local User table using Graph delta
+    queries. The deltaLink is stored between runs so that each run only
+    fetches the users that changed since the previous one.
+    """
+
+    STATE_NAME = "users"
+    # Graph property -> User field
+    FIELDS = {
+        "givenName": "first_name",
+        "surname": "last_name",
+        "userPrincipalName": "email",
+        "accountEnabled": "is_active",
+    }
+
+    def __init__(self, api=None, chunk_size=None, create_missing=True, mirror=None):
+        self.api = api or GraphApi()
+        self.chunk_size = chunk_size or AZURE_AUTH.get("SYNC_CHUNK_SIZE")
+        self.create_missing = create_missing
+        # Also keep the DirectoryUser copy searched by UserListView
+        self.mirror = AZURE_AUTH.get("DIRECTORY_MIRROR") if mirror is None else mirror
+        self.User = get_user_model()
+
+    def run(self, full=False) -> SyncResult:
+        """
+        Applies the directory changes to the local User table.
+        :param full: Ignore the stored deltaLink and enumerate every user.
+        """
+        result = SyncResult()
+        started = time.monotonic()
+        started_at = timezone.now()
+        state, _ = DirectorySyncState.objects.get_or_create(name=self.STATE_NAME)
+        if self.mirror and not DirectoryUser.objects.exists():
+            full = True  # The copy is filled by a full enumeration
+        delta_link = None if full else state.delta_link or None
+        result.full = delta_link is None
+
+        try:
+            delta_link = self._apply(delta_link, result)
+        except GraphApiError as e:
+            # The stored deltaLink expired, start over with a full enumeration
+            if delta_link and e.error.get("error", {}).get("code") in (
+                "resyncRequired",
+                "syncStateNotFound",
+            ):
+                result = SyncResult()
+                result.full = True
+                delta_link = self._apply(None, result)
+            else:
+                raise
+
+        if result.full and self.mirror:
+            # Users missing from a full enumeration were deleted meanwhile
+            prune_mirror(started_at)
+        state.delta_link = delta_link
+        state.save(update_fields=["delta_link", "updated_at"])
+        result.elapsed = time.monotonic() - started
+        return result
+
+    def apply_changes(self, changed, removed) -> SyncResult:
+        """
+        Applies changes learnt outside of a delta query, e.g. from change
+        notifications.
+        :param changed: a dict mapping user ids to their Graph properties.
+        :param removed: a dict mapping the ids of removed users to the reason
+            of the removal, 'changed' for users that can still be restored.
+        """
+        result = SyncResult()
+        started = time.monotonic()
+        self._flush(changed, removed, result)
+        result.elapsed = time.monotonic() - started
+        return result
+
+    def _apply(self, delta_link, result):
+        changed, removed = {}, {}
+        for page in self.api.user.delta(delta_link):
+            result.pages += 1
+            for item in page.get("value", []):
+                if "@removed" in item:
+                    changed.pop(item["id"], None)
+                    removed[item["id"]] = item["@removed"].get("reason")
+                else:
+                    removed.pop(item["id"], None)
+                    changed.setdefault(item["id"], {}).update(item)
+            if len(changed) + len(removed) >= self.chunk_size:
+                self._flush(changed, removed, result)
+                changed, removed = {}, {}
+            if "@odata.deltaLink" in page:
+                delta_link = page["@odata.deltaLink"]
+        self._flush(changed, removed, result)
+        return delta_link
+
+    @transaction.atomic
+    def _flush(self, changed, removed, result):
+        if removed:
+            # Soft deleted users can still be restored, only deactivate them
+            soft = [pk for pk, reason in removed.items() if reason == "changed"]
+            hard = [pk for pk, reason in removed.items() if reason != "changed"]
+            result.deleted += self.User.objects.filter(pk__in=soft).update(
+                is_active=False
+            )
+            result.deleted += self.User.objects.filter(pk__in=hard).delete()[0]
+            invalidate_cached_users(*soft)
+        if self.mirror:
+            mirror_users(changed, removed, batch_size=self.chunk_size)
+
+        if not changed:
+            return
+        existing = self.User.objects.in_bulk(list(changed))
+        to_update, to_create, fields = [], [], set()
+        for pk, item in changed.items():
+            user = existing.get(self._to_pk(pk))
+            if user is None:
+                if not self.create_missing or not item.get("userPrincipalName"):
+                    continue
+                user = self.User(azure_object_id=pk, password=make_password(None))
+                to_create.append(user)
+            else:
+                to_update.append(user)
+            for graph_field, field in self.FIELDS.items():
+                value = item.get(graph_field)
+                if graph_field in item and not (value is None and field == "is_active"):
+                    setattr(user, field, value if value is not None else "")
+                    fields.add(field)
+
+        if to_update and fields:
+            self.User.objects.bulk_update(to_update, fields, batch_size=self.chunk_size)
+            invalidate_cached_users(*(user.pk for user in to_update))
+            result.updated += len(to_update)
+        if to_create:
+            # Rows conflicting with an existing user are skipped by the insert
+            created = self.User.objects.filter(pk__in=[user.pk for user in to_create])
+            before = created.count()
+            self.User.objects.bulk_create(
+                to_create, batch_size=self.chunk_size, ignore_conflicts=True
+            )
+            result.created += created.count() - before
+
+    def _to_pk(self, value):
+        return self.User._meta.pk.to_python(value)
@@ -0,0 +1,175 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import msal
+from django.db import connections
+
+from .delegated import discard_delegated
+from .metrics import increment, span
+from .settings import AZURE_AUTH
+from .token_store import get_token_store
+from .utils import _build_msal_app
+
+logger = logging.getLogger(__name__)
+
+# Scopes MSAL adds to every request, they can not be requested explicitly
+RESERVED_SCOPES = {"openid", "profile", "offline_access"}
+
+
+class RefreshResult:
+    def __init__(self):
+        self.due = 0
+        self.refreshed = 0
+        self.failed = 0
+
+    def __str__(self):
+        return (
+            f"{self.due} token caches near expiry: "
+            f"{self.refreshed} refreshed, {self.failed} failed"
+        )
+
+
+class TokenRefresher:
+    """
+    Refreshes the delegated access tokens of the users before they expire, so
+    that `User.get_token_from_cache` is answered from the cache instead of
+    redeeming a refresh token on the request path.
+
+    Each run asks the token store for the users whose earliest refreshable
+    access token expires within `margin` seconds, and refreshes them with at
+    most `workers` concurrent MSAL calls.
+    """
+
+    def __init__(self, store=None, margin=None, workers=None):
+        self.store = store or get_token_store()
+        self.margin = margin or AZURE_AUTH.get("TOKEN_REFRESH_MARGIN")
+        self.workers = workers or AZURE_AUTH.get("TOKEN_REFRESH_WORKERS")
+        self._lock = threading.Lock()
+        self._stats = {"near_expiry": 0, "refreshed": 0, "failed": 0, "runs": 0}
+        self._thread = None
+
+    def run(self) -> RefreshResult:
+        result = RefreshResult()
+        now = time.time()
+        try:
+            due = list(self.store.expiring(now, now + self.margin))
+        except NotImplementedError:
+            logger.warning(
+                "%s can not list the users it stores, their tokens are not refreshed",
+                type(self.store).__name__,
+            )
+            due = []
+        result.due = len(due)
+        if due:
+            with ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="azure-auth-refresh"
+            ) as pool:
+                for ok in pool.map(self._refresh_in_thread, due):
+                    if ok:
+                        result.refreshed += 1
+                    else:
+                        result.failed += 1
+        with self._lock:
+            self._stats["near_expiry"] = result.due
+            self._stats["refreshed"] += result.refreshed
+            self._stats["failed"] += result.failed
+            self._stats["runs"] += 1
+        return result
+
+    def refresh_user(self, user_id) -> bool:
+        """
+        Redeems the refresh token of a user for every scope whose access token
+        expires within the margin. Returns whether every refresh succeeded.
+        """
+        serialized = self.store.load(user_id)
+        if not serialized:
+            return False
+        cache = msal.SerializableTokenCache()
+        cache.deserialize(serialized)
+        horizon = time.time() + self.margin
+        due = {
+            (token.get("home_account_id"), token.get("target", ""))
+            for token in cache.find(msal.TokenCache.CredentialType.ACCESS_TOKEN)
+            if int(token.get("expires_on", 0)) <= horizon
+        }
+        cca = _build_msal_app(cache=cache)
+        accounts = {
+            account["home_account_id"]: account for account in cca.get_accounts()
+        }
+        ok = True
+        for home_account_id, target in due:
+            scopes = [s for s in target.split() if s.lower() not in RESERVED_SCOPES]
+            account = accounts.get(home_account_id)
+            if not scopes or account is None:
+                continue
+            with span("msal_acquire_token", flow="refresh"):
+                res = cca.acquire_token_silent_with_error(
+                    scopes, account=account, force_refresh=True
+                )
+            if not res or "error" in res:
+                logger.warning(
+                    "Could not refresh the token of %s: %s",
+                    user_id,
+                    (res or {}).get("error_description", "no refresh token"),
+                )
+                ok = False
+        if cache.has_state_changed:
+            self.store.save(user_id, cache.serialize())
+            discard_delegated(user_id)
+        return ok
+
+    def _refresh_in_thread(self, user_id):
+        try:
+            ok = self.refresh_user(user_id)
+        except Exception:
+            logger.exception("Could not refresh the token of %s", user_id)
+            ok = False
+        finally:
+            connections.close_all()
+        increment("token_refresh", result="refreshed" if ok else "failed")
+        return ok
+
+    def start(self, interval):
+        """
+        Runs the refresher every `interval` seconds in a daemon thread. Only one
+        process sharing the default cache runs it per interval.
+        """
+        from django.core.cache import cache
+
+        def loop():
+            while True:
+                if cache.add("azure_auth:token_refresh:lock", 1, interval):
+                    try:
+                        self.run()
+                    except Exception:
+                        logger.exception("Token refresh run failed")
+                    finally:
+                        connections.close_all()
+                time.sleep(interval)
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=loop, name="azure-auth-token-refresh", daemon=True
+                )
+                self._thread.start()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def get_token_refresher() -> TokenRefresher:
+    """Returns the process wide token refresher built from the settings."""
+    global _refresher
+    if _refresher is None:
+        with _refresher_lock:
+            if _refresher is None:
+                _refresher = TokenRefresher()
+    return _refresher
@@ -0,0 +1,279 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+from django.utils.module_loading import import_string
+
+from .settings import AZURE_AUTH
+
+
+def compress(serialized: str) -> bytes:
+    return zlib.compress(serialized.encode(), 6)
+
+
+def decompress(data: bytes) -> str:
+    return zlib.decompress(bytes(data)).decode()
+
+
+def prune(serialized: str) -> str:
+    """
+    Drops expired access tokens, and accounts (with their id tokens) that no
+    longer hold a refresh token, from a serialized MSAL token cache.
+    """
+    data = json.loads(serialized)
+    _prune(data)
+    return json.dumps(data, separators=(",", ":"))
+
+
+def _prune(data):
+    now = time.time()
+    access_tokens = data.get("AccessToken", {})
+    for key, token in list(access_tokens.items()):
+        if int(token.get("expires_on", 0)) <= now:
+            del access_tokens[key]
+
+    live_accounts = {
+        token.get("home_account_id") for token in data.get("RefreshToken", {}).values()
+    }
+    for section in ("Account", "IdToken"):
+        entries = data.get(section, {})
+        for key, entry in list(entries.items()):
+            if entry.get("home_account_id") not in live_accounts:
+                del entries[key]
+
+
+def _refreshable_expiry(data):
+    """
+    Returns the earliest expiry (timestamp) of the access tokens that can be
+    refreshed, i.e. whose account holds a refresh token, or None.
+    """
+    live_accounts = {
+        token.get("home_account_id") for token in data.get("RefreshToken", {}).values()
+    }
+    expiries = [
+        int(token["expires_on"])
+        for token in data.get("AccessToken", {}).values()
+        if token.get("home_account_id") in live_accounts and "expires_on" in token
+    ]
+    return min(expiries) if expiries else None
+
+
+class NoCachedAccountError(Exception):
+    """Raised when a user has no account to acquire tokens for in its token cache."""
+
+
+class BaseTokenStore:
+    """
+    Stores the serialized MSAL token cache of each user, outside of the user
+    row. Subclasses store the compressed blobs returned by `compress`.
+    """
+
+    def load(self, user_id):
+        """Returns the serialized token cache of a user, or None."""
+        data = self.read(str(user_id))
+        return decompress(data) if data else None
+
+    def save(self, user_id, serialized: str):
+        """Prunes, compresses and stores the serialized token cache of a user."""
+        data = json.loads(serialized)
+        _prune(data)
+        self.write(
+            str(user_id),
+            compress(json.dumps(data, separators=(",", ":"))),
+            expires_on=_refreshable_expiry(data),
+        )
+
+    def save_many(self, caches):
+        """Stores several serialized token caches, a dict keyed by user id."""
+        for user_id, serialized in caches.items():
+            self.save(user_id, serialized)
+
+    def expiring(self, after, before):
+        """
+        Returns the ids of the users whose earliest refreshable access token
+        expires between the `after` and `before` timestamps. Stores able to
+        index the expiry override the scan of every stored cache.
+        """
+        for user_id in self.user_ids():
+            if serialized := self.load(user_id):
+                expires_on = _refreshable_expiry(json.loads(serialized))
+                if expires_on is not None and after < expires_on <= before:
+                    yield user_id
+
+    def user_ids(self):
+        """Returns the ids of the users having a stored token cache."""
+        raise NotImplementedError
+
+    def read(self, user_id):
+        raise NotImplementedError
+
+    def write(self, user_id, data: bytes, expires_on=None):
+        """
+        :param expires_on: the earliest expiry of the refreshable access tokens
+            of the cache, see `expiring`.
+        """
+        raise NotImplementedError
+
+    def delete(self, user_id):
+        raise NotImplementedError
+
+
+class DatabaseTokenStore(BaseTokenStore):
+    """Stores token caches in the UserTokenCache table."""
+
+    def read(self, user_id):
+        from .models import UserTokenCache
+
+        return (
+            UserTokenCache.objects.filter(user_id=user_id)
+            .values_list("data", flat=True)
+            .first()
+        )
+
+    def write(self, user_id, data: bytes, expires_on=None):
+        from .models import UserTokenCache
+
+        UserTokenCache.objects.update_or_create(
+            user_id=user_id,
+            defaults={
+                "data": data,
+                "expires_at": (
+                    datetime.fromtimestamp(expires_on, timezone.utc)
+                    if expires_on
+                    else None
+                ),
+            },
+        )
+
+    def save_many(self, caches):
+        from django.db import transaction
+
+        # A single commit for the batch
+        with transaction.atomic():
+            super().save_many(caches)
+
+    def expiring(self, after, before):
+        from .models import UserTokenCache
+
+        return (
+            UserTokenCache.objects.filter(
+                expires_at__gt=datetime.fromtimestamp(after, timezone.utc),
+                expires_at__lte=datetime.fromtimestamp(before, timezone.utc),
+            )
+            .values_list("user_id", flat=True)
+            .iterator()
+        )
+
+    def user_ids(self):
+        from .models import UserTokenCache
+
+        return UserTokenCache.objects.values_list("user_id", flat=True).iterator()
+
+    def delete(self, user_id):
+        from .models import UserTokenCache
+
+        UserTokenCache.objects.filter(user_id=user_id).delete()
+
+
+class CacheTokenStore(BaseTokenStore):
+    """
+    Stores token caches in a Django cache. Only use persistent cache backends.
+
+    The ids of the stored users are kept in an index entry, updated without a
+    lock: a user missed by the index when two processes add users at once is
+    added again by its next write.
+    """
+
+    index_key = "azure_auth:token_cache:users"
+
+    def __init__(self, alias="default", timeout=None):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+
+        return caches[self.alias]
+
+    def _key(self, user_id):
+        return f"azure_auth:token_cache:{user_id}"
+
+    def read(self, user_id):
+        return self.cache.get(self._key(user_id))
+
+    def write(self, user_id, data: bytes, expires_on=None):
+        self.cache.set(self._key(user_id), data, self.timeout)
+        user_ids = self.cache.get(self.index_key, set())
+        if user_id not in user_ids:
+            self.cache.set(self.index_key, user_ids | {user_id}, None)
+
+    def user_ids(self):
+        user_ids = self.cache.get(self.index_key, set())
+        # Entries may have expired since they were indexed
+        stored = self.cache.get_many([self._key(user_id) for user_id in user_ids])
+        return [user_id for user_id in user_ids if self._key(user_id) in stored]
+
+    def delete(self, user_id):
+        self.cache.delete(self._key(user_id))
+        user_ids = self.cache.get(self.index_key, set())
+        if user_id in user_ids:
+            self.cache.set(self.index_key, user_ids - {user_id}, None)
+
+
+class FileTokenStore(BaseTokenStore):
+    """Stores token caches as one file per user in a directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def _path(self, user_id):
+        return os.path.join(self.directory, f"{user_id}.bin")
+
+    def read(self, user_id):
+        try:
+            with open(self._path(user_id), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def user_ids(self):
+        return (
+            name[: -len(".bin")]
+            for name in os.listdir(self.directory)
+            if name.endswith(".bin")
+        )
+
+    def write(self, user_id, data: bytes, expires_on=None):
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._path(user_id))
+
+    def delete(self, user_id):
+        try:
+            os.remove(self._path(user_id))
+        except FileNotFoundError:
+            pass
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_token_store() -> BaseTokenStore:
+    """Returns the token store configured by TOKEN_STORE and TOKEN_STORE_OPTIONS."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store_class = AZURE_AUTH.get("TOKEN_STORE")
+                if isinstance(store_class, str):
+                    store_class = import_string(store_class)
+                _store = store_class(**AZURE_AUTH.get("TOKEN_STORE_OPTIONS"))
+    return _store
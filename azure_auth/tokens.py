@@ -0,0 +1,166 @@
+import threading
+import time
+
+from .settings import AZURE_AUTH
+
+
+class TokenAcquisitionError(Exception):
+    """Raised when AAD refuses to issue an app-only token."""
+
+    def __init__(self, result: dict):
+        self.result = result
+        super().__init__(result.get("error_description") or result.get("error"))
+
+
+class AppTokenStore:
+    """
+    Shares the app-only (client credentials) token between every GraphApi
+    instance of the process, and optionally between processes through a Django
+    cache alias.
+
+    The token is refreshed `refresh_margin` seconds before it expires. Only one
+    caller refreshes at a time; while a refresh is in progress the other callers
+    keep using the current token as long as it has not actually expired.
+    """
+
+    def __init__(self, scopes, cache_alias=None, refresh_margin=300, app_factory=None):
+        self.scopes = list(scopes)
+        self.cache_alias = cache_alias
+        self.refresh_margin = refresh_margin
+        self._app_factory = app_factory
+        self._app = None
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "shared_hits": 0, "misses": 0, "errors": 0}
+
+    @property
+    def cache_key(self):
+        return "azure_auth:app_token:{}:{}".format(
+            AZURE_AUTH.get("CLIENT_ID"), " ".join(sorted(self.scopes))
+        )
+
+    @property
+    def app(self):
+        if self._app is None:
+            if self._app_factory is None:
+                from .utils import _build_msal_app
+
+                self._app_factory = _build_msal_app
+            self._app = self._app_factory()
+        return self._app
+
+    def get_token(self):
+        """
+        Returns a valid access token, acquiring a new one from AAD only if
+        neither the process nor the shared cache hold a fresh one.
+        """
+        token, expires_at = self._token, self._expires_at
+        if token and self._is_fresh(expires_at):
+            self._count("hits")
+            return token
+
+        # Someone else is refreshing, the current token is still usable.
+        blocking = not (token and expires_at > time.time())
+        if not self._lock.acquire(blocking=blocking):
+            self._count("hits")
+            return token
+        try:
+            if self._token and self._is_fresh(self._expires_at):
+                self._count("hits")
+                return self._token
+
+            shared = self._read_shared()
+            if shared and self._is_fresh(shared[1]):
+                self._token, self._expires_at = shared
+                self._count("shared_hits")
+                return self._token
+
+            self._count("misses")
+            self._token, self._expires_at = self._acquire()
+            self._write_shared(self._token, self._expires_at)
+            return self._token
+        finally:
+            self._lock.release()
+
+    def peek(self):
+        """Returns the current token if it is fresh, without any I/O."""
+        token, expires_at = self._token, self._expires_at
+        if token and self._is_fresh(expires_at):
+            self._count("hits")
+            return token
+        return None
+
+    def invalidate(self):
+        """Drops the token locally and from the shared cache."""
+        with self._lock:
+            self._token, self._expires_at = None, 0.0
+            cache = self._shared_cache()
+            if cache is not None:
+                cache.delete(self.cache_key)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["expires_in"] = max(0, int(self._expires_at - time.time()))
+        return stats
+
+    def _is_fresh(self, expires_at):
+        return expires_at - self.refresh_margin > time.time()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def _acquire(self):
+        from .metrics import span
+
+        with span("msal_acquire_token", flow="client_credentials"):
+            result = self.app.acquire_token_for_client(scopes=self.scopes)
+        if "access_token" not in result:
+            self._count("errors")
+            raise TokenAcquisitionError(result)
+        return result["access_token"], time.time() + int(result.get("expires_in", 0))
+
+    def _shared_cache(self):
+        if not self.cache_alias:
+            return None
+        from django.core.cache import caches
+
+        return caches[self.cache_alias]
+
+    def _read_shared(self):
+        cache = self._shared_cache()
+        if cache is None:
+            return None
+        value = cache.get(self.cache_key)
+        return tuple(value) if value else None
+
+    def _write_shared(self, token, expires_at):
+        cache = self._shared_cache()
+        if cache is None:
+            return
+        timeout = int(expires_at - time.time())
+        if timeout > 0:
+            cache.set(self.cache_key, (token, expires_at), timeout)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_app_token_store(scopes) -> AppTokenStore:
+    """Returns the process wide token store for the given scopes."""
+    key = tuple(sorted(scopes))
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                store = _stores[key] = AppTokenStore(
+                    scopes,
+                    cache_alias=AZURE_AUTH.get("APP_TOKEN_CACHE"),
+                    refresh_margin=AZURE_AUTH.get("APP_TOKEN_REFRESH_MARGIN"),
+                )
+    return store
@@ -0,0 +1,124 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.utils.module_loading import import_string
+
+from .settings import AZURE_AUTH
+
+
+class GraphTransport:
+    """
+    HTTP transport used by GraphApi. Wraps a pooled `requests.Session` so
+    connections to graph.microsoft.com are kept alive and reused between calls.
+
+    Any object exposing `request(method, url, **kwargs)` returning a
+    `requests.Response`-like object can be used in its place.
+    """
+
+    def __init__(
+        self,
+        pool_connections=10,
+        pool_maxsize=10,
+        pool_block=False,
+        connect_timeout=5,
+        read_timeout=30,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_transport = None
+_delegated_transport = None
+_transport_lock = threading.Lock()
+
+
+def build_transport(delegated=False):
+    """
+    Builds a transport from the `AZURE_AUTH` settings. Transports of delegated
+    calls do not serve cached responses, which are shared by every caller.
+    """
+    from .metrics import InstrumentedTransport
+    from .resilience import ResilientTransport, get_resilience
+    from .response_cache import CachingTransport, get_response_cache
+    from .singleflight import CoalescingTransport, graph_single_flight
+
+    transport_class = AZURE_AUTH.get("GRAPH_TRANSPORT")
+    if isinstance(transport_class, str):
+        transport_class = import_string(transport_class)
+    transport = (transport_class or GraphTransport)(
+        pool_connections=AZURE_AUTH.get("HTTP_POOL_CONNECTIONS"),
+        pool_maxsize=AZURE_AUTH.get("HTTP_POOL_MAXSIZE"),
+        pool_block=AZURE_AUTH.get("HTTP_POOL_BLOCK"),
+        connect_timeout=AZURE_AUTH.get("HTTP_CONNECT_TIMEOUT"),
+        read_timeout=AZURE_AUTH.get("HTTP_READ_TIMEOUT"),
+    )
+    if AZURE_AUTH.get("GRAPH_RESILIENCE"):
+        transport = ResilientTransport(transport, get_resilience())
+    if AZURE_AUTH.get("GRAPH_COALESCE"):
+        transport = CoalescingTransport(transport, graph_single_flight)
+    if AZURE_AUTH.get("METRICS_ENABLED"):
+        # Inside the cache, so that only the calls reaching Graph are timed
+        transport = InstrumentedTransport(transport)
+    if AZURE_AUTH.get("GRAPH_CACHE"):
+        transport = CachingTransport(
+            transport, get_response_cache(), reads=not delegated
+        )
+    return transport
+
+
+def get_transport(delegated=False):
+    """Returns the process wide transport, building it on first use."""
+    global _transport, _delegated_transport
+    if delegated:
+        if _delegated_transport is None:
+            with _transport_lock:
+                if _delegated_transport is None:
+                    _delegated_transport = build_transport(delegated=True)
+        return _delegated_transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = build_transport()
+    return _transport
+
+
+def set_transport(transport):
+    """
+    Replaces the process wide transports, e.g. with a stub in tests or
+    benchmarks. Passing None resets them to the configured default.
+    """
+    global _transport, _delegated_transport
+    with _transport_lock:
+        previous = (_transport, _delegated_transport)
+        _transport = _delegated_transport = transport
+    for p in previous:
+        if p is not None and p is not transport and hasattr(p, "close"):
+            p.close()
@@ -1,11 +1,33 @@
 from django.urls import path
-from .views import login, logout, UserDeleteView, UserUpdateView
+from .metrics import metrics_view
+from .notifications import notification_view
+from .views import (
+    login,
+    logout,
+    photo,
+    user_list_async,
+    user_update_async,
+    JobStatusView,
+    UserDeleteView,
+    UserListView,
+    UserSearchView,
+    UserUpdateView,
+)
 from .settings import AZURE_AUTH
 
 app_name = "azure_auth"
 urlpatterns = [
     path(AZURE_AUTH.get("REDIRECT_PATH"), login, name="login"),
     path("logout", logout, name="logout"),
+    path("users", UserListView.as_view(), name="user_list"),
+    path("users/search", UserSearchView.as_view(), name="user_search"),
     path("update/<uuid:user_id>", UserUpdateView.as_view(), name='update'),
-    path("delete/<uuid:user_id>", UserDeleteView.as_view(), name='delete')
+    path("async/users", user_list_async, name="user_list_async"),
+    path("async/update/<uuid:user_id>", user_update_async, name="update_async"),
+    path("delete/<uuid:user_id>", UserDeleteView.as_view(), name='delete'),
+    path("photo/<uuid:user_id>", photo, name="photo"),
+    path("photo/<uuid:user_id>/<int:size>", photo, name="photo_size"),
+    path("metrics", metrics_view, name="metrics"),
+    path("notifications", notification_view, name="notifications"),
+    path("jobs/<uuid:job_id>", JobStatusView.as_view(), name="job_status"),
 ]
@@ -2,16 +2,12 @@ import uuid
 import msal
 from django.urls import reverse
 
-from .settings import AZURE_AUTH
+from .msal_pool import msal_app_pool
+from .token_store import get_token_store
 
 
 def _build_msal_app(cache=None, authority=None):
-    return msal.ConfidentialClientApplication(
-        AZURE_AUTH.get("CLIENT_ID"),
-        authority=authority or AZURE_AUTH.get("AUTHORITY"),
-        client_credential=AZURE_AUTH.get("CLIENT_SECRET"),
-        token_cache=cache,
-    )
+    return msal_app_pool.get(cache=cache, authority=authority)
 
 
 def build_auth_url(request, scopes=None, state=None, authority=None):
@@ -29,12 +25,16 @@ def build_auth_url(request, scopes=None, state=None, authority=None):
 
 def _load_cache(user):
     cache = msal.SerializableTokenCache()
-    if user.azure_token_cache:
-        cache.deserialize(user.azure_token_cache)
+    if serialized := get_token_store().load(user.pk):
+        cache.deserialize(serialized)
     return cache
 
 
 def _save_cache(cache: msal.SerializableTokenCache, user):
     if cache.has_state_changed:
-        user.azure_token_cache = cache.serialize()
-        user.save()
+        from .delegated import discard_delegated
+
+        get_token_store().save(user.pk, cache.serialize())
+        cache.has_state_changed = False
+        # Pooled clients of the user would write their older cache back
+        discard_delegated(user.pk)
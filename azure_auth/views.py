@@ -1,15 +1,30 @@
+import asyncio
+import functools
+
 import msal
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
 from django.contrib.auth import login as auth_login, logout as auth_logout
+from django.contrib.auth.decorators import login_required
+from django.core.handlers.asgi import ASGIRequest
 from django.shortcuts import render, redirect
 from django.urls import reverse
-from django.http import HttpResponseBadRequest, HttpResponseNotFound, HttpResponse
+from django.http import (
+    HttpResponseBadRequest,
+    HttpResponseNotFound,
+    HttpResponseNotModified,
+    HttpResponse,
+    JsonResponse,
+)
 from django.views import View
 
 from .forms import UserCreateForm, UserUpdateForm
+from .metrics import span
 from .settings import AZURE_AUTH
-from .models import get_user_model
-from .permissions import UserAdminRequiredMixin
+from .models import DirectoryUser, get_user_model
+from .permissions import UserAdminRequiredMixin, user_admin_required
 from .utils import _build_msal_app, _save_cache, _load_cache
 
 User = get_user_model()
@@ -40,47 +55,129 @@ def login(request):
 
         redirect_uri = request.build_absolute_uri(reverse("azure_auth:login"))
 
-        result: dict = _build_msal_app(cache=cache).acquire_token_by_authorization_code(
-            request.GET.get("code"),
-            scopes=AZURE_AUTH.get("SCOPE"),
-            # Misspelled scope would cause an HTTP 400 error here
-            redirect_uri=redirect_uri,
-        )
+        with span("msal_acquire_token", flow="authorization_code"):
+            result: dict = _build_msal_app(
+                cache=cache
+            ).acquire_token_by_authorization_code(
+                request.GET.get("code"),
+                scopes=AZURE_AUTH.get("SCOPE"),
+                # Misspelled scope would cause an HTTP 400 error here
+                redirect_uri=redirect_uri,
+            )
 
         if "error" in result:
             context = {"result": result}
             return render(request, "registration/auth_error.html", context=context)
 
         try:
-            user = User.objects.get(
-                azure_object_id=result.get("id_token_claims").get("oid")
-            )
-            # Update email id if changed
-            if user.email != result.get("id_token_claims").get("preferred_username"):
-                user.email = result.get("id_token_claims").get("preferred_username")
-                user.save()
-            if user.azure_token_cache:
-                cache.deserialize(user.azure_token_cache)
-        except User.DoesNotExist:
-            name = result.get("id_token_claims").get("name").split()
-
-            user = User.objects.create(
-                azure_object_id=result.get("id_token_claims").get("oid"),
-                email=result.get("id_token_claims").get("preferred_username"),
-                first_name=name[0],
-                last_name=name[1] if len(name) > 1 else None,
-                azure_token_cache=cache.serialize(),
-            )
+            with span("login_db", step="user"):
+                user = _upsert_user(result.get("id_token_claims"))
         except:
             return HttpResponseBadRequest()
 
-        auth_login(request, user)
+        if AZURE_AUTH.get("PERMISSION_MAP"):
+            from .permission_index import claims_memberships, update_permission_index
+
+            groups, roles = claims_memberships(result.get("id_token_claims"))
+            with span("login_db", step="permission_index"):
+                update_permission_index(user.pk, groups, roles)
 
-        _save_cache(cache, user)
+        auth_login(request, user, backend=_login_backend())
+
+        with span("login_db", step="token_cache"):
+            _save_cache(cache, user)
 
     return redirect(AZURE_AUTH.get("LOGIN_REDIRECT_URL"))
 
 
+@login_required
+def photo(request, user_id, size=None):
+    """
+    Serves a thumbnail of the profile photo of a user, or a placeholder for
+    users without photo, from the on-disk photo cache.
+    """
+    from .photos import get_photo_service
+
+    sizes = AZURE_AUTH.get("PHOTO_SIZES")
+    if size is None:
+        size = min(sizes)
+    elif size not in sizes:
+        return HttpResponseNotFound()
+    image = get_photo_service().get(user_id, size)
+    if image.etag in request.headers.get("If-None-Match", ""):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(image.content, content_type=image.content_type)
+    response["ETag"] = image.etag
+    if image.transient:
+        # The photo is fetched again by the next request
+        response["Cache-Control"] = "private, no-cache"
+        return response
+    # A placeholder is replaced as soon as the user gets a photo
+    max_age = AZURE_AUTH.get(
+        "PHOTO_REVALIDATE_AFTER" if image.placeholder else "PHOTO_MAX_AGE"
+    )
+    response["Cache-Control"] = f"private, max-age={max_age}"
+    return response
+
+
+def _upsert_user(claims):
+    """
+    Creates the user signing in, or updates it writing only the columns that
+    changed.
+    """
+    user = User.objects.filter(azure_object_id=claims.get("oid")).first()
+    if user is None:
+        name = claims.get("name").split()
+        return User.objects.create(
+            azure_object_id=claims.get("oid"),
+            email=claims.get("preferred_username"),
+            first_name=name[0],
+            last_name=name[1] if len(name) > 1 else None,
+        )
+    # Update email id if changed
+    changed = []
+    if user.email != claims.get("preferred_username"):
+        user.email = claims.get("preferred_username")
+        changed.append("email")
+    if changed:
+        user.save(update_fields=changed)
+    return user
+
+
+def _login_backend():
+    backends = settings.AUTHENTICATION_BACKENDS
+    if "azure_auth.backends.CachedUserBackend" in backends:
+        return "azure_auth.backends.CachedUserBackend"
+    return backends[0]
+
+
+def _enqueue(request, kind, key, payload):
+    """
+    Defers a Graph write to the job queue, answering JSON clients with the job
+    id and redirecting form posts to the user list.
+    """
+    from .jobs import get_job_queue
+
+    job = get_job_queue().enqueue(kind, key, payload)
+    if "application/json" not in request.headers.get("Accept", ""):
+        messages.info(
+            request,
+            "Your changes were saved and are applied in the background.",
+            fail_silently=True,
+        )
+        return redirect("azure_auth:user_list")
+    return JsonResponse(
+        {
+            "job": str(job.pk),
+            "status": request.build_absolute_uri(
+                reverse("azure_auth:job_status", args=[job.pk])
+            ),
+        },
+        status=202,
+    )
+
+
 class UserCreateView(UserAdminRequiredMixin, View):
     def get(self, request):
         form = UserCreateForm()
@@ -88,15 +185,27 @@ class UserCreateView(UserAdminRequiredMixin, View):
 
     def post(self, request):
         form = UserCreateForm(request.POST)
+        if form.is_valid() and AZURE_AUTH.get("GRAPH_JOBS"):
+            return _enqueue(
+                request,
+                "user.create",
+                f"user:{form.cleaned_data['username']}",
+                form.cleaned_data,
+            )
         if form.is_valid():
             from .graph_api import GraphApi
 
             graph_api = GraphApi()
             res = graph_api.user.create(**form.cleaned_data)
             if res is True:
-                return render(request, "azure_auth/register_success.html", context={
-                    'email': form.cleaned_data['username'] + AZURE_AUTH.get('DOMAIN')
-                })
+                return render(
+                    request,
+                    "azure_auth/register_success.html",
+                    context={
+                        'email': form.cleaned_data['username']
+                        + AZURE_AUTH.get('DOMAIN')
+                    },
+                )
             else:
                 errors = res.get("error").get("message")
         else:
@@ -109,9 +218,18 @@ class UserUpdateView(UserAdminRequiredMixin, View):
     def get(self, request, user_id):
         try:
             user = User.objects.get(azure_object_id=user_id)
-            user.sync_from_ad()
+            if AZURE_AUTH.get("GRAPH_JOBS"):
+                # Shows the local row, refreshed in the background
+                from .jobs import get_job_queue
+
+                get_job_queue().enqueue(
+                    "user.sync", f"user:{user_id}", {"user_id": str(user_id),}
+                )
+            else:
+                user.sync_from_ad()
         except User.DoesNotExist:
             from .graph_api import GraphApi
+
             res = GraphApi().user.get(user_id)
             if 'error' in request:
                 return HttpResponseBadRequest()
@@ -121,15 +239,24 @@ class UserUpdateView(UserAdminRequiredMixin, View):
                 first_name=res.get('givenName'),
                 last_name=res.get('surname'),
             )
-        form = UserUpdateForm(data={
-            'username': user.email.split('@')[0],
-            'first_name': user.first_name,
-            'last_name': user.last_name,
-        })
+        form = UserUpdateForm(
+            data={
+                'username': user.email.split('@')[0],
+                'first_name': user.first_name,
+                'last_name': user.last_name,
+            }
+        )
         return render(request, "azure_auth/update.html", context={"form": form})
 
     def post(self, request, user_id):
         form = UserUpdateForm(request.POST)
+        if form.is_valid() and AZURE_AUTH.get("GRAPH_JOBS"):
+            return _enqueue(
+                request,
+                "user.update",
+                f"user:{user_id}",
+                {"user_id": str(user_id), **form.cleaned_data,},
+            )
         if form.is_valid():
             from .graph_api import GraphApi
 
@@ -150,24 +277,249 @@ class UserUpdateView(UserAdminRequiredMixin, View):
         return render(request, "azure_auth/register.html", context=context)
 
 
+def _mirror_page(request):
+    """Renders a page of UserListView searched and sorted in the directory copy."""
+    from django.core.paginator import Paginator
+    from .directory import is_stale, search_users, synced_at, to_graph
+
+    query, sort = request.GET.get("q", ""), request.GET.get("sort", "name")
+    page = Paginator(
+        search_users(query, sort), AZURE_AUTH.get("USER_LIST_PAGE_SIZE")
+    ).get_page(request.GET.get("page"))
+    synced = synced_at()
+    return render(
+        request,
+        'azure_auth/list.html',
+        context={
+            'users': [to_graph(user) for user in page],
+            'page': page,
+            'q': query,
+            'sort': sort,
+            'synced_at': synced,
+            'is_stale': is_stale(synced),
+            'mirror': True,
+        },
+    )
+
+
 class UserListView(UserAdminRequiredMixin, View):
     def get(self, request):
-        from .graph_api import GraphApi
-        users = GraphApi().user.list()
-        if 'error' in request:
+        if AZURE_AUTH.get("DIRECTORY_MIRROR"):
+            return _mirror_page(request)
+        from .graph_api import GraphApi, GraphApiError
+
+        try:
+            users, next_cursor = GraphApi().user.list_page(
+                page_size=AZURE_AUTH.get("USER_LIST_PAGE_SIZE"),
+                cursor=request.GET.get("cursor"),
+            )
+        except GraphApiError as e:
+            return render(
+                request,
+                'azure_auth/list.html',
+                context={'errors': e.error.get("error").get("message")},
+            )
+        return render(
+            request,
+            'azure_auth/list.html',
+            context={
+                'users': users,
+                'next_cursor': next_cursor,
+                'is_first_page': not request.GET.get("cursor"),
+            },
+        )
+
+
+class UserSearchView(UserAdminRequiredMixin, View):
+    """Typeahead of the users in the directory copy, as JSON."""
+
+    max_results = 50
+
+    def get(self, request):
+        from .directory import search_users, synced_at, to_graph
+
+        if not AZURE_AUTH.get("DIRECTORY_MIRROR"):
             return HttpResponseNotFound()
-        return render(request, 'azure_auth/list.html', context={
-            'users': users.get('value')
-        })
+        query = request.GET.get("q", "").strip()
+        try:
+            limit = max(0, min(int(request.GET.get("limit", 10)), self.max_results))
+        except ValueError:
+            return HttpResponseBadRequest()
+        users = (
+            search_users(query, request.GET.get("sort", "name"))[:limit]
+            if query
+            else []
+        )
+        return JsonResponse(
+            {"value": [to_graph(user) for user in users], "syncedAt": synced_at(),}
+        )
 
 
 class UserDeleteView(UserAdminRequiredMixin, View):
     def post(self, request, user_id):
+        if AZURE_AUTH.get("GRAPH_JOBS"):
+            return _enqueue(
+                request, "user.delete", f"user:{user_id}", {"user_id": str(user_id),}
+            )
         from .graph_api import GraphApi
+
         if not GraphApi().user.delete(user_id):
             return HttpResponseBadRequest()
+        DirectoryUser.objects.filter(pk=user_id).delete()
         try:
             user = User.objects.get(azure_object_id=user_id)
             user.delete()
         except User.DoesNotExist:
             return HttpResponse('Deleted')
+
+
+class JobStatusView(UserAdminRequiredMixin, View):
+    def get(self, request, job_id):
+        from .models import GraphJob
+
+        job = GraphJob.objects.filter(pk=job_id).first()
+        if job is None:
+            return HttpResponseNotFound()
+        return JsonResponse(
+            {
+                "job": str(job.pk),
+                "kind": job.kind,
+                "status": job.status,
+                "result": job.result,
+                "coalesced": job.coalesced,
+                "created_at": job.created_at,
+                "updated_at": job.updated_at,
+            }
+        )
+
+
+def _closes_graph_client(view):
+    """
+    Closes the AsyncGraphApi client of the event loop once an async view
+    returns, unless it runs in the long-lived loop of an ASGI server.
+    """
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            return await view(request, *args, **kwargs)
+        finally:
+            if not isinstance(request, ASGIRequest):
+                from .async_graph_api import close_loop_client
+
+                await close_loop_client()
+
+    return wrapper
+
+
+async def _admin_gather(request, *calls):
+    """
+    Runs the admin check of `request` and, only once it passed, the given calls
+    (functions returning awaitables) concurrently. Returns the response to send
+    if the check failed, and the call results.
+    """
+    if denied := await user_admin_required(request):
+        return denied, [None] * len(calls)
+    results = await asyncio.gather(*(call() for call in calls), return_exceptions=True)
+    return None, results
+
+
+@_closes_graph_client
+async def user_list_async(request):
+    """Async version of UserListView."""
+    from .async_graph_api import AsyncGraphApi
+    from .graph_api import GraphApiError
+
+    denied, (page,) = await _admin_gather(
+        request,
+        lambda: AsyncGraphApi().user.list_page(
+            page_size=AZURE_AUTH.get("USER_LIST_PAGE_SIZE"),
+            cursor=request.GET.get("cursor"),
+        ),
+    )
+    if denied:
+        return denied
+    if isinstance(page, GraphApiError):
+        return render(
+            request,
+            'azure_auth/list.html',
+            context={'errors': page.error.get("error").get("message")},
+        )
+    if isinstance(page, Exception):
+        raise page
+    users, next_cursor = page
+    return render(
+        request,
+        'azure_auth/list.html',
+        context={
+            'users': users,
+            'next_cursor': next_cursor,
+            'is_first_page': not request.GET.get("cursor"),
+        },
+    )
+
+
+@_closes_graph_client
+async def user_update_async(request, user_id):
+    """Async version of UserUpdateView."""
+    from .async_graph_api import AsyncGraphApi
+
+    if request.method == "POST":
+        if denied := await user_admin_required(request):
+            return denied
+        form = UserUpdateForm(request.POST)
+        if not form.is_valid():
+            context = {"form": form, "errors": form.errors}
+            return render(request, "azure_auth/register.html", context=context)
+        graph_api = AsyncGraphApi()
+        res = await graph_api.user.update(user_id, **form.cleaned_data)
+        if res is not True:
+            context = {"form": form, "errors": res.get("error").get("message")}
+            return render(request, "azure_auth/register.html", context=context)
+        user, new_data = await asyncio.gather(
+            sync_to_async(User.objects.filter(azure_object_id=user_id).first)(),
+            graph_api.user.get(user_id),
+        )
+        if user is None:
+            return HttpResponseNotFound()
+        if 'error' not in new_data:
+            user.first_name = new_data.get('givenName')
+            user.last_name = new_data.get('surname')
+            user.email = new_data.get('userPrincipalName')
+            await sync_to_async(user.save)()
+        return render(request, "azure_auth/update.html", context={'user': user})
+
+    # The local row and the directory entry are fetched together after the admin check
+    denied, (user, res) = await _admin_gather(
+        request,
+        sync_to_async(User.objects.filter(azure_object_id=user_id).first),
+        lambda: AsyncGraphApi().user.get(user_id),
+    )
+    if denied:
+        return denied
+    for result in (user, res):
+        if isinstance(result, Exception):
+            raise result
+    if 'error' in res:
+        if user is None:
+            return HttpResponseBadRequest()
+    elif user is None:
+        user = await sync_to_async(User.objects.create)(
+            azure_object_id=user_id,
+            email=res.get('userPrincipalName'),
+            first_name=res.get('givenName'),
+            last_name=res.get('surname'),
+        )
+    else:
+        user.first_name = res.get('givenName')
+        user.last_name = res.get('surname')
+        user.email = res.get('userPrincipalName')
+        await sync_to_async(user.save)()
+    form = UserUpdateForm(
+        data={
+            'username': user.email.split('@')[0],
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+        }
+    )
+    return render(request, "azure_auth/update.html", context={"form": form})
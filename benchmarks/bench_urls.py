@@ -0,0 +1,10 @@
+from django.http import HttpResponse
+from django.urls import include, path
+
+from azure_auth.views import UserListView
+
+urlpatterns = [
+    path("", lambda request: HttpResponse("home"), name="home"),
+    path("users", UserListView.as_view(), name="user_list"),
+    path("auth/", include("azure_auth.urls")),
+]
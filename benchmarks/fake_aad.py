@@ -0,0 +1,292 @@
+"""
+Local stand-in for the Azure AD token endpoint and the parts of Microsoft Graph
+used by azure_auth, so the package can be benchmarked without a tenant.
+
+Requests meant for login.microsoftonline.com and graph.microsoft.com are sent
+to this server by mounting `LocalAdapter` on the requests sessions in use.
+"""
+import base64
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from requests.adapters import HTTPAdapter
+
+TENANT = "00000000-0000-0000-0000-00000000beef"
+DOMAIN = "@bench.onmicrosoft.com"
+AUTHORITY_HOST = "https://login.microsoftonline.com"
+GRAPH_HOST = "https://graph.microsoft.com"
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+
+class FakeTenant:
+    """A generated directory of `size` users, the first `admins` of them admins."""
+
+    def __init__(self, size=1000, admins=10):
+        self.users = []
+        self.by_key = {}
+        for i in range(size):
+            user = {
+                "id": str(uuid.uuid5(uuid.NAMESPACE_OID, f"bench-user-{i}")),
+                "givenName": f"First{i}",
+                "surname": f"Last{i}",
+                "jobTitle": "Benchmark",
+                "userPrincipalName": f"user{i}{DOMAIN}",
+                "accountEnabled": True,
+            }
+            self.users.append(user)
+            self.by_key[user["id"]] = user
+            self.by_key[user["userPrincipalName"].lower()] = user
+        self.admins = {user["id"] for user in self.users[:admins]}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self.by_key.get(key.lower())
+
+    def add(self, user):
+        with self._lock:
+            self.users.append(user)
+            self.by_key[user["id"]] = user
+            self.by_key[user["userPrincipalName"].lower()] = user
+
+
+class FakeAadServer:
+    """
+    Serves the token and Graph endpoints from a background thread.
+
+    :param tenant: The FakeTenant served.
+    :param latency: Seconds added to every response.
+    :param page_size: Maximum users per page of '/users', whatever '$top' says.
+    :param throttle_rate: Fraction of Graph requests answered with a 429.
+    :param retry_after: 'Retry-After' of the injected 429s.
+    """
+
+    def __init__(self, tenant, latency=0.0, page_size=100, throttle_rate=0.0,
+                 retry_after=0, client_id="bench-client"):
+        self.tenant = tenant
+        self.latency = latency
+        self.page_size = page_size
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.client_id = client_id
+        self.calls = Counter()
+        self._calls_lock = threading.Lock()
+        self._random = random.Random(0)
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self.httpd.server_address[1]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def total_calls(self):
+        with self._calls_lock:
+            return sum(self.calls.values())
+
+    def count(self, kind):
+        with self._calls_lock:
+            self.calls[kind] += 1
+
+    def throttled(self):
+        with self._calls_lock:
+            return self._random.random() < self.throttle_rate
+
+    # Token endpoint
+
+    def openid_configuration(self):
+        base = f"{AUTHORITY_HOST}/{TENANT}"
+        return 200, {
+            "authorization_endpoint": f"{base}/oauth2/v2.0/authorize",
+            "token_endpoint": f"{base}/oauth2/v2.0/token",
+            "issuer": f"{base}/v2.0",
+        }
+
+    def token(self, form):
+        grant_type = form.get("grant_type")
+        result = {
+            "token_type": "Bearer",
+            "expires_in": 3600,
+            "access_token": uuid.uuid4().hex,
+        }
+        if grant_type == "client_credentials":
+            return 200, result
+        if grant_type == "authorization_code":
+            # The code is the user principal name of the user signing in
+            user = self.tenant.get(form.get("code", ""))
+        elif grant_type == "refresh_token":
+            user = self.tenant.get(form.get("refresh_token", "").split(":", 1)[-1])
+        else:
+            user = None
+        if user is None:
+            return 400, {"error": "invalid_grant", "error_description": "Unknown code"}
+        now = int(time.time())
+        claims = {
+            "aud": self.client_id,
+            "iss": f"{AUTHORITY_HOST}/{TENANT}/v2.0",
+            "iat": now,
+            "exp": now + 3600,
+            "oid": user["id"],
+            "sub": user["id"],
+            "tid": TENANT,
+            "name": f"{user['givenName']} {user['surname']}",
+            "preferred_username": user["userPrincipalName"],
+        }
+        result.update({
+            "scope": form.get("scope", ""),
+            "refresh_token": "refresh:" + user["userPrincipalName"],
+            "id_token": f"{_b64({'alg': 'none'})}.{_b64(claims)}.",
+            "client_info": _b64({"uid": user["id"], "utid": TENANT}),
+        })
+        return 200, result
+
+    # Graph
+
+    def graph(self, method, path, query, body):
+        parts = [p for p in path.split("/") if p][1:]  # without 'v1.0'
+        if parts == ["$batch"] and method == "POST":
+            return 200, {"responses": [self._batch_item(r) for r in body["requests"]]}
+        if parts == ["users"] and method == "GET":
+            return self.list_users(query)
+        if parts == ["users"] and method == "POST":
+            user = {
+                "id": str(uuid.uuid4()),
+                "givenName": body.get("givenName"),
+                "surname": body.get("surname"),
+                "jobTitle": body.get("jobTitle"),
+                "userPrincipalName": body.get("userPrincipalName"),
+                "accountEnabled": body.get("accountEnabled", True),
+            }
+            self.tenant.add(user)
+            return 201, user
+        if len(parts) >= 2 and parts[0] == "users":
+            user = self.tenant.get(parts[1])
+            if user is None:
+                return 404, {"error": {"code": "Request_ResourceNotFound",
+                                       "message": "Resource does not exist."}}
+            if len(parts) == 2 and method == "GET":
+                return 200, user
+            if len(parts) == 2 and method in ("PATCH", "DELETE"):
+                return 204, None
+            if parts[2:] == ["memberOf", "microsoft.graph.directoryRole"]:
+                roles = []
+                if user["id"] in self.tenant.admins:
+                    roles.append({
+                        "id": "role-user-admin",
+                        "displayName": "User Account Administrator",
+                        "roleTemplateId": "fe930be7-5e62-47db-91af-98c3a49a38b1",
+                    })
+                return 200, {"value": roles}
+        return 400, {"error": {"code": "BadRequest", "message": f"{method} {path}"}}
+
+    def list_users(self, query):
+        top = min(int(query.get("$top", self.page_size)), self.page_size)
+        start = int(query.get("$skiptoken", 0))
+        users = self.tenant.users[start:start + top]
+        select = query.get("$select")
+        if select:
+            fields = select.split(",")
+            users = [{k: u[k] for k in fields if k in u} for u in users]
+        result = {"value": users}
+        if start + top < len(self.tenant.users):
+            next_query = {**query, "$skiptoken": start + top}
+            result["@odata.nextLink"] = f"{GRAPH_HOST}/v1.0/users?{urlencode(next_query)}"
+        return 200, result
+
+    def _batch_item(self, request):
+        url = urlparse(request["url"])
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        status, body = self.graph(
+            request["method"], "/v1.0" + url.path, query, request.get("body")
+        )
+        return {"id": request["id"], "status": status, "body": body}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately, avoid delayed ACK stalls
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self.dispatch("GET")
+
+            def do_POST(self):
+                self.dispatch("POST")
+
+            def do_PATCH(self):
+                self.dispatch("PATCH")
+
+            def do_DELETE(self):
+                self.dispatch("DELETE")
+
+            def dispatch(self, method):
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                if server.latency:
+                    time.sleep(server.latency)
+
+                if url.path.endswith("/.well-known/openid-configuration"):
+                    server.count("discovery")
+                    return self.send(*server.openid_configuration())
+                if url.path.endswith("/oauth2/v2.0/token"):
+                    server.count("token")
+                    form = {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+                    return self.send(*server.token(form))
+
+                server.count("graph")
+                if server.throttled():
+                    server.count("throttled")
+                    return self.send(429, {"error": {
+                        "code": "TooManyRequests", "message": "Throttled"
+                    }}, {"Retry-After": str(server.retry_after)})
+                body = json.loads(raw) if raw else None
+                return self.send(*server.graph(method, url.path, query, body))
+
+            def send(self, status, body, headers=None):
+                content = json.dumps(body).encode() if body is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+        return Handler
+
+
+class LocalAdapter(HTTPAdapter):
+    """Sends requests for the AAD and Graph hosts to a FakeAadServer."""
+
+    def __init__(self, server_url, **kwargs):
+        self.server_url = server_url
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        for host in (AUTHORITY_HOST, GRAPH_HOST):
+            if request.url.startswith(host):
+                request.url = self.server_url + request.url[len(host):]
+        return super().send(request, **kwargs)
@@ -0,0 +1,368 @@
+"""
+Benchmarks azure_auth against a local AAD/Graph stand-in.
+
+Drives the real views and GraphApi with concurrent workers and reports, per
+scenario, the throughput, p50/p99 latency, outbound calls per request and
+database queries per request.
+
+    python benchmarks/run.py --tenant-size 5000 --latency 20 --concurrency 16
+    python benchmarks/run.py --json baseline.json
+    python benchmarks/run.py --compare baseline.json  # exits 1 on regressions
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django
+from django.conf import settings
+
+from fake_aad import AUTHORITY_HOST, TENANT, FakeAadServer, FakeTenant, LocalAdapter
+
+CLIENT_ID = "bench-client"
+
+
+def local_transport(**kwargs):
+    """GRAPH_TRANSPORT building a pooled transport aimed at the stand-in."""
+    from azure_auth.transport import GraphTransport
+
+    transport = GraphTransport(**kwargs)
+    adapter = LocalAdapter(
+        os.environ["AZURE_AUTH_BENCH_SERVER"],
+        pool_connections=kwargs["pool_connections"],
+        pool_maxsize=kwargs["pool_maxsize"],
+        pool_block=kwargs["pool_block"],
+    )
+    transport.session.mount("https://", adapter)
+    return transport
+
+
+def configure(database, options):
+    settings.configure(
+        SECRET_KEY="benchmark",
+        DEBUG=False,
+        ALLOWED_HOSTS=["testserver"],
+        INSTALLED_APPS=[
+            "django.contrib.auth",
+            "django.contrib.contenttypes",
+            "django.contrib.sessions",
+            "azure_auth",
+        ],
+        DATABASES={"default": database},
+        AUTH_USER_MODEL="azure_auth.User",
+        AUTHENTICATION_BACKENDS=["azure_auth.backends.CachedUserBackend"],
+        ROOT_URLCONF="bench_urls",
+        MIDDLEWARE=[
+            "django.contrib.sessions.middleware.SessionMiddleware",
+            "django.contrib.auth.middleware.AuthenticationMiddleware",
+        ],
+        TEMPLATES=[{
+            "BACKEND": "django.template.backends.django.DjangoTemplates",
+            "APP_DIRS": True,
+        }],
+        USE_TZ=True,
+        AZURE_AUTH={
+            "CLIENT_ID": CLIENT_ID,
+            "CLIENT_SECRET": "secret",
+            "AUTHORITY": f"{AUTHORITY_HOST}/{TENANT}",
+            "DOMAIN": "@bench.onmicrosoft.com",
+            "SCOPE": ["User.Read"],
+            "MSAL_WARM_ON_STARTUP": False,
+            "GRAPH_TRANSPORT": local_transport,
+            "GRAPH_RESILIENCE": not options.no_resilience,
+            "GRAPH_CACHE": not options.no_cache,
+            "GRAPH_COALESCE": not options.no_coalesce,
+            "USER_LIST_PAGE_SIZE": options.page_size,
+        },
+    )
+    django.setup()
+
+    if database["ENGINE"] == "django.db.backends.sqlite3":
+        from django.db.backends.signals import connection_created
+        from django.db.backends.sqlite3.base import DatabaseWrapper
+
+        def enable_wal(connection, **kwargs):
+            # Lets the workers read while another one writes
+            connection.cursor().execute("PRAGMA journal_mode=WAL")
+
+        def begin_immediate(self):
+            # A deferred transaction upgrading to a write fails at once with
+            # "database is locked" instead of waiting for the other writers
+            self.cursor().execute("BEGIN IMMEDIATE")
+
+        connection_created.connect(enable_wal, weak=False)
+        DatabaseWrapper._start_transaction_under_autocommit = begin_immediate
+
+
+# Scenarios are (prepare, request) pairs, both called with the worker's state,
+# the request number and the tenant. Only `request` is measured, it raises if
+# the request failed.
+
+def prepare_login(worker, i, tenant):
+    # What the authorization redirect leaves in the session
+    session = worker.client.session
+    session["state"] = str(i)
+    session.save()
+
+
+def scenario_login(worker, i, tenant):
+    from django.urls import reverse
+
+    user = tenant.users[i % len(tenant.users)]
+    res = worker.client.get(
+        reverse("azure_auth:login"), {"state": str(i), "code": user["userPrincipalName"]}
+    )
+    assert "_auth_user_id" in worker.client.session, res.status_code
+
+
+def prepare_user_list(worker, i, tenant):
+    if not worker.logged_in:
+        from azure_auth.models import get_user_model
+
+        admin = tenant.users[worker.number % len(tenant.admins)]
+        worker.client.force_login(
+            get_user_model().objects.get(azure_object_id=admin["id"])
+        )
+        worker.logged_in = True
+
+
+def scenario_user_list(worker, i, tenant):
+    res = worker.client.get("/users")
+    assert res.status_code == 200 and b"errors" not in res.content, res.status_code
+
+
+def scenario_graph_get(worker, i, tenant):
+    from azure_auth.graph_api import GraphApi
+
+    user = tenant.users[i % len(tenant.users)]
+    res = GraphApi().user.get(user["userPrincipalName"])
+    assert "error" not in res, res
+
+
+def scenario_graph_iter(worker, i, tenant):
+    from azure_auth.graph_api import GraphApi
+
+    count = sum(1 for _ in GraphApi().user.iter_users(page_size=999))
+    assert count >= len(tenant.users) - 1, count
+
+
+def prepare_nothing(worker, i, tenant):
+    pass
+
+
+SCENARIOS = {
+    "login": (prepare_login, scenario_login),
+    "user_list": (prepare_user_list, scenario_user_list),
+    "graph_get": (prepare_nothing, scenario_graph_get),
+    "graph_iter": (prepare_nothing, scenario_graph_iter),
+}
+
+
+class Worker:
+    def __init__(self, number):
+        from django.test import Client
+
+        self.number = number
+        self.client = Client()
+        self.logged_in = False
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def reset_caches():
+    from django.core.cache import caches
+
+    from azure_auth.response_cache import get_response_cache
+
+    for cache in caches.all():
+        cache.clear()
+    get_response_cache().clear()
+
+
+def run_scenario(name, server, tenant, options):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    reset_caches()
+    workers = threading.local()
+    all_workers = []
+    lock = threading.Lock()
+    latencies, queries, errors = [], [], []
+    prepare, request = SCENARIOS[name]
+
+    def call(i):
+        worker = getattr(workers, "state", None)
+        if worker is None:
+            with lock:
+                worker = workers.state = Worker(len(all_workers))
+                all_workers.append(worker)
+        prepare(worker, i, tenant)
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            try:
+                request(worker, i, tenant)
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+            elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            queries.append(len(captured))
+
+    calls_before = server.total_calls()
+    throttled_before = server.calls["throttled"]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=options.concurrency) as executor:
+        list(executor.map(call, range(options.requests)))
+    elapsed = time.perf_counter() - started
+    outbound = server.total_calls() - calls_before
+
+    return {
+        "requests": options.requests,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "throughput": options.requests / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "calls_per_request": outbound / options.requests,
+        "throttled": server.calls["throttled"] - throttled_before,
+        "queries_per_request": sum(queries) / options.requests,
+    }
+
+
+def print_report(results):
+    header = (
+        f"{'scenario':<12} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} "
+        f"{'calls/req':>10} {'429s':>6} {'queries/req':>12} {'errors':>7}"
+    )
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        print(
+            f"{name:<12} {r['throughput']:>9.1f} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f} "
+            f"{r['calls_per_request']:>10.2f} {r['throttled']:>6} "
+            f"{r['queries_per_request']:>12.2f} {r['errors']:>7}"
+        )
+        if r["first_error"]:
+            print(f"  first error: {r['first_error']}")
+
+
+def compare(results, baseline, tolerance):
+    """Returns the metrics that regressed against a baseline report."""
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for key in ("p50_ms", "p99_ms"):
+            if r[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{name} {key}: {base[key]:.1f} -> {r[key]:.1f}")
+        if r["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{name} throughput: {base['throughput']:.1f} -> {r['throughput']:.1f}"
+            )
+        # Outbound calls and queries are deterministic enough to compare exactly
+        for key in ("calls_per_request", "queries_per_request"):
+            if r[key] > base[key] + 0.01:
+                regressions.append(f"{name} {key}: {base[key]:.2f} -> {r[key]:.2f}")
+        if r["errors"] > base["errors"]:
+            regressions.append(f"{name} errors: {base['errors']} -> {r['errors']}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="Comma separated scenarios to run.")
+    parser.add_argument("--requests", type=int, default=500,
+                        help="Requests per scenario.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--tenant-size", type=int, default=1000)
+    parser.add_argument("--admins", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=5,
+                        help="Milliseconds added to every stand-in response.")
+    parser.add_argument("--page-size", type=int, default=100,
+                        help="Maximum users per page served by the stand-in.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="Fraction of Graph requests answered with a 429.")
+    parser.add_argument("--retry-after", type=int, default=0,
+                        help="Retry-After of the injected 429s.")
+    parser.add_argument("--database",
+                        help="JSON of the Django database to use, e.g. a PostgreSQL "
+                             "one. Defaults to a temporary SQLite file.")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--no-coalesce", action="store_true")
+    parser.add_argument("--no-resilience", action="store_true")
+    parser.add_argument("--json", help="Write the results to this file.")
+    parser.add_argument("--compare", help="Fail on regressions against this report.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative slowdown when comparing.")
+    options = parser.parse_args(argv)
+
+    tenant = FakeTenant(options.tenant_size, options.admins)
+    server = FakeAadServer(
+        tenant,
+        latency=options.latency / 1000,
+        page_size=options.page_size,
+        throttle_rate=options.throttle_rate,
+        retry_after=options.retry_after,
+        client_id=CLIENT_ID,
+    ).start()
+    os.environ["AZURE_AUTH_BENCH_SERVER"] = server.url
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = json.loads(options.database) if options.database else {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.path.join(directory, "bench.sqlite3"),
+            "OPTIONS": {"timeout": 30},
+        }
+        configure(database, options)
+
+        from django.core.management import call_command
+
+        from azure_auth.models import get_user_model
+        from azure_auth.msal_pool import msal_app_pool
+
+        call_command("migrate", verbosity=0)
+        msal_app_pool.http_client.session.mount(AUTHORITY_HOST, LocalAdapter(server.url))
+        get_user_model().objects.bulk_create([
+            get_user_model()(
+                azure_object_id=user["id"],
+                email=user["userPrincipalName"],
+                first_name=user["givenName"],
+                last_name=user["surname"],
+            )
+            for user in tenant.users[:options.admins]
+        ])
+
+        results = {}
+        for name in options.scenarios.split(","):
+            results[name] = run_scenario(name, server, tenant, options)
+        server.stop()
+
+    print_report(results)
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if options.compare:
+        with open(options.compare) as f:
+            regressions = compare(results, json.load(f), options.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
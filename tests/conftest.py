@@ -0,0 +1,32 @@
+import django
+from django.conf import settings
+
+
+def pytest_configure():
+    settings.configure(
+        SECRET_KEY="tests",
+        INSTALLED_APPS=[
+            "django.contrib.auth",
+            "django.contrib.contenttypes",
+            "django.contrib.sessions",
+            "azure_auth",
+        ],
+        DATABASES={
+            "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}
+        },
+        AUTH_USER_MODEL="azure_auth.User",
+        ROOT_URLCONF="tests.urls",
+        USE_TZ=True,
+        AZURE_AUTH={
+            "CLIENT_ID": "client",
+            "CLIENT_SECRET": "secret",
+            "AUTHORITY": "https://login.microsoftonline.com/tenant",
+            "DOMAIN": "example.com",
+            "MSAL_WARM_ON_STARTUP": False,
+        },
+    )
+    django.setup()
+
+    from django.core.management import call_command
+
+    call_command("migrate", verbosity=0)
@@ -0,0 +1,41 @@
+from unittest import TestCase, mock
+
+from azure_auth.apps import _start_background_threads
+
+
+@mock.patch.dict(
+    "azure_auth.settings.AZURE_AUTH",
+    {"MSAL_WARM_ON_STARTUP": True, "TOKEN_REFRESH_INTERVAL": 60,},
+)
+@mock.patch("azure_auth.token_refresh.get_token_refresher")
+@mock.patch("azure_auth.msal_pool.warm_msal_app_pool")
+class BackgroundThreadsTest(TestCase):
+    def test_threads_start_in_web_processes(self, warm, refresher):
+        for argv in (
+            ["/venv/bin/gunicorn", "project.wsgi"],
+            ["manage.py", "runserver", "--noreload"],
+        ):
+            with self.subTest(argv=argv):
+                warm.reset_mock()
+                refresher.reset_mock()
+                _start_background_threads(argv)
+                warm.assert_called_once_with()
+                refresher.return_value.start.assert_called_once_with(60)
+
+    def test_threads_never_start_in_management_commands(self, warm, refresher):
+        for argv in (
+            ["manage.py", "migrate"],
+            ["/venv/bin/django-admin", "shell"],
+            ["/venv/lib/python3.11/site-packages/django/__main__.py", "test"],
+            # The autoreloader, its child serves the requests
+            ["manage.py", "runserver"],
+        ):
+            with self.subTest(argv=argv):
+                _start_background_threads(argv)
+        warm.assert_not_called()
+        refresher.assert_not_called()
+
+    @mock.patch.dict("os.environ", {"RUN_MAIN": "true"})
+    def test_threads_start_in_the_runserver_child(self, warm, refresher):
+        _start_background_threads(["manage.py", "runserver"])
+        warm.assert_called_once_with()
@@ -0,0 +1,67 @@
+import asyncio
+from unittest import TestCase, mock
+
+import httpx
+
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from azure_auth import async_graph_api, views
+
+
+class Tokens:
+    def peek(self):
+        return "token"
+
+
+class AsyncAdminViewsTest(TestCase):
+    def request(self, path):
+        request = RequestFactory().get(path)
+        request.user = AnonymousUser()
+        return request
+
+    def test_anonymous_requests_do_not_call_graph(self):
+        with mock.patch("azure_auth.async_graph_api.AsyncGraphApi") as api:
+            list_response = asyncio.run(
+                views.user_list_async(self.request("/async/users"))
+            )
+            update_response = asyncio.run(
+                views.user_update_async(
+                    self.request("/async/update/x"),
+                    "00000000-0000-0000-0000-000000000001",
+                )
+            )
+        self.assertEqual(list_response.status_code, 302)
+        self.assertEqual(update_response.status_code, 302)
+        api.assert_not_called()
+
+    def test_wsgi_requests_close_their_graph_client(self):
+        clients, async_client = [], httpx.AsyncClient
+
+        def client(**kwargs):
+            transport = httpx.MockTransport(
+                lambda request: httpx.Response(200, json={"value": []})
+            )
+            clients.append(async_client(transport=transport, **kwargs))
+            return clients[-1]
+
+        async def allowed(request):
+            return None
+
+        with mock.patch("azure_auth.views.user_admin_required", allowed), mock.patch(
+            "azure_auth.views.render", return_value=HttpResponse()
+        ), mock.patch(
+            "azure_auth.async_graph_api.get_app_token_store", return_value=Tokens()
+        ), mock.patch.object(
+            async_graph_api.httpx, "AsyncClient", client
+        ):
+            # asgiref runs each of them in a new event loop
+            for _ in range(2):
+                response = asyncio.run(
+                    views.user_list_async(self.request("/async/users"))
+                )
+                self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(clients), 2)
+        self.assertTrue(all(client.is_closed for client in clients))
+        self.assertEqual(len(async_graph_api._loop_state), 0)
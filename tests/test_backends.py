@@ -0,0 +1,41 @@
+from django.core.cache import cache
+from django.test import TransactionTestCase
+
+from azure_auth.backends import CachedUserBackend
+from azure_auth.models import User
+
+USER_ID = "5f0c7a3e-9b51-4e53-9c9e-0f6b1a1f2c11"
+
+
+class CachedUserBackendTest(TransactionTestCase):
+    def setUp(self):
+        self.addCleanup(cache.clear)
+        self.backend = CachedUserBackend()
+        self.user = User.objects.create(
+            azure_object_id=USER_ID, email="ann@example.com", first_name="Ann"
+        )
+
+    def test_cached_users_are_resolved_without_queries(self):
+        self.backend.get_user(USER_ID)
+        with self.assertNumQueries(0):
+            user = self.backend.get_user(USER_ID)
+        self.assertEqual((str(user.pk), user.email), (USER_ID, "ann@example.com"))
+
+    def test_saves_invalidate_the_cached_user(self):
+        self.backend.get_user(USER_ID)
+        self.user.first_name = "Annie"
+        self.user.save()
+        # The row and its permission index are read again
+        with self.assertNumQueries(2):
+            self.assertEqual(self.backend.get_user(USER_ID).first_name, "Annie")
+
+    def test_deleted_users_are_not_resolved(self):
+        self.backend.get_user(USER_ID)
+        self.user.delete()
+        self.assertIsNone(self.backend.get_user(USER_ID))
+
+    def test_deferred_fields_are_loaded_on_access(self):
+        self.backend.get_user(USER_ID)
+        user = self.backend.get_user(USER_ID)
+        with self.assertNumQueries(1):
+            self.assertIsNone(user.last_login)
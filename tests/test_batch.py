@@ -0,0 +1,167 @@
+import time
+from email.utils import formatdate
+from unittest import TestCase, mock
+
+from azure_auth.batch import GraphBatch
+
+
+class Response:
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def json(self):
+        return self.body
+
+
+class Api:
+    """Answers `$batch` posts with the queued responses, recording the envelopes."""
+
+    ENDPOINT = "https://graph.microsoft.com/v1.0"
+    auth_header = {"Authorization": "Bearer token"}
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.envelopes = []
+        self.transport = mock.Mock()
+        self.transport.post.side_effect = self.post
+        del self.transport.invalidate
+
+    def post(self, url, headers=None, json=None):
+        self.envelopes.append([request["id"] for request in json["requests"]])
+        response = self.responses.pop(0)
+        return response(json["requests"]) if callable(response) else response
+
+
+def answer(status, headers=None):
+    """Answers every sub-request of an envelope with `status`."""
+    return lambda requests: Response(
+        200,
+        {
+            "responses": [
+                {
+                    "id": request["id"],
+                    "status": status,
+                    "headers": headers or {},
+                    "body": {},
+                }
+                for request in requests
+            ]
+        },
+    )
+
+
+class GraphBatchTest(TestCase):
+    @mock.patch("azure_auth.batch.time.sleep")
+    def test_retry_after_http_date(self, sleep):
+        retry_at = formatdate(time.time() + 30, usegmt=True)
+        api = Api(answer(429, {"Retry-After": retry_at}), answer(200))
+        batch = GraphBatch(api)
+        request = batch.add("GET", "/users/ann")
+        batch.execute()
+        self.assertEqual(request.status, 200)
+        (delay,), _ = sleep.call_args
+        self.assertTrue(28 <= delay <= 30, delay)
+
+    @mock.patch("azure_auth.batch.time.sleep")
+    def test_envelope_retry_after_http_date(self, sleep):
+        retry_at = formatdate(time.time() + 30, usegmt=True)
+        api = Api(Response(503, {}, {"Retry-After": retry_at}), answer(200))
+        batch = GraphBatch(api)
+        batch.add("GET", "/users/ann")
+        batch.execute()
+        (delay,), _ = sleep.call_args
+        self.assertTrue(28 <= delay <= 30, delay)
+
+    def test_envelopes_hold_at_most_20_requests(self):
+        api = Api(answer(200), answer(200))
+        batch = GraphBatch(api)
+        for number in range(25):
+            batch.add("GET", f"/users/{number}")
+        batch.execute()
+        self.assertEqual([len(envelope) for envelope in api.envelopes], [20, 5])
+
+    def test_dependency_chains_are_not_split(self):
+        api = Api(answer(200), answer(200))
+        batch = GraphBatch(api)
+        for number in range(18):
+            batch.add("GET", f"/users/{number}")
+        first = batch.add("POST", "/users", body={})
+        second = batch.add("PATCH", "/users/x", body={}, depends_on=[first])
+        batch.add("GET", "/users/x", depends_on=[second])
+        batch.execute()
+        self.assertEqual(api.envelopes[1], ["19", "20", "21"])
+
+    def test_too_long_chain_raises(self):
+        batch = GraphBatch(Api())
+        previous = None
+        for number in range(21):
+            previous = batch.add(
+                "GET", f"/users/{number}", depends_on=[previous] if previous else None
+            )
+        with self.assertRaises(ValueError):
+            batch.execute()
+
+    def test_envelope_error_is_mapped_to_every_request(self):
+        error = {"error": {"code": "BadRequest", "message": "Invalid batch"}}
+        api = Api(Response(400, error))
+        batch = GraphBatch(api)
+        requests = [batch.add("GET", "/users/ann"), batch.add("GET", "/users/bob")]
+        batch.execute()
+        self.assertEqual(len(api.envelopes), 1)
+        for request in requests:
+            self.assertEqual((request.status, request.result), (400, error))
+            self.assertFalse(request.ok)
+
+    @mock.patch("azure_auth.batch.time.sleep")
+    def test_failed_dependency_is_retried_with_its_request(self, sleep):
+        def throttled_then_failed(requests):
+            return Response(
+                200,
+                {
+                    "responses": [
+                        {
+                            "id": "1",
+                            "status": 429,
+                            "headers": {"Retry-After": "1"},
+                            "body": {},
+                        },
+                        {"id": "2", "status": 424, "body": {}},
+                    ]
+                },
+            )
+
+        api = Api(throttled_then_failed, answer(201))
+        batch = GraphBatch(api)
+        first = batch.add("POST", "/users", body={})
+        second = batch.add("PATCH", "/users/x", body={}, depends_on=[first])
+        batch.execute()
+        self.assertEqual(api.envelopes, [["1", "2"], ["1", "2"]])
+        self.assertEqual((first.status, second.status), (201, 201))
+        sleep.assert_called_once_with(1.0)
+
+    @mock.patch("azure_auth.batch.time.sleep")
+    def test_writes_are_only_retried_when_throttled(self, sleep):
+        api = Api(answer(503), answer(429), answer(201))
+        batch = GraphBatch(api)
+        create = batch.add("POST", "/users", body={})
+        batch.execute()
+        # Graph may have created the user before failing
+        self.assertEqual((len(api.envelopes), create.status), (1, 503))
+
+        batch = GraphBatch(api)
+        create = batch.add("POST", "/users", body={})
+        batch.execute()
+        self.assertEqual((len(api.envelopes), create.status), (3, 201))
+
+    @mock.patch("azure_auth.batch.time.sleep")
+    def test_failed_envelope_retries_idempotent_requests(self, sleep):
+        api = Api(Response(503, {}), answer(200))
+        batch = GraphBatch(api)
+        create = batch.add("POST", "/users", body={})
+        read = batch.add("GET", "/users/ann")
+        batch.add("GET", "/users/x", depends_on=[create])
+        batch.execute()
+        self.assertEqual(api.envelopes[1], ["2"])
+        self.assertEqual((create.status, read.status), (503, 200))
@@ -0,0 +1,50 @@
+from unittest import TestCase, mock
+
+import requests
+from django.test import RequestFactory
+
+from azure_auth.bearer import BearerTokenMiddleware, JWKSCache, SigningKeysUnavailable
+
+
+class JWKSCacheTest(TestCase):
+    def setUp(self):
+        patcher = mock.patch("azure_auth.msal_pool.msal_app_pool")
+        self.pool = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.jwks = JWKSCache(ttl=3600, min_refresh_interval=60)
+        self.jwks._openid_config = {"issuer": "issuer", "jwks_uri": "https://keys"}
+
+    def test_last_keys_are_served_when_a_refresh_fails(self):
+        key = object()
+        self.jwks._keys, self.jwks._fetched_at = {"kid": key}, 0.0
+        self.pool.http_client.session.get.side_effect = requests.ConnectionError()
+        self.assertIs(self.jwks.get_key("kid"), key)
+        # Not fetched again before min_refresh_interval
+        self.assertIs(self.jwks.get_key("kid"), key)
+        self.assertEqual(self.pool.http_client.session.get.call_count, 1)
+
+    def test_failed_first_fetch_raises(self):
+        self.pool.http_client.session.get.return_value.json.side_effect = ValueError()
+        with self.assertRaises(SigningKeysUnavailable):
+            self.jwks.get_key("kid")
+
+    def test_failed_openid_configuration_raises(self):
+        self.jwks._openid_config = None
+        self.pool.http_client.get.return_value.raise_for_status.side_effect = requests.HTTPError(
+            "500 Error"
+        )
+        with self.assertRaises(SigningKeysUnavailable):
+            self.jwks.openid_config
+
+
+class BearerTokenMiddlewareTest(TestCase):
+    @mock.patch(
+        "azure_auth.bearer.authenticate", side_effect=SigningKeysUnavailable("JWKS")
+    )
+    def test_unavailable_keys_answer_503(self, authenticate):
+        middleware = BearerTokenMiddleware(mock.Mock())
+        response = middleware(
+            RequestFactory().get("/", HTTP_AUTHORIZATION="Bearer token")
+        )
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response)
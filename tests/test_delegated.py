@@ -0,0 +1,56 @@
+from unittest import TestCase, mock
+
+from azure_auth.delegated import DelegatedClientPool
+
+
+class Client:
+    """Stands for the DelegatedTokens of a user."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.discarded = False
+        self.version = 1
+        self.saved_version = 0
+
+    def snapshot(self):
+        if self.version == self.saved_version:
+            return None
+        return f"cache of {self.user_id}", self.version
+
+    def saved(self, version):
+        self.saved_version = max(self.saved_version, version)
+
+
+class DelegatedClientPoolTest(TestCase):
+    def setUp(self):
+        self.store = mock.Mock()
+        patcher = mock.patch(
+            "azure_auth.delegated.get_token_store", return_value=self.store
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = DelegatedClientPool()
+        self.pool._flusher = object()  # No background flushes
+
+    def test_flush_writes_changed_caches_once(self):
+        client = Client("ann")
+        self.pool.mark_dirty(client)
+        self.assertEqual(self.pool.flush(), 1)
+        self.store.save_many.assert_called_once_with({"ann": "cache of ann"})
+        self.pool.mark_dirty(client)
+        self.assertEqual(self.pool.flush(), 0)
+
+    def test_failed_write_keeps_clients_dirty(self):
+        client, discarded = Client("ann"), Client("bob")
+        discarded.discarded = True
+        self.pool.mark_dirty(client)
+        self.pool.mark_dirty(discarded)
+        self.store.save_many.side_effect = OSError("database is gone")
+        with self.assertRaises(OSError):
+            self.pool.flush()
+        self.assertEqual(client.saved_version, 0)
+
+        self.store.save_many.side_effect = None
+        self.assertEqual(self.pool.flush(), 1)
+        self.store.save_many.assert_called_with({"ann": "cache of ann"})
+        self.assertEqual(client.saved_version, 1)
@@ -0,0 +1,44 @@
+import uuid
+
+from django.test import TestCase
+
+from azure_auth.directory import mirror_users, search_users
+
+
+class SearchUsersTest(TestCase):
+    def setUp(self):
+        people = [
+            ("Ann", "Lee", "ann.lee@example.com", "Developer"),
+            ("Bob", "Andrews", "bob@example.com", "Designer"),
+            ("Annie", "Brown", "annie@example.com", "Manager"),
+        ]
+        mirror_users(
+            {
+                str(uuid.uuid4()): {
+                    "givenName": given,
+                    "surname": surname,
+                    "userPrincipalName": upn,
+                    "jobTitle": job,
+                    "accountEnabled": True,
+                }
+                for given, surname, upn, job in people
+            },
+            [],
+        )
+
+    def names(self, query, sort="name"):
+        return [user.given_name for user in search_users(query, sort)]
+
+    def test_every_word_must_prefix_a_field(self):
+        self.assertEqual(self.names("ann"), ["Annie", "Ann"])
+        self.assertEqual(self.names("and"), ["Bob"])
+        self.assertEqual(self.names("ANN dev"), ["Ann"])
+        self.assertEqual(self.names("nn"), [])
+
+    def test_sorts(self):
+        self.assertEqual(self.names(""), ["Bob", "Annie", "Ann"])
+        self.assertEqual(self.names("", "-name"), ["Ann", "Annie", "Bob"])
+        self.assertEqual(self.names("", "upn"), ["Ann", "Annie", "Bob"])
+        self.assertEqual(self.names("", "job_title"), ["Bob", "Ann", "Annie"])
+        # Unknown sorts fall back to the name
+        self.assertEqual(self.names("", "password"), ["Bob", "Annie", "Ann"])
@@ -0,0 +1,74 @@
+import json
+from unittest import TestCase, mock
+
+from azure_auth.graph_api import GraphApi, GraphApiError
+
+USERS_URL = "https://graph.microsoft.com/v1.0/users"
+
+
+class Response:
+    def __init__(self, body):
+        self.status_code = 200
+        self.headers = {}
+        self.content = json.dumps(body).encode()
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class Pages:
+    """Answers '/users' with the page of the requested $skiptoken."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def get(self, url, params=None, headers=None):
+        self.calls.append(params)
+        return Response(self.pages[params.get("$skiptoken")])
+
+
+def page(names, skiptoken=None):
+    body = {"value": [{"userPrincipalName": name} for name in names]}
+    if skiptoken:
+        body["@odata.nextLink"] = f"{USERS_URL}?$top=2&$skiptoken={skiptoken}"
+    return body
+
+
+class UserPagesTest(TestCase):
+    def setUp(self):
+        patcher = mock.patch("azure_auth.graph_api.get_app_token_store")
+        patcher.start().return_value.get_token.return_value = "token"
+        self.addCleanup(patcher.stop)
+        self.transport = Pages(
+            {
+                None: page(["ann", "bob"], skiptoken="p2"),
+                "p2": page(["cid", "dan"], skiptoken="p3"),
+                "p3": page(["eve"]),
+            }
+        )
+        self.api = GraphApi(transport=self.transport)
+
+    def test_list_page_returns_the_cursor_of_the_next_page(self):
+        users, cursor = self.api.user.list_page(page_size=2, cursor="p2")
+        self.assertEqual([u["userPrincipalName"] for u in users], ["cid", "dan"])
+        self.assertEqual(cursor, "p3")
+        self.assertEqual(self.transport.calls[0]["$top"], 2)
+        self.assertEqual(self.transport.calls[0]["$skiptoken"], "p2")
+
+    def test_last_page_has_no_cursor(self):
+        self.assertEqual(self.api.user.list_page(cursor="p3")[1], None)
+
+    def test_iter_users_requests_pages_lazily(self):
+        users = self.api.user.iter_users(page_size=2)
+        self.assertEqual(
+            [next(users)["userPrincipalName"] for _ in range(3)], ["ann", "bob", "cid"]
+        )
+        self.assertEqual(len(self.transport.calls), 2)
+        self.assertEqual([u["userPrincipalName"] for u in users], ["dan", "eve"])
+        self.assertEqual(len(self.transport.calls), 3)
+
+    def test_errors_are_raised(self):
+        self.transport.pages[None] = {"error": {"code": "Authorization_RequestDenied"}}
+        with self.assertRaises(GraphApiError):
+            self.api.user.list_page()
@@ -0,0 +1,68 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from azure_auth import jobs
+from azure_auth.jobs import JobQueue
+from azure_auth.models import GraphJob
+
+
+class JobQueueTest(TestCase):
+    payload = {
+        "username": "ann",
+        "first_name": "Ann",
+        "last_name": "Lee",
+        "password": "hunter2",
+    }
+
+    def test_password_is_stored_encrypted_and_dropped(self):
+        queue = JobQueue()
+        job = queue.enqueue("user.create", "user:ann", self.payload)
+        stored = GraphJob.objects.get(pk=job.pk).payload
+        self.assertNotIn("hunter2", stored["password"])
+
+        handler = mock.Mock(return_value={"id": "1"})
+        with mock.patch.dict("azure_auth.jobs.HANDLERS", {"user.create": handler}):
+            queue.run(job.pk)
+        handler.assert_called_once_with(self.payload)
+        job.refresh_from_db()
+        self.assertEqual(job.status, GraphJob.DONE)
+        self.assertNotIn("password", job.payload)
+
+    def test_password_is_dropped_when_the_job_fails(self):
+        queue = JobQueue()
+        job = queue.enqueue("user.create", "user:ann", self.payload)
+        handler = mock.Mock(side_effect=OSError("Graph is gone"))
+        with mock.patch.dict("azure_auth.jobs.HANDLERS", {"user.create": handler}):
+            queue.run(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, GraphJob.FAILED)
+        self.assertNotIn("password", job.payload)
+
+    def test_pending_edits_are_merged(self):
+        queue = JobQueue()
+        first = queue.enqueue("user.update", "user:ann", {"first_name": "Ann"})
+        second = queue.enqueue("user.update", "user:ann", {"last_name": "Lee"})
+        self.assertEqual(second.pk, first.pk)
+        job = GraphJob.objects.get(pk=first.pk)
+        self.assertEqual(job.payload, {"first_name": "Ann", "last_name": "Lee"})
+        self.assertEqual(job.coalesced, 1)
+
+    def test_job_claimed_while_merging_is_not_changed(self):
+        queue = JobQueue()
+        first = queue.enqueue("user.update", "user:ann", {"first_name": "Ann"})
+
+        def claim_then_merge(*args):
+            # A worker claims the job between the read and the write
+            GraphJob.objects.filter(pk=first.pk).update(status=GraphJob.RUNNING)
+            return merge(*args)
+
+        merge = jobs._merge
+        with mock.patch("azure_auth.jobs._merge", side_effect=claim_then_merge):
+            second = queue.enqueue("user.update", "user:ann", {"last_name": "Lee"})
+        self.assertNotEqual(second.pk, first.pk)
+        first.refresh_from_db()
+        self.assertEqual((first.payload, first.coalesced), ({"first_name": "Ann"}, 0))
+        self.assertEqual(
+            GraphJob.objects.get(pk=second.pk).payload, {"last_name": "Lee"}
+        )
@@ -0,0 +1,50 @@
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import PermissionDenied
+from django.test import RequestFactory, TestCase
+
+from azure_auth.metrics import RegistrySink, metrics_view
+from azure_auth.models import User
+
+
+class MetricsViewTest(TestCase):
+    def setUp(self):
+        patcher = mock.patch("azure_auth.metrics.get_sink", return_value=RegistrySink())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        settings = mock.patch.dict(
+            "azure_auth.metrics.AZURE_AUTH",
+            {"METRICS_TOKEN": "scraper", "METRICS_ALLOWED_IPS": (),},
+        )
+        settings.start()
+        self.addCleanup(settings.stop)
+
+    def request(self, **headers):
+        request = RequestFactory().get("/metrics", **headers)
+        request.user = AnonymousUser()
+        return request
+
+    def test_anonymous_requests_are_denied_from_any_address(self):
+        with self.assertRaises(PermissionDenied):
+            metrics_view(self.request(REMOTE_ADDR="127.0.0.1"))
+        with self.assertRaises(PermissionDenied):
+            metrics_view(self.request(HTTP_AUTHORIZATION="Bearer wrong"))
+
+    def test_superusers_are_allowed(self):
+        request = self.request()
+        request.user = User(email="ann@example.com", is_superuser=True)
+        self.assertEqual(metrics_view(request).status_code, 200)
+        request.user = User(email="bob@example.com")
+        with self.assertRaises(PermissionDenied):
+            metrics_view(request)
+
+    def test_token_reads_typed_component_stats(self):
+        res = metrics_view(self.request(HTTP_AUTHORIZATION="Bearer scraper"))
+        body = res.content.decode()
+        self.assertIn("# TYPE azure_auth_graph_cache_hits counter", body)
+        self.assertIn("# TYPE azure_auth_graph_cache_entries gauge", body)
+        names = [
+            line.split()[2] for line in body.splitlines() if line.startswith("# TYPE")
+        ]
+        self.assertEqual(len(names), len(set(names)))
@@ -0,0 +1,37 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase, mock
+
+from azure_auth.msal_pool import MsalAppPool
+
+AUTHORITY = "https://login.microsoftonline.com/tenant"
+
+
+class MsalAppPoolTest(TestCase):
+    def test_concurrent_gets_build_one_application(self):
+        pool = MsalAppPool()
+        built = []
+        started = threading.Barrier(8)
+
+        def build(cache, authority):
+            # Authority discovery is slow, callers would pile up behind it
+            time.sleep(0.05)
+            built.append(authority)
+            return object()
+
+        def get():
+            started.wait()
+            return pool.get(authority=AUTHORITY)
+
+        with mock.patch.object(pool, "_build", side_effect=build):
+            with ThreadPoolExecutor(8) as executor:
+                apps = [f.result() for f in [executor.submit(get) for _ in range(8)]]
+        self.assertEqual(built, [AUTHORITY])
+        self.assertEqual(len({id(app) for app in apps}), 1)
+
+    def test_applications_with_a_token_cache_are_not_shared(self):
+        pool = MsalAppPool()
+        with mock.patch.object(pool, "_build", side_effect=lambda *args: object()):
+            cache = object()
+            self.assertIsNot(pool.get(cache, AUTHORITY), pool.get(cache, AUTHORITY))
@@ -0,0 +1,132 @@
+import json
+import os
+import uuid
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TransactionTestCase
+
+from azure_auth.backends import _version_key
+from azure_auth.models import User, UserPermissionIndex
+from azure_auth.permissions import ROLE_CACHE_PREFIX
+from azure_auth.response_cache import get_response_cache
+
+PAYLOADS = os.path.join(os.path.dirname(__file__), "notifications")
+CLIENT_STATE = "recorded-client-state"
+UPDATED = "2d0e4c5a-5b5e-4e53-9c9e-0f6b1a1f2c11"
+DELETED = "3b9d1f6e-8c2a-4f1b-a7d4-5e6f7a8b9c0d"
+MEMBER = "4c8e2a1b-7d3f-4e6a-9b5c-0d1e2f3a4b5c"
+GROUP = "9e8d7c6b-5a4f-4e3d-8c2b-1a0f9e8d7c6b"
+SUBSCRIPTION = "7f105c7d-2dc5-4530-97cd-4e7ae6534c07"
+
+
+def payload(name):
+    with open(os.path.join(PAYLOADS, f"{name}.json")) as f:
+        return f.read()
+
+
+class Response:
+    def __init__(self, body):
+        self.status_code = 200
+        self.headers = {}
+        self.content = json.dumps(body).encode()
+
+
+class UserApi:
+    """Answers the Graph reads made while applying notifications."""
+
+    def get_many(self, ids, select=None):
+        return {
+            user_id: {
+                "id": user_id,
+                "userPrincipalName": "ann.lee@example.com",
+                "givenName": "Annie",
+                "surname": "Lee",
+                "accountEnabled": True,
+            }
+            for user_id in ids
+        }
+
+    def transitive_member_of_many(self, ids):
+        return {user_id: [GROUP] for user_id in ids}
+
+
+class NotificationViewTest(TransactionTestCase):
+    def setUp(self):
+        self.api = mock.Mock(user=UserApi())
+        patchers = [
+            mock.patch("azure_auth.notifications.GraphApi", return_value=self.api),
+            mock.patch.dict(
+                "azure_auth.settings.AZURE_AUTH",
+                {
+                    "GRAPH_NOTIFICATION_CLIENT_STATE": CLIENT_STATE,
+                    "GRAPH_JOBS": False,
+                    "PERMISSION_MAP": {GROUP: ["azure_auth.view_user"]},
+                },
+            ),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(cache.clear)
+        self.addCleanup(get_response_cache().clear)
+        for pk, email in (
+            (UPDATED, "ann@example.com"),
+            (DELETED, "bob@example.com"),
+            (MEMBER, "cid@example.com"),
+        ):
+            User.objects.create(azure_object_id=pk, email=email, first_name="x")
+            # Cached user snapshot, directory roles and Graph response
+            cache.set(_version_key(uuid.UUID(pk)), "before", None)
+            cache.set(ROLE_CACHE_PREFIX + pk, {"roles": [], "fetched_at": 0})
+            get_response_cache().set(
+                f"https://graph.microsoft.com/v1.0/users/{pk}", Response({"id": pk})
+            )
+
+    def post(self, body, **params):
+        query = "".join(f"?{key}={value}" for key, value in params.items())
+        return self.client.post(
+            f"/notifications{query}", body, content_type="application/json"
+        )
+
+    def assertInvalidated(self, pk):
+        self.assertNotEqual(cache.get(_version_key(uuid.UUID(pk))), "before")
+        self.assertIsNone(cache.get(ROLE_CACHE_PREFIX + pk))
+        self.assertIsNone(
+            get_response_cache().get(f"https://graph.microsoft.com/v1.0/users/{pk}")
+        )
+
+    def test_validation_handshake(self):
+        response = self.post("", validationToken="token-from-graph")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/plain")
+        self.assertEqual(response.content, b"token-from-graph")
+
+    def test_invalid_client_state_is_refused(self):
+        body = payload("users").replace(CLIENT_STATE, "forged")
+        self.assertEqual(self.post(body).status_code, 403)
+        self.assertEqual(User.objects.get(pk=UPDATED).email, "ann@example.com")
+        self.assertEqual(cache.get(_version_key(uuid.UUID(UPDATED))), "before")
+
+    def test_updated_and_deleted_users(self):
+        self.assertEqual(self.post(payload("users")).status_code, 202)
+        updated = User.objects.get(pk=UPDATED)
+        self.assertEqual(
+            (updated.email, updated.first_name), ("ann.lee@example.com", "Annie")
+        )
+        # Deleted users stay restorable, they are only deactivated
+        self.assertFalse(User.objects.get(pk=DELETED).is_active)
+        self.assertInvalidated(UPDATED)
+        self.assertInvalidated(DELETED)
+        self.assertEqual(cache.get(_version_key(uuid.UUID(MEMBER))), "before")
+
+    def test_group_membership_change(self):
+        self.assertEqual(self.post(payload("groups")).status_code, 202)
+        index = UserPermissionIndex.objects.get(pk=MEMBER)
+        self.assertEqual(index.groups, [GROUP])
+        self.assertEqual(index.permissions, ["azure_auth.view_user"])
+        self.assertInvalidated(MEMBER)
+
+    def test_lifecycle_event(self):
+        self.assertEqual(self.post(payload("lifecycle")).status_code, 202)
+        self.api.subscriptions.reauthorize.assert_called_once_with(SUBSCRIPTION)
@@ -0,0 +1,33 @@
+import uuid
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from azure_auth.models import User, UserPermissionIndex
+from azure_auth.permission_index import PermissionIndexSync
+
+
+class PermissionIndexSyncTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            azure_object_id=uuid.uuid4(), email="ann@example.com", first_name="Ann"
+        )
+        self.api = mock.Mock()
+
+    def test_graph_is_called_outside_the_transaction(self):
+        depth = []
+
+        def memberships(pks):
+            depth.append(len(connection.savepoint_ids))
+            return {pk: ["staff"] for pk in pks}
+
+        self.api.user.transitive_member_of_many.side_effect = memberships
+        # Transactions opened by the sync are savepoints of the test transaction
+        outer = len(connection.savepoint_ids)
+        result = PermissionIndexSync(api=self.api, chunk_size=10).run()
+        self.assertEqual(depth, [outer])
+        self.assertEqual((result.users, result.changed, result.failed), (1, 1, 0))
+        self.assertEqual(
+            UserPermissionIndex.objects.get(pk=self.user.pk).groups, ["staff"]
+        )
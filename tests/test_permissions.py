@@ -0,0 +1,62 @@
+import time
+from unittest import TestCase, mock
+
+from django.core.cache import cache
+
+from azure_auth.permissions import ROLE_CACHE_PREFIX, get_directory_roles
+
+USER_ID = "5f0c7a3e-9b51-4e53-9c9e-0f6b1a1f2c11"
+ADMIN = {"id": "1", "displayName": "User Account Administrator"}
+
+
+class Thread:
+    """Runs the background refresh in the calling thread."""
+
+    def __init__(self, target, daemon=None):
+        self.target = target
+
+    def start(self):
+        self.target()
+
+
+@mock.patch.dict(
+    "azure_auth.settings.AZURE_AUTH",
+    {"ROLE_CACHE_TTL": 300, "ROLE_CACHE_STALE_TTL": 600,},
+)
+class DirectoryRolesTest(TestCase):
+    def setUp(self):
+        self.addCleanup(cache.clear)
+        patcher = mock.patch("azure_auth.graph_api.GraphApi")
+        self.directory_roles = patcher.start().return_value.user.directory_roles
+        self.directory_roles.return_value = [ADMIN]
+        self.addCleanup(patcher.stop)
+
+    def test_roles_are_cached_for_the_ttl(self):
+        self.assertEqual(get_directory_roles(USER_ID), ["User Account Administrator"])
+        self.assertEqual(get_directory_roles(USER_ID), ["User Account Administrator"])
+        self.directory_roles.assert_called_once_with(USER_ID)
+
+    @mock.patch("azure_auth.permissions.threading.Thread", Thread)
+    def test_stale_roles_are_served_while_refreshed(self):
+        cache.set(
+            ROLE_CACHE_PREFIX + USER_ID,
+            {"roles": ["Global Reader"], "fetched_at": time.time() - 400,},
+        )
+        self.assertEqual(get_directory_roles(USER_ID), ["Global Reader"])
+        self.directory_roles.assert_called_once_with(USER_ID)
+        self.assertEqual(get_directory_roles(USER_ID), ["User Account Administrator"])
+
+    @mock.patch("azure_auth.permissions.threading.Thread")
+    def test_one_refresh_of_a_stale_entry_at_a_time(self, thread):
+        cache.set(
+            ROLE_CACHE_PREFIX + USER_ID,
+            {"roles": ["Global Reader"], "fetched_at": time.time() - 400,},
+        )
+        get_directory_roles(USER_ID)
+        get_directory_roles(USER_ID)
+        thread.assert_called_once()
+
+    def test_graph_failures_are_not_cached(self):
+        self.directory_roles.return_value = None
+        self.assertIsNone(get_directory_roles(USER_ID))
+        self.assertIsNone(cache.get(ROLE_CACHE_PREFIX + USER_ID))
@@ -0,0 +1,51 @@
+import tempfile
+import uuid
+from unittest import mock
+
+from django.test import RequestFactory, TestCase
+
+from azure_auth.graph_api import GraphApiError
+from azure_auth.photos import PLACEHOLDER_PHOTO, PhotoCache, PhotoService
+from azure_auth.tokens import TokenAcquisitionError
+from azure_auth.views import photo
+
+
+class PhotoServiceTest(TestCase):
+    def setUp(self):
+        self.api = mock.Mock()
+        self.service = PhotoService(
+            PhotoCache(tempfile.mkdtemp()), sizes=(48,), api=self.api
+        )
+        self.user_id = uuid.uuid4()
+
+    def test_fetch_failures_are_not_cached(self):
+        for error in (
+            ConnectionError("reset"),
+            TokenAcquisitionError({"error": "x"}),
+            GraphApiError({"error": {"message": "x"}}),
+        ):
+            with self.subTest(error=type(error).__name__):
+                self.api.user.photo_etag.side_effect = error
+                image = self.service.get(self.user_id, 48)
+                self.assertTrue(image.placeholder)
+                self.assertTrue(image.transient)
+                self.assertIsNone(self.service.cache.get(self.user_id))
+
+    def test_users_without_photo_are_cached(self):
+        self.api.user.photo_etag.return_value = None
+        self.assertIs(self.service.get(self.user_id, 48), PLACEHOLDER_PHOTO)
+        self.assertEqual(self.service.cache.get(self.user_id)["variants"], {})
+
+
+class PhotoViewTest(TestCase):
+    def test_unavailable_photo_is_not_cached_by_browsers(self):
+        api = mock.Mock()
+        api.user.photo_etag.side_effect = OSError("Graph is down")
+        service = PhotoService(PhotoCache(tempfile.mkdtemp()), sizes=(48,), api=api)
+        request = RequestFactory().get("/photo")
+        request.user = mock.Mock(is_authenticated=True)
+        with mock.patch(
+            "azure_auth.photos.get_photo_service", return_value=service
+        ), mock.patch.dict("azure_auth.views.AZURE_AUTH", {"PHOTO_SIZES": (48,)}):
+            response = photo(request, uuid.uuid4())
+        self.assertEqual(response["Cache-Control"], "private, no-cache")
@@ -0,0 +1,79 @@
+import json
+import os
+import tempfile
+import uuid
+
+from django.test import TestCase
+
+from azure_auth.models import User
+from azure_auth.provisioning import Provisioner
+
+
+class UserApi:
+    """Creates users in memory, failing the usernames of `failing`."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.created = {}
+
+    def create(
+        self, username, first_name, last_name, password, job_title="", return_user=False
+    ):
+        if username in self.failing:
+            raise ConnectionError("connection reset")
+        upn = f"{username}@example.com"
+        if upn in self.created:
+            return {
+                "error": {
+                    "message": "Another object with the same value for "
+                    "property userPrincipalName already exists."
+                }
+            }
+        self.created[upn] = {"id": str(uuid.uuid4()), "userPrincipalName": upn}
+        return self.created[upn]
+
+    def get(self, email):
+        return self.created[email]
+
+
+class Api:
+    def __init__(self, user):
+        self.user = user
+
+
+class ProvisionerTest(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.path = os.path.join(directory, "users.jsonl")
+        with open(self.path, "w") as f:
+            for name in ("ann", "bob", "cid"):
+                f.write(
+                    json.dumps(
+                        {
+                            "username": name,
+                            "first_name": name,
+                            "last_name": "x",
+                            "password": "Password123!",
+                            "job_title": "dev",
+                        }
+                    )
+                    + "\n"
+                )
+
+    def test_failed_rows_are_retried_and_conflicts_resumed(self):
+        users = UserApi(failing={"bob"})
+        result = Provisioner(api=Api(users), workers=2).run(self.path)
+        self.assertEqual(result.created, 2)
+        self.assertEqual([number for number, _ in result.errors], [2])
+        self.assertEqual(User.objects.count(), 2)
+        with open(self.path + ".checkpoint") as f:
+            self.assertEqual(sorted(int(line) for line in f), [1, 3])
+
+        # bob was created by Graph, but the run stopped before recording it
+        os.remove(self.path + ".checkpoint")
+        with open(self.path + ".checkpoint", "w") as f:
+            f.write("1\n")
+        users.failing.clear()
+        result = Provisioner(api=Api(users), workers=2).run(self.path)
+        self.assertEqual((result.created, result.skipped, result.errors), (2, 1, []))
+        self.assertEqual(User.objects.count(), 3)
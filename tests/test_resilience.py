@@ -0,0 +1,192 @@
+import time
+from email.utils import formatdate
+from unittest import TestCase, mock
+
+from azure_auth.resilience import (
+    CircuitBreaker,
+    CircuitOpenResponse,
+    Resilience,
+    ResilientTransport,
+    TokenBucket,
+    parse_retry_after,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+
+
+class Transport:
+    """Answers with the queued statuses, raising the queued exceptions."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return Response(outcome)
+
+
+URL = "https://graph.microsoft.com/v1.0/users"
+ENDPOINT = "GET /v1.0/users"
+
+
+class CircuitBreakerTest(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch("azure_auth.resilience.time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.resilience = Resilience(
+            max_retries=0, failure_threshold=2, reset_timeout=30
+        )
+        self.breaker = self.resilience.breaker(ENDPOINT)
+
+    def open_breaker(self):
+        self.resilience.record(ENDPOINT, status=500)
+        self.resilience.record(ENDPOINT, status=500)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.clock.now += 30
+
+    def test_opens_after_consecutive_failures(self):
+        self.resilience.record(ENDPOINT, status=500)
+        self.assertTrue(self.breaker.allow())
+        self.resilience.record(ENDPOINT, status=500)
+        self.assertFalse(self.breaker.allow())
+
+    def test_success_resets_failures(self):
+        self.resilience.record(ENDPOINT, status=500)
+        self.resilience.record(ENDPOINT, status=200)
+        self.resilience.record(ENDPOINT, status=500)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_single_trial_when_half_open(self):
+        self.open_breaker()
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_successful_trial_closes(self):
+        self.open_breaker()
+        self.breaker.allow()
+        self.resilience.record(ENDPOINT, status=404)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_throttled_or_failed_trial_opens_again(self):
+        for status in (429, 503, 500):
+            with self.subTest(status=status):
+                self.open_breaker()
+                self.breaker.allow()
+                self.resilience.record(ENDPOINT, status=status)
+                self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+                self.assertFalse(self.breaker.allow())
+                self.clock.now += 30
+                self.assertTrue(self.breaker.allow())
+                self.resilience.record(ENDPOINT, status=200)
+
+    def test_throttling_does_not_open_a_closed_breaker(self):
+        for _ in range(5):
+            self.resilience.record(ENDPOINT, status=429)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_unrecorded_trial_times_out(self):
+        self.open_breaker()
+        self.breaker.allow()
+        self.clock.now += 30
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+
+    def test_transport_resolves_trial_on_429(self):
+        self.open_breaker()
+        transport = ResilientTransport(Transport(429, 200), self.resilience)
+        self.assertEqual(transport.get(URL).status_code, 429)
+        self.assertIsInstance(transport.get(URL), CircuitOpenResponse)
+        self.clock.now += 30
+        self.assertEqual(transport.get(URL).status_code, 200)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_transport_resolves_trial_on_unexpected_exception(self):
+        self.open_breaker()
+        transport = ResilientTransport(Transport(ValueError("boom")), self.resilience)
+        with self.assertRaises(ValueError):
+            transport.get(URL)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_transport_retries_connection_errors(self):
+        resilience = Resilience(max_retries=2, backoff_base=0, failure_threshold=5)
+        inner = Transport(ConnectionError("reset"), 200)
+        self.assertEqual(
+            ResilientTransport(inner, resilience).get(URL).status_code, 200
+        )
+        self.assertEqual(inner.calls, 2)
+        self.assertEqual(resilience.stats()["endpoints"][ENDPOINT]["retries"], 1)
+
+    def test_batch_envelopes_are_not_retried(self):
+        # GraphBatch retries the requests of an envelope itself
+        transport = Transport(429, 200)
+        res = ResilientTransport(transport, Resilience(max_retries=3)).request(
+            "POST", "https://graph.microsoft.com/v1.0/$batch"
+        )
+        self.assertEqual((res.status_code, transport.calls), (429, 1))
+
+
+class ParseRetryAfterTest(TestCase):
+    def test_seconds_and_http_dates(self):
+        self.assertEqual(parse_retry_after("7"), 7.0)
+        delay = parse_retry_after(formatdate(time.time() + 30, usegmt=True))
+        self.assertTrue(28 <= delay <= 30, delay)
+        self.assertEqual(
+            parse_retry_after(formatdate(time.time() - 30, usegmt=True)), 0.0
+        )
+
+    def test_missing_or_invalid_values(self):
+        for value in (None, "", "soon", "-1", "inf"):
+            with self.subTest(value=value):
+                self.assertIsNone(parse_retry_after(value))
+
+
+class TokenBucketTest(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch("azure_auth.resilience.time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.bucket = TokenBucket(max_rate=10, capacity=2)
+
+    def test_burst_then_rate(self):
+        self.assertEqual([self.bucket.reserve() for _ in range(2)], [0.0, 0.0])
+        self.assertAlmostEqual(self.bucket.reserve(), 0.1)
+        self.assertAlmostEqual(self.bucket.reserve(), 0.2)
+        self.clock.now += 1
+        # Refilled up to the capacity only
+        self.assertEqual([self.bucket.reserve() for _ in range(2)], [0.0, 0.0])
+
+    def test_rate_is_cut_on_throttling_and_raised_on_success(self):
+        for _ in range(10):
+            self.bucket.on_throttle()
+        self.assertEqual(self.bucket.rate, 1.0)
+        self.bucket.on_success()
+        self.assertAlmostEqual(self.bucket.rate, 1.1)
+        for _ in range(200):
+            self.bucket.on_success()
+        self.assertEqual(self.bucket.rate, 10.0)
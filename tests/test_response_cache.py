@@ -0,0 +1,166 @@
+import asyncio
+import json
+from unittest import TestCase, mock
+
+import httpx
+
+from django.core.cache import cache as default_cache
+
+from azure_auth.async_graph_api import AsyncGraphApi
+from azure_auth.response_cache import CachingTransport, ResponseCache
+
+USER_ID = "5f0c7a3e-9b51-4e53-9c9e-0f6b1a1f2c11"
+USER_URL = f"https://graph.microsoft.com/v1.0/users/{USER_ID}"
+
+
+class Response:
+    def __init__(self, body, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = json.dumps(body).encode()
+
+
+class Transport:
+    def __init__(self, body, status_code=200, headers=None):
+        self.response = Response(body, status_code, headers)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        return self.response
+
+
+class ResponseCacheTest(TestCase):
+    def test_evicts_least_recently_used_entries(self):
+        cache = ResponseCache(max_entries=2)
+        for name in ("a", "b", "c"):
+            cache.set(f"https://graph/{name}", Response({"name": name}))
+        self.assertIsNone(cache.get("https://graph/a"))
+        self.assertIsNotNone(cache.get("https://graph/c"))
+
+    def test_bounded_by_bytes(self):
+        body = {"value": "x" * 100}
+        size = len(json.dumps(body))
+        cache = ResponseCache(max_bytes=size * 8)
+        for number in range(10):
+            cache.set(f"https://graph/{number}", Response(body))
+        self.assertEqual(cache.stats()["entries"], 8)
+        self.assertEqual(cache.stats()["bytes"], size * 8)
+        self.assertIsNone(cache.get("https://graph/0"))
+
+    def test_oversized_responses_are_not_cached(self):
+        cache = ResponseCache(max_bytes=800)
+        self.assertIsNone(cache.set("https://graph/big", Response({"v": "x" * 100})))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_invalidation_follows_other_identifiers(self):
+        cache = ResponseCache()
+        cache.set(USER_URL, Response({"id": USER_ID, "userPrincipalName": "ann@x.com"}))
+        upn_key = "https://graph.microsoft.com/v1.0/users/ann@x.com"
+        cache.set(upn_key, Response({"id": USER_ID, "userPrincipalName": "ann@x.com"}))
+        cache.invalidate(USER_ID)
+        self.assertIsNone(cache.get(USER_URL))
+        self.assertIsNone(cache.get(upn_key))
+        self.assertEqual(cache.stats()["bytes"], 0)
+
+    def test_shared_tier_invalidated_by_another_process(self):
+        self.addCleanup(default_cache.clear)
+        writer, reader = (
+            ResponseCache(cache_alias="default"),
+            ResponseCache(cache_alias="default"),
+        )
+        upn_key = "https://graph.microsoft.com/v1.0/users/ann@x.com"
+        writer.set(upn_key, Response({"id": USER_ID, "userPrincipalName": "ann@x.com"}))
+        self.assertIsNotNone(ResponseCache(cache_alias="default").get(upn_key))
+        # The invalidating process never saw the entry read by principal name
+        reader.invalidate(USER_ID)
+        self.assertIsNone(ResponseCache(cache_alias="default").get(upn_key))
+
+    def test_local_hits_invalidated_by_another_process(self):
+        self.addCleanup(default_cache.clear)
+        local, other = (
+            ResponseCache(cache_alias="default"),
+            ResponseCache(cache_alias="default"),
+        )
+        local.set(USER_URL, Response({"id": USER_ID}))
+        self.assertIsNotNone(local.get(USER_URL))
+        other.invalidate(USER_ID)
+        self.assertIsNone(local.get(USER_URL))
+        self.assertEqual(local.stats()["entries"], 0)
+
+
+class CachingTransportTest(TestCase):
+    def test_serves_fresh_entries(self):
+        inner = Transport({"id": USER_ID})
+        transport = CachingTransport(inner, ResponseCache())
+        transport.get(USER_URL)
+        self.assertTrue(transport.get(USER_URL).from_cache)
+        self.assertEqual(len(inner.calls), 1)
+
+    def test_revalidates_stale_entries_with_etag(self):
+        cache = ResponseCache(default_ttl=0)
+        inner = Transport({"id": USER_ID}, headers={"ETag": 'W/"1"'})
+        transport = CachingTransport(inner, cache)
+        transport.get(USER_URL)
+        inner.response = Response(None, status_code=304)
+        res = transport.get(USER_URL)
+        self.assertEqual(res.json(), {"id": USER_ID})
+        self.assertEqual(inner.calls[-1][2]["headers"]["If-None-Match"], 'W/"1"')
+
+    def test_delta_queries_are_not_cached(self):
+        inner = Transport({"value": []})
+        transport = CachingTransport(inner, ResponseCache())
+        for url in (
+            "https://graph.microsoft.com/v1.0/users/delta?$select=id",
+            "https://graph.microsoft.com/v1.0/users/delta()?$deltatoken=abc",
+        ):
+            transport.get(url)
+            transport.get(url)
+        self.assertEqual(len(inner.calls), 4)
+
+    def test_writes_invalidate(self):
+        cache = ResponseCache()
+        inner = Transport({"id": USER_ID})
+        transport = CachingTransport(inner, cache)
+        transport.get(USER_URL)
+        inner.response = Response(None, status_code=204)
+        transport.patch(USER_URL, json={})
+        self.assertIsNone(cache.get(cache.key(USER_URL)))
+
+    def test_creates_invalidate_collection_pages(self):
+        cache = ResponseCache()
+        users = "https://graph.microsoft.com/v1.0/users?$top=10"
+        inner = Transport({"value": [{"id": USER_ID}]})
+        transport = CachingTransport(inner, cache)
+        transport.get(users)
+        self.assertIsNotNone(cache.get(cache.key(users)))
+        inner.response = Response({"id": USER_ID}, status_code=201)
+        transport.post("https://graph.microsoft.com/v1.0/users", json={})
+        self.assertIsNone(cache.get(cache.key(users)))
+
+
+class Tokens:
+    def peek(self):
+        return "token"
+
+
+class AsyncWriteInvalidationTest(TestCase):
+    def test_async_writes_invalidate_cached_reads(self):
+        cache = ResponseCache()
+        key = cache.key(USER_URL)
+        cache.set(
+            key, Response({"id": USER_ID, "userPrincipalName": "ann@example.com"})
+        )
+        other = cache.key("https://graph.microsoft.com/v1.0/users/ann@example.com")
+        cache.set(other, Response({"id": USER_ID}))
+
+        client = httpx.AsyncClient(
+            transport=httpx.MockTransport(lambda request: httpx.Response(204))
+        )
+        api = AsyncGraphApi(client=client)
+        api.tokens = Tokens()
+        with mock.patch("azure_auth.response_cache._response_cache", cache):
+            res = asyncio.run(api.user.update(USER_ID, "ann", "Ann", "Lee"))
+        self.assertIs(res, True)
+        self.assertIsNone(cache.get(key))
+        self.assertIsNone(cache.get(other))
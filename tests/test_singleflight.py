@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from azure_auth.singleflight import CoalescingTransport, SingleFlight, request_key
+
+USERS_URL = "https://graph.microsoft.com/v1.0/users"
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+class Transport:
+    """Blocks every request until released."""
+
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url))
+        self.release.wait(5)
+        return object()
+
+
+class SingleFlightTest(TestCase):
+    def test_concurrent_identical_reads_share_one_request(self):
+        inner = Transport()
+        transport = CoalescingTransport(inner, SingleFlight())
+        headers = {"Authorization": "Bearer token"}
+        with ThreadPoolExecutor(4) as executor:
+            futures = [
+                executor.submit(transport.get, USERS_URL, headers=headers)
+                for _ in range(4)
+            ]
+            wait_for(lambda: transport.single_flight.stats()["calls"] == 4)
+            inner.release.set()
+            responses = [f.result() for f in futures]
+        self.assertEqual(len(inner.calls), 1)
+        self.assertEqual(len({id(response) for response in responses}), 1)
+        self.assertEqual(transport.single_flight.stats()["deduplicated"], 3)
+
+    def test_writes_and_other_callers_are_not_coalesced(self):
+        inner = Transport()
+        inner.release.set()
+        transport = CoalescingTransport(inner, SingleFlight())
+        transport.post(USERS_URL)
+        transport.post(USERS_URL)
+        self.assertEqual(len(inner.calls), 2)
+        self.assertNotEqual(
+            request_key("GET", USERS_URL, headers={"Authorization": "Bearer ann"}),
+            request_key("GET", USERS_URL, headers={"Authorization": "Bearer bob"}),
+        )
+
+    def test_errors_reach_every_waiter(self):
+        flight, started, release = SingleFlight(), threading.Event(), threading.Event()
+
+        def fail():
+            started.set()
+            release.wait(5)
+            raise ValueError("throttled")
+
+        with ThreadPoolExecutor(2) as executor:
+            leader = executor.submit(flight.do, "key", fail)
+            started.wait(5)
+            follower = executor.submit(flight.do, "key", fail)
+            wait_for(lambda: flight.stats()["deduplicated"] == 1)
+            release.set()
+            for future in (leader, follower):
+                with self.assertRaisesRegex(ValueError, "throttled"):
+                    future.result()
+
+    def test_tasks_of_a_loop_share_one_call(self):
+        flight, calls = SingleFlight(), []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"id": "ann"}
+
+        async def main():
+            return await asyncio.gather(*(flight.ado("key", fetch) for _ in range(5)))
+
+        results = asyncio.run(main())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"id": "ann"}] * 5)
@@ -0,0 +1,28 @@
+import uuid
+from unittest import mock
+
+from django.test import TestCase
+
+from azure_auth.models import User
+from azure_auth.sync import DirectorySync
+
+
+class DirectorySyncTest(TestCase):
+    def test_created_counts_inserted_rows_only(self):
+        # A stale local row holding the email of a recreated directory user
+        User.objects.create(
+            azure_object_id=uuid.uuid4(), email="ann@example.com", first_name="Ann"
+        )
+        changed = {
+            str(uuid.uuid4()): {
+                "userPrincipalName": "ann@example.com",
+                "givenName": "Ann",
+            },
+            str(uuid.uuid4()): {
+                "userPrincipalName": "bob@example.com",
+                "givenName": "Bob",
+            },
+        }
+        result = DirectorySync(api=mock.Mock(), mirror=False).apply_changes(changed, {})
+        self.assertEqual(result.created, 1)
+        self.assertEqual(User.objects.count(), 2)
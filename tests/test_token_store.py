@@ -0,0 +1,71 @@
+import json
+import logging
+import time
+from unittest import TestCase
+
+from django.core.cache import caches
+
+from azure_auth.token_refresh import TokenRefresher
+from azure_auth.token_store import BaseTokenStore, CacheTokenStore, prune
+
+
+def token_cache(expires_on):
+    account = "uid.tid"
+    return json.dumps(
+        {
+            "Account": {account: {"home_account_id": account}},
+            "AccessToken": {
+                "at": {"home_account_id": account, "expires_on": str(int(expires_on))}
+            },
+            "RefreshToken": {"rt": {"home_account_id": account}},
+        }
+    )
+
+
+class CacheTokenStoreTest(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+        self.store = CacheTokenStore()
+
+    def test_user_ids_lists_stored_users(self):
+        self.store.save("ann", token_cache(time.time() + 60))
+        self.store.save("bob", token_cache(time.time() + 3600))
+        self.assertEqual(sorted(self.store.user_ids()), ["ann", "bob"])
+        self.store.delete("bob")
+        self.assertEqual(list(self.store.user_ids()), ["ann"])
+        # An entry evicted by the cache is not listed
+        caches["default"].delete(self.store._key("ann"))
+        self.assertEqual(list(self.store.user_ids()), [])
+
+    def test_expiring_scans_the_indexed_users(self):
+        now = time.time()
+        self.store.save("ann", token_cache(now + 60))
+        self.store.save("bob", token_cache(now + 3600))
+        self.assertEqual(list(self.store.expiring(now, now + 300)), ["ann"])
+
+
+class TokenRefresherTest(TestCase):
+    def test_stores_without_user_ids_are_skipped(self):
+        refresher = TokenRefresher(store=BaseTokenStore(), margin=300, workers=1)
+        with self.assertLogs("azure_auth.token_refresh", logging.WARNING):
+            result = refresher.run()
+        self.assertEqual(result.due, 0)
+
+
+class PruneTest(TestCase):
+    def test_drops_expired_tokens_and_signed_out_accounts(self):
+        now = int(time.time())
+        data = {
+            "Account": {"a": {"home_account_id": "a"}, "b": {"home_account_id": "b"}},
+            "IdToken": {"a": {"home_account_id": "a"}, "b": {"home_account_id": "b"}},
+            "AccessToken": {
+                "live": {"home_account_id": "a", "expires_on": str(now + 600)},
+                "expired": {"home_account_id": "a", "expires_on": str(now - 1)},
+            },
+            "RefreshToken": {"rt": {"home_account_id": "a"}},
+        }
+        pruned = json.loads(prune(json.dumps(data)))
+        self.assertEqual(list(pruned["AccessToken"]), ["live"])
+        self.assertEqual(list(pruned["Account"]), ["a"])
+        self.assertEqual(list(pruned["IdToken"]), ["a"])
+        self.assertEqual(list(pruned["RefreshToken"]), ["rt"])
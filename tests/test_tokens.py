@@ -0,0 +1,72 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from django.core.cache import caches
+
+from azure_auth.tokens import AppTokenStore, TokenAcquisitionError
+
+SCOPES = ["https://graph.microsoft.com/.default"]
+
+
+class App:
+    """Client credentials flow of a ConfidentialClientApplication."""
+
+    def __init__(self, delay=0, result=None):
+        self.delay = delay
+        self.result = result
+        self.calls = 0
+
+    def acquire_token_for_client(self, scopes):
+        self.calls += 1
+        time.sleep(self.delay)
+        return self.result or {
+            "access_token": f"token-{self.calls}",
+            "expires_in": 3600,
+        }
+
+
+class AppTokenStoreTest(TestCase):
+    def test_concurrent_callers_share_one_refresh(self):
+        app = App(delay=0.05)
+        store = AppTokenStore(SCOPES, app_factory=lambda: app)
+        started = threading.Barrier(8)
+
+        def get_token():
+            started.wait()
+            return store.get_token()
+
+        with ThreadPoolExecutor(8) as executor:
+            tokens = [
+                f.result() for f in [executor.submit(get_token) for _ in range(8)]
+            ]
+        self.assertEqual(app.calls, 1)
+        self.assertEqual(set(tokens), {"token-1"})
+        self.assertEqual(store.stats()["misses"], 1)
+
+    def test_current_token_is_served_while_another_caller_refreshes(self):
+        app = App()
+        store = AppTokenStore(SCOPES, refresh_margin=300, app_factory=lambda: app)
+        # Within the refresh margin, but not expired yet
+        store._token, store._expires_at = "current", time.time() + 60
+        with store._lock:
+            self.assertEqual(store.get_token(), "current")
+        self.assertEqual(app.calls, 0)
+        self.assertEqual(store.get_token(), "token-1")
+
+    def test_processes_share_the_token_through_the_cache(self):
+        self.addCleanup(caches["default"].clear)
+        app = App()
+        first = AppTokenStore(SCOPES, cache_alias="default", app_factory=lambda: app)
+        second = AppTokenStore(SCOPES, cache_alias="default", app_factory=lambda: app)
+        self.assertEqual(first.get_token(), second.get_token())
+        self.assertEqual(app.calls, 1)
+        self.assertEqual(second.stats()["shared_hits"], 1)
+
+    def test_refused_requests_raise(self):
+        app = App(result={"error": "invalid_client", "error_description": "Bad secret"})
+        store = AppTokenStore(SCOPES, app_factory=lambda: app)
+        with self.assertRaisesRegex(TokenAcquisitionError, "Bad secret"):
+            store.get_token()
+        self.assertEqual(store.stats()["errors"], 1)
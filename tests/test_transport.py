@@ -0,0 +1,75 @@
+from unittest import TestCase, mock
+
+from azure_auth import transport as transport_module
+from azure_auth.graph_api import GraphApi
+from azure_auth.transport import (
+    GraphTransport,
+    build_transport,
+    get_transport,
+    set_transport,
+)
+
+
+class RecordingTransport:
+    def __init__(self, **options):
+        self.options = options
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class GraphTransportTest(TestCase):
+    def test_session_is_pooled(self):
+        transport = GraphTransport(pool_connections=4, pool_maxsize=32, pool_block=True)
+        adapter = transport.session.get_adapter(
+            "https://graph.microsoft.com/v1.0/users"
+        )
+        self.assertEqual(adapter._pool_connections, 4)
+        self.assertEqual(adapter._pool_maxsize, 32)
+        self.assertTrue(adapter._pool_block)
+        self.assertEqual(transport.session.headers["Accept-Encoding"], "gzip, deflate")
+
+    def test_requests_default_to_the_configured_timeouts(self):
+        transport = GraphTransport(connect_timeout=2, read_timeout=9)
+        with mock.patch.object(transport.session, "request") as request:
+            transport.get("https://graph.microsoft.com/v1.0/users")
+            transport.post("https://graph.microsoft.com/v1.0/users", timeout=1)
+        self.assertEqual(request.call_args_list[0][1]["timeout"], (2, 9))
+        self.assertEqual(request.call_args_list[1][1]["timeout"], 1)
+
+
+@mock.patch.dict(
+    "azure_auth.settings.AZURE_AUTH",
+    {
+        "GRAPH_TRANSPORT": "tests.test_transport.RecordingTransport",
+        "GRAPH_RESILIENCE": False,
+        "GRAPH_COALESCE": False,
+        "GRAPH_CACHE": False,
+        "METRICS_ENABLED": False,
+        "HTTP_POOL_MAXSIZE": 50,
+    },
+)
+class ProcessTransportTest(TestCase):
+    def setUp(self):
+        self.addCleanup(set_transport, None)
+        set_transport(None)
+
+    def test_built_from_the_settings(self):
+        transport = build_transport()
+        self.assertIsInstance(transport, RecordingTransport)
+        self.assertEqual(transport.options["pool_maxsize"], 50)
+
+    def test_graph_api_instances_share_the_transport(self):
+        with mock.patch("azure_auth.graph_api.get_app_token_store"):
+            first, second = GraphApi(), GraphApi()
+        self.assertIs(first.transport, second.transport)
+        self.assertIs(first.transport, get_transport())
+
+    def test_replaced_transports_are_closed(self):
+        previous = get_transport()
+        stub = RecordingTransport()
+        set_transport(stub)
+        self.assertTrue(previous.closed)
+        self.assertIs(get_transport(), stub)
+        self.assertIs(transport_module._delegated_transport, stub)